@@ -75,6 +75,37 @@ class CreatePairwiseSerializer(WalletAccessSerializer):
         instance['metadata'] = validated_data.get('metadata')
 
 
+class PairwiseSearchSerializer(WalletAccessSerializer):
+
+    query = serializers.JSONField(required=False, default=dict)
+    limit = serializers.IntegerField(required=False, default=100, min_value=1, max_value=1000)
+    cursor = serializers.CharField(max_length=128, required=False, allow_null=True, default=None)
+
+    def update(self, instance, validated_data):
+        super().update(instance, validated_data)
+        instance['query'] = validated_data.get('query')
+        instance['limit'] = validated_data.get('limit')
+        instance['cursor'] = validated_data.get('cursor')
+
+
+class DIDBulkCreateSerializer(WalletAccessSerializer):
+
+    count = serializers.IntegerField(required=False, min_value=1, max_value=10000)
+    items = serializers.ListField(child=serializers.DictField(), required=False, max_length=10000)
+    keys_only = serializers.BooleanField(required=False, default=False)
+
+    def validate(self, data):
+        if ('count' in data) == ('items' in data):
+            raise ValidationError('Expected "count" or "items"')
+        return super().validate(data)
+
+    def update(self, instance, validated_data):
+        super().update(instance, validated_data)
+        instance['count'] = validated_data.get('count')
+        instance['items'] = validated_data.get('items')
+        instance['keys_only'] = validated_data.get('keys_only')
+
+
 class DIDSerializer(serializers.Serializer):
 
     did = serializers.CharField(max_length=1024, required=True)
@@ -377,6 +408,17 @@ class PeerMessageSerializer(BaseMessageSerializer):
     their_did = serializers.CharField(max_length=1024, required=True)
 
 
+class BroadcastMessageSerializer(BaseMessageSerializer):
+    their_dids = serializers.ListField(child=serializers.CharField(max_length=1024), required=False)
+    query = serializers.JSONField(required=False)
+    fan_out = serializers.IntegerField(required=False, min_value=1, max_value=256)
+
+    def validate(self, data):
+        if ('their_dids' in data) == ('query' in data):
+            raise ValidationError('Expected "their_dids" or "query"')
+        return super().validate(data)
+
+
 class EndpointMessageSerializer(BaseMessageSerializer):
     my_verkey = serializers.CharField(max_length=128, required=False, allow_null=True, default=None)
     their_verkey = serializers.CharField(max_length=128, required=True)
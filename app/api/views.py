@@ -10,6 +10,7 @@ from rest_framework_extensions.mixins import NestedViewSetMixin
 from rest_framework.renderers import JSONRenderer, TemplateHTMLRenderer
 from rest_framework.decorators import action
 from django.db import transaction, connection
+from django.http import StreamingHttpResponse
 
 import core.aries_rfcs.features.feature_0036_issue_credential.feature as feature_0036
 import core.aries_rfcs.features.feature_0037_present_proof.feature as feature_0037
@@ -19,9 +20,12 @@ from core.utils import *
 from core.permissions import *
 from core.ledger import *
 from core.codec import encode
-from core.sync2async import run_async
+from core.sync2async import run_async, Scheduler
 from core.proofs import *
+from core.broadcast import broadcast
+from core.outbox import outbox_stats
 from core.base import EndpointTransport, ReadWriteTimeoutError
+from transport.resolver import resolver_stats
 from .serializers import *
 from .exceptions import *
 from .models import *
@@ -29,6 +33,8 @@ from .models import *
 
 WALLET_AGENT_TIMEOUT = settings.INDY['WALLET_SETTINGS']['TIMEOUTS']['AGENT_REQUEST']
 LEDGER_READ_TIMEOUT = settings.INDY['LEDGER']['TIMEOUTS']['READ']
+# Count of pairwise fetched from wallet agent in single call when whole list is requested
+PAIRWISE_PAGE_SIZE = 100
 
 
 async def ensure_wallet_exists(name, pass_phrase):
@@ -76,6 +82,21 @@ class MaintenanceViewSet(viewsets.GenericViewSet):
     def version(self, request):
         return Response(settings.VERSION)
 
+    @action(methods=["GET"], detail=False)
+    def resolver_stats(self, request):
+        """Hit rate of endpoints and wallets lookups cache"""
+        return Response(resolver_stats())
+
+    @action(methods=["GET"], detail=False)
+    def scheduler_stats(self, request):
+        """Queue depth and lag of event loops running coroutines of sync views"""
+        return Response(Scheduler.stats())
+
+    @action(methods=["GET"], detail=False)
+    def outbox_stats(self, request):
+        """Delivery counters, backlog and delivery latency per outbox worker"""
+        return Response(run_async(outbox_stats()))
+
     @action(methods=["GET"], detail=False)
     def logout(self, request):
         """Logout for current BasicAuth/Session based session"""
@@ -105,7 +126,7 @@ class AdminWalletViewSet(viewsets.mixins.RetrieveModelMixin,
             return WalletAccessSerializer
         elif self.action in ['create', 'ensure_exists']:
             return WalletCreateSerializer
-        elif self.action == 'is_open':
+        elif self.action in ['is_open', 'live']:
             return EmptySerializer
         else:
             raise NotImplemented()
@@ -209,6 +230,13 @@ class AdminWalletViewSet(viewsets.mixins.RetrieveModelMixin,
         value = run_async(WalletAgent.is_open(agent_name=wallet.uid))
         return Response(status=status.HTTP_200_OK, data=dict(is_open=value))
 
+    @action(methods=['GET'], detail=False)
+    def live(self, request, *args, **kwargs):
+        uids = list(self.get_queryset().values_list('uid', flat=True))
+        heartbeats = run_async(WalletAgent.live_agents(uids))
+        data = [dict(uid=uid, **heartbeat) for uid, heartbeat in heartbeats.items()]
+        return Response(status=status.HTTP_200_OK, data=data)
+
     @action(methods=['POST'], detail=False)
     def ensure_exists(self, request, *args, **kwargs):
         pass_phrase = extract_pass_phrase(request)
@@ -249,26 +277,63 @@ class PairwiseViewSet(NestedViewSetMixin,
             return CreatePairwiseSerializer
         elif self.action == 'did_for_key':
             return VerkeySerializer
+        elif self.action == 'search':
+            return PairwiseSearchSerializer
         else:
             return super().get_serializer_class()
 
     @action(methods=['POST'], detail=False)
     def all(self, request, *args, **kwargs):
+        """Deprecated: use search to page through pairwise
+
+        List is fetched from wallet agent page by page, so every agent call is bounded
+        """
         wallet = self.get_wallet()
-        # serializer = WalletAccessSerializer(data=request.data)
-        # serializer.is_valid(raise_exception=True)
-        # credentials = serializer.create(serializer.validated_data)
+        pass_phrase = extract_pass_phrase(request)
+        ret = []
+        cursor = None
+        try:
+            while True:
+                page = run_async(
+                    WalletAgent.search_pairwise(
+                        agent_name=wallet.uid,
+                        pass_phrase=pass_phrase,
+                        limit=PAIRWISE_PAGE_SIZE,
+                        cursor=cursor
+                    ),
+                    timeout=WALLET_AGENT_TIMEOUT
+                )
+                ret.extend(page['items'])
+                cursor = page['cursor']
+                if not cursor:
+                    break
+        except AgentTimeOutError:
+            raise AgentTimeoutError()
+        else:
+            return Response(data=ret)
+
+    @action(methods=['POST'], detail=False)
+    def search(self, request, *args, **kwargs):
+        wallet = self.get_wallet()
+        serializer = PairwiseSearchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.create(serializer.validated_data)
         pass_phrase = extract_pass_phrase(request)
         try:
             ret = run_async(
-                WalletAgent.list_pairwise(
+                WalletAgent.search_pairwise(
                     agent_name=wallet.uid,
-                    pass_phrase=pass_phrase
+                    pass_phrase=pass_phrase,
+                    query=params['query'],
+                    limit=params['limit'],
+                    cursor=params['cursor']
                 ),
                 timeout=WALLET_AGENT_TIMEOUT
             )
         except AgentTimeOutError:
             raise AgentTimeoutError()
+        except BaseWalletException as e:
+            raise exceptions.ValidationError(e.error_message)
         else:
             return Response(data=ret)
 
@@ -376,6 +441,8 @@ class DIDViewSet(NestedViewSetMixin, viewsets.GenericViewSet):
             return WalletAccessSerializer
         elif self.action == 'create_and_store_my_did':
             return DIDCreateSerializer
+        elif self.action == 'create_many':
+            return DIDBulkCreateSerializer
         else:
             return super().get_serializer_class()
 
@@ -423,6 +490,55 @@ class DIDViewSet(NestedViewSetMixin, viewsets.GenericViewSet):
             entity['verkey'] = verkey
             return Response(data=entity, status=status.HTTP_201_CREATED)
 
+    @action(methods=['POST'], detail=False)
+    def create_many(self, request, *args, **kwargs):
+        """Create DIDs or keys, results are streamed as JSON line per item"""
+        wallet = self.get_wallet()
+        serializer = DIDBulkCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.create(serializer.validated_data)
+        pass_phrase = extract_pass_phrase(request)
+        items = params.get('items') or [dict() for _ in range(params['count'])]
+        chunk_size = WalletAgent.CREATE_MANY_CHUNK
+
+        def create_chunk(offset: int):
+            return run_async(
+                WalletAgent.create_many(
+                    agent_name=wallet.uid,
+                    pass_phrase=pass_phrase,
+                    items=items[offset:offset + chunk_size],
+                    keys_only=params['keys_only']
+                ),
+                timeout=WALLET_AGENT_TIMEOUT
+            )
+
+        # First chunk is created before response is started to report access errors with status code
+        try:
+            first = create_chunk(0)
+        except (AgentTimeOutError, TimeoutError):
+            raise AgentTimeoutError()
+        except BaseWalletException as e:
+            raise exceptions.ValidationError(e.error_message)
+
+        def stream():
+            offset = 0
+            results = first
+            while True:
+                for n, result in enumerate(results):
+                    yield json.dumps(dict(index=offset + n, **result)) + '\n'
+                offset += chunk_size
+                if offset >= len(items):
+                    return
+                try:
+                    results = create_chunk(offset)
+                except (BaseWalletException, TimeoutError) as e:
+                    if not isinstance(e, BaseWalletException):
+                        e = AgentTimeOutError()
+                    error = dict(error_code=e.error_code, error_message=e.error_message)
+                    results = [dict(error=error)] * len(items[offset:offset + chunk_size])
+
+        return StreamingHttpResponse(stream(), status=status.HTTP_201_CREATED, content_type='application/x-ndjson')
+
     def get_wallet(self):
         if 'wallet' in self.get_parents_query_dict():
             wallet_uid = self.get_parents_query_dict()['wallet']
@@ -718,6 +834,8 @@ class MessagingViewSet(NestedViewSetMixin, viewsets.GenericViewSet):
             return AuthCryptSerializer
         elif self.action == 'post_to_peer':
             return PeerMessageSerializer
+        elif self.action == 'broadcast':
+            return BroadcastMessageSerializer
         elif self.action == 'issue_credential':
             return IssueCredentialSerializer
         elif self.action == 'stop_issue_credential':
@@ -799,25 +917,32 @@ class MessagingViewSet(NestedViewSetMixin, viewsets.GenericViewSet):
         entity = serializer.create(serializer.validated_data)
         pass_phrase = extract_pass_phrase(request)
         try:
-            info = run_async(
-                WalletAgent.get_pairwise(
+            results = run_async(
+                WalletAgent.batch(
                     agent_name=wallet.uid,
                     pass_phrase=pass_phrase,
-                    their_did=entity['their_did']
+                    commands=[
+                        dict(
+                            command=WalletAgent.COMMAND_GET_PAIRWISE,
+                            kwargs=dict(their_did=entity['their_did'])
+                        ),
+                        dict(
+                            command=WalletAgent.COMMAND_PACK_MESSAGE,
+                            kwargs=dict(
+                                message=entity['message'],
+                                their_ver_key={'$ref': '0.metadata.their_vk'},
+                                my_ver_key={'$ref': '0.metadata.my_vk'}
+                            )
+                        )
+                    ]
                 ),
                 timeout=WALLET_AGENT_TIMEOUT
             )
+            info, encrypted = [batch_item_result(item) for item in results]
             metadata = info['metadata']
-            encrypted = run_async(
-                WalletAgent.pack_message(
-                    agent_name=wallet.uid,
-                    message=entity['message'],
-                    their_ver_key=metadata['their_vk'],
-                    my_ver_key=metadata['my_vk']
-                ),
-                timeout=WALLET_AGENT_TIMEOUT
-            )
-            encrypted = json.loads(encrypted.decode('utf-8'))
+            if isinstance(encrypted, bytes):
+                encrypted = encrypted.decode('utf-8')
+            encrypted = json.loads(encrypted)
             encrypted.update(entity.get('extra', {}))
             transport = EndpointTransport(address=metadata['their_endpoint'])
             stat = run_async(
@@ -832,6 +957,33 @@ class MessagingViewSet(NestedViewSetMixin, viewsets.GenericViewSet):
         else:
             return Response(status=stat)
 
+    @action(methods=['POST'], detail=False)
+    def broadcast(self, request, *args, **kwargs):
+        wallet = self.get_wallet()
+        serializer = BroadcastMessageSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        entity = serializer.create(serializer.validated_data)
+        pass_phrase = extract_pass_phrase(request)
+        try:
+            results = run_async(
+                broadcast(
+                    agent_name=wallet.uid,
+                    pass_phrase=pass_phrase,
+                    message=entity['message'],
+                    their_dids=entity.get('their_dids', None),
+                    query=entity.get('query', None),
+                    extra=entity.get('extra', None),
+                    fan_out=entity.get('fan_out', None)
+                ),
+                timeout=WALLET_AGENT_TIMEOUT
+            )
+        except AgentTimeOutError:
+            raise AgentTimeoutError()
+        except BaseWalletException as e:
+            raise exceptions.ValidationError(detail=e.error_message)
+        else:
+            return Response(data=results)
+
     @action(methods=['POST'], detail=False)
     def issue_credential(self, request, *args, **kwargs):
         wallet = self.get_wallet()
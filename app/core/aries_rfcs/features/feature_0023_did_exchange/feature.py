@@ -9,7 +9,8 @@ import base64
 import indy.crypto
 import core.indy_sdk_utils as indy_sdk_utils
 import core.const
-from core.base import WireMessageFeature, FeatureMeta, WriteOnlyChannel, EndpointTransport
+import core.outbox
+from core.base import WireMessageFeature, FeatureMeta, WriteOnlyChannel
 from core.messages.did_doc import DIDDoc
 from core.messages.message import Message
 from core.messages.errors import ValidationException as MessageValidationException
@@ -29,6 +30,7 @@ class DIDExchange(WireMessageFeature, metaclass=FeatureMeta):
     FAMILY_NAME = "didexchange"
     VERSION = "1.0"
     FAMILY = "did:sov:BzCbsNYhMrjHiqZDTUASHg;spec/" + FAMILY_NAME + "/" + VERSION
+    INBOUND_FAMILIES = (FAMILY, TrustPing.FAMILY)
 
     CONNECTION = 'connection'
     INVITE = FAMILY + "/invitation"
@@ -54,8 +56,11 @@ class DIDExchange(WireMessageFeature, metaclass=FeatureMeta):
         return False
 
     @classmethod
-    async def handle(cls, agent_name: str, wire_message: bytes, my_label: str=None, my_endpoint: str=None) -> bool:
-        unpacked = await WalletAgent.unpack_message(agent_name, wire_message)
+    async def handle(
+            cls, agent_name: str, wire_message: bytes, my_label: str=None, my_endpoint: str=None,
+            unpacked: dict=None
+    ) -> bool:
+        unpacked = unpacked or await WalletAgent.unpack_message(agent_name, wire_message)
         kwargs = json.loads(unpacked['message'])
         message = Message(**kwargs)
         if message.get('@type', None) is None:
@@ -282,8 +287,7 @@ class DIDExchange(WireMessageFeature, metaclass=FeatureMeta):
             logging.exception(str(e))
             raise
         else:
-            transport = EndpointTransport(address=their_endpoint)
-            await transport.send_wire_message(wire_message)
+            await core.outbox.send_wire_message(their_endpoint, wire_message)
 
     @staticmethod
     async def unpack_agent_message(wire_msg_bytes, wallet: WalletConnection):
@@ -751,8 +755,7 @@ class DIDExchange(WireMessageFeature, metaclass=FeatureMeta):
                     their_ver_key=their['connection_key'],
                     my_ver_key=my_vk
                 )
-                transport = EndpointTransport(address=their['endpoint'])
-                await transport.send_wire_message(wire_message)
+                await core.outbox.send_wire_message(their['endpoint'], wire_message)
                 await self.__log('Send', request.to_dict())
             except Exception as e:
                 logging.exception(str(e))
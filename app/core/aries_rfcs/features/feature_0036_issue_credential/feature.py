@@ -11,8 +11,9 @@ from django.utils.timezone import timedelta, now
 import core.indy_sdk_utils as indy_sdk_utils
 import core.codec
 import core.const
+import core.outbox
 from core.models import update_cred_def_meta, update_issuer_schema
-from core.base import WireMessageFeature, FeatureMeta, EndpointTransport, WriteOnlyChannel
+from core.base import WireMessageFeature, FeatureMeta, WriteOnlyChannel
 from core.messages.message import Message
 from core.messages.errors import ValidationException as MessageValidationException
 from core.serializer.json_serializer import JSONSerializer as Serializer
@@ -68,6 +69,7 @@ class IssueCredentialProtocol(WireMessageFeature, metaclass=FeatureMeta):
     FAMILY_NAME = "issue-credential"
     VERSION = "1.1"
     FAMILY = "did:sov:BzCbsNYhMrjHiqZDTUASHg;spec/" + FAMILY_NAME + "/" + VERSION
+    INBOUND_FAMILIES = (FAMILY, "did:sov:BzCbsNYhMrjHiqZDTUASHg;spec/" + FAMILY_NAME + "/1.0", AckMessage.FAMILY)
 
     """Messages"""
     # potential Holder to Issuer (optional). Tells what the Holder hopes to receive.
@@ -105,8 +107,11 @@ class IssueCredentialProtocol(WireMessageFeature, metaclass=FeatureMeta):
     STATE_MACHINE_TTL = 60  # 60 sec
 
     @classmethod
-    async def handle(cls, agent_name: str, wire_message: bytes, my_label: str = None, my_endpoint: str = None) -> bool:
-        unpacked = await WalletAgent.unpack_message(agent_name, wire_message)
+    async def handle(
+            cls, agent_name: str, wire_message: bytes, my_label: str = None, my_endpoint: str = None,
+            unpacked: dict = None
+    ) -> bool:
+        unpacked = unpacked or await WalletAgent.unpack_message(agent_name, wire_message)
         kwargs = json.loads(unpacked['message'])
         message = Message(**kwargs)
         if message.get('@type', None) is None:
@@ -195,8 +200,7 @@ class IssueCredentialProtocol(WireMessageFeature, metaclass=FeatureMeta):
             logging.exception(str(e))
             raise
         else:
-            transport = EndpointTransport(address=context.their_endpoint)
-            await transport.send_wire_message(wire_message)
+            await core.outbox.send_wire_message(context.their_endpoint, wire_message)
             return err_msg
 
     @classmethod
@@ -244,8 +248,7 @@ class IssueCredentialProtocol(WireMessageFeature, metaclass=FeatureMeta):
             logging.exception(str(e))
             raise
         else:
-            transport = EndpointTransport(address=their_endpoint)
-            await transport.send_wire_message(wire_message)
+            await core.outbox.send_wire_message(their_endpoint, wire_message)
 
     @staticmethod
     async def unpack_agent_message(wire_msg_bytes, wallet: WalletConnection):
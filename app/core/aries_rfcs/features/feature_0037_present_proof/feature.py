@@ -12,10 +12,11 @@ from django.utils.timezone import timedelta, now
 import core.indy_sdk_utils as indy_sdk_utils
 import core.codec
 import core.const
+import core.outbox
 import core.ledger
 from core.models import get_issuer_schema, get_cred_def_meta
 from core.proofs import verifier_verify_proof
-from core.base import WireMessageFeature, FeatureMeta, EndpointTransport, WriteOnlyChannel
+from core.base import WireMessageFeature, FeatureMeta, WriteOnlyChannel
 from core.messages.message import Message
 from core.messages.errors import ValidationException as MessageValidationException
 from core.serializer.json_serializer import JSONSerializer as Serializer
@@ -90,6 +91,7 @@ class PresentProofProtocol(WireMessageFeature, metaclass=FeatureMeta):
     FAMILY_NAME = "present-proof"
     VERSION = "1.0"
     FAMILY = "did:sov:BzCbsNYhMrjHiqZDTUASHg;spec/" + FAMILY_NAME + "/" + VERSION
+    INBOUND_FAMILIES = (FAMILY, AckMessage.FAMILY)
 
     """Messages"""
     # Verifier send to Prover message describes values that need to be revealed and predicates that need to be fulfilled
@@ -133,8 +135,11 @@ class PresentProofProtocol(WireMessageFeature, metaclass=FeatureMeta):
         return False
 
     @classmethod
-    async def handle(cls, agent_name: str, wire_message: bytes, my_label: str = None, my_endpoint: str = None) -> bool:
-        unpacked = await WalletAgent.unpack_message(agent_name, wire_message)
+    async def handle(
+            cls, agent_name: str, wire_message: bytes, my_label: str = None, my_endpoint: str = None,
+            unpacked: dict = None
+    ) -> bool:
+        unpacked = unpacked or await WalletAgent.unpack_message(agent_name, wire_message)
         kwargs = json.loads(unpacked['message'])
         message = Message(**kwargs)
         print('***** feature 0037 handle message *****')
@@ -225,8 +230,7 @@ class PresentProofProtocol(WireMessageFeature, metaclass=FeatureMeta):
             logging.exception(str(e))
             raise
         else:
-            transport = EndpointTransport(address=context.their_endpoint)
-            await transport.send_wire_message(wire_message)
+            await core.outbox.send_wire_message(context.their_endpoint, wire_message)
             return err_msg
 
     @classmethod
@@ -286,8 +290,7 @@ class PresentProofProtocol(WireMessageFeature, metaclass=FeatureMeta):
             logging.exception(str(e))
             raise
         else:
-            transport = EndpointTransport(address=their_endpoint)
-            await transport.send_wire_message(wire_message)
+            await core.outbox.send_wire_message(their_endpoint, wire_message)
 
     @staticmethod
     async def unpack_agent_message(wire_msg_bytes, wallet: WalletConnection):
@@ -1,15 +1,23 @@
+import os
+import time
 import uuid
+import socket
 import logging
 import asyncio
-import aioredis
+from collections import deque
 from abc import ABC, abstractmethod
 
 import aiohttp
+import aioredis
 from django.core.cache import caches
 from django.conf import settings
 
 from transport.const import *
 from core.messages.message import Message
+from core.redis_pool import RedisPool
+from core.http_pool import HttpPool
+from core.packets import encode_packet, decode_packet
+from core.streams import RedisStream
 
 
 CACHE = caches['state_machines']
@@ -52,14 +60,21 @@ class ContentFeature:
 
 class WireMessageFeature:
 
+    # Message families ("<doc-uri>/<family-name>/<version>") routed to feature by InboundRouter
+    INBOUND_FAMILIES = ()
+
     @classmethod
     @abstractmethod
-    async def handle(cls, agent_name: str, wire_message: bytes, my_label: str=None, my_endpoint: str=None) -> bool:
+    async def handle(
+            cls, agent_name: str, wire_message: bytes, my_label: str=None, my_endpoint: str=None,
+            unpacked: dict=None
+    ) -> bool:
         """
         :param agent_name: Indy agent name
         :param wire_message: Wired Input message
         :param my_label: Self Indy Label
         :param my_endpoint: Self endpoint
+        :param unpacked: wire message already unpacked by caller, it is unpacked by feature if None
         :return: response message or None
         """
         return False
@@ -76,21 +91,15 @@ class ReadWriteTimeoutError(Exception):
 class CustomChannel(ABC):
 
     def __init__(self):
-        self.redis = None
+        self.pool = None
         self.name = None
-        self.channel = None
         self._is_closed = True
 
-    def __del__(self):
-        if not self._is_closed and self.redis:
-            self.redis.close()
-
     @classmethod
     async def create(cls, name, live_timeout=settings.REDIS_CONN_TIMEOUT):
         self = cls()
-        self.redis = await aioredis.create_redis(
-            'redis://%s' % settings.REDIS_ADDRESS, timeout=live_timeout
-        )
+        self.pool = RedisPool.instance()
+        await self.pool.connection(timeout=live_timeout)
         self.name = 'channel://' + name
         self._is_closed = False
         await self._setup()
@@ -99,7 +108,6 @@ class CustomChannel(ABC):
     async def close(self):
         if not self._is_closed:
             self._is_closed = True
-            self.redis.close()
 
     @property
     def is_closed(self):
@@ -113,15 +121,19 @@ class ReadOnlyChannel(CustomChannel):
 
     def __init__(self):
         super().__init__()
-        self.queue = list()
+        self.queue = None
+
+    def __del__(self):
+        if not self._is_closed and self.queue is not None:
+            self.pool.discard(self.name, self.queue)
 
     async def read(self, timeout):
         if self._is_closed:
             raise ChannelIsClosedError()
         try:
             while True:
-                await asyncio.wait_for(self.__async_reader(), timeout=timeout)
-                packet = self.queue.pop(0)
+                msg = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+                packet = decode_packet(msg)
                 if packet['kind'] == 'data':
                     break
                 elif packet['kind'] == 'close':
@@ -132,16 +144,12 @@ class ReadOnlyChannel(CustomChannel):
         return True, packet['body']
 
     async def close(self):
-        await super().close()
+        if not self._is_closed:
+            await super().close()
+            await self.pool.unsubscribe(self.name, self.queue)
 
     async def _setup(self):
-        res = await self.redis.subscribe(self.name)
-        self.channel = res[0]
-
-    async def __async_reader(self):
-        await self.channel.wait_message()
-        msg = await self.channel.get_json()
-        self.queue.append(msg)
+        self.queue = await self.pool.subscribe(self.name)
 
 
 class WriteOnlyChannel(CustomChannel):
@@ -160,27 +168,132 @@ class WriteOnlyChannel(CustomChannel):
         if self._is_closed:
             raise ChannelIsClosedError()
         packet = dict(kind='data', body=data)
-        result = await self.redis.publish_json(self.name, packet)
+        result = await self.pool.publish(self.name, encode_packet(packet))
         return result
 
     async def close(self, silent=False):
         if not self.is_closed:
             if not silent:
                 packet = dict(kind='close', body=None)
-                await self.redis.publish_json(self.name, packet)
+                await self.pool.publish(self.name, encode_packet(packet))
             await super().close()
 
     async def _setup(self):
         pass
 
 
+class ReplyChannel:
+    """Reply to the request sent in multiplexed mode"""
+
+    def __init__(self, channel: WriteOnlyChannel, req_id: str):
+        self.__channel = channel
+        self.__req_id = req_id
+
+    async def write(self, data):
+        return await self.__channel.write(dict(req_id=self.__req_id, data=data))
+
+    async def close(self):
+        # Inbox is shared with other requests, so close packet is never sent
+        await self.__channel.close(silent=True)
+
+    @property
+    def is_closed(self):
+        return self.__channel.is_closed
+
+
+class StreamReplyChannel(ReplyChannel):
+    """Reply to the request received from stream, request is acknowledged on close"""
+
+    def __init__(self, channel: WriteOnlyChannel, req_id: str, stream: RedisStream, entry_id):
+        super().__init__(channel, req_id)
+        self.__stream = stream
+        self.__entry_id = entry_id
+
+    async def close(self):
+        try:
+            await super().close()
+        finally:
+            await self.__stream.ack(self.__entry_id)
+
+
+class ReplyInbox:
+    """Process level reply channel: single subscription serves all requests sent from event loop"""
+
+    __instances = dict()
+
+    def __init__(self):
+        self.name = 'inbox/%s/%d/%s' % (socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+        self.__pool = RedisPool.instance()
+        self.__queue = None
+        self.__waiters = dict()
+        self.__lock = asyncio.Lock()
+
+    @classmethod
+    def instance(cls) -> 'ReplyInbox':
+        loop = asyncio.get_event_loop()
+        inst = cls.__instances.get(loop, None)
+        if inst is None:
+            for closed_loop in [lp for lp in cls.__instances.keys() if lp.is_closed()]:
+                del cls.__instances[closed_loop]
+            inst = cls()
+            cls.__instances[loop] = inst
+        return inst
+
+    async def expect(self, req_id: str) -> asyncio.Future:
+        """Register waiter for reply with req_id"""
+        await self.__ensure_listening()
+        fut = asyncio.get_event_loop().create_future()
+        self.__waiters[req_id] = fut
+        return fut
+
+    def forget(self, req_id: str):
+        self.__waiters.pop(req_id, None)
+
+    async def __ensure_listening(self):
+        if self.__queue is None:
+            async with self.__lock:
+                if self.__queue is None:
+                    queue = await self.__pool.subscribe('channel://' + self.name)
+                    asyncio.ensure_future(self.__read(queue))
+                    self.__queue = queue
+
+    async def __read(self, queue: asyncio.Queue):
+        while True:
+            msg = await queue.get()
+            try:
+                packet = decode_packet(msg)
+            except ValueError:
+                logging.error('Unexpected packet in reply inbox "%s"' % self.name)
+                continue
+            # close packets are ignored: inbox lives as long as the process
+            body = packet.get('body') if packet.get('kind') == 'data' else None
+            if isinstance(body, dict) and 'req_id' in body:
+                fut = self.__waiters.pop(body['req_id'], None)
+                if fut and not fut.done():
+                    fut.set_result(body.get('data'))
+
+
 class AsyncReqResp:
 
+    # Requests are read from stream by single consumer, so it may resume processing after restart
+    STREAM_CONSUMER = 'listener'
+
     def __init__(self, address: str):
         self.address = address
         self.__listening_chan = None
+        self.__stream = None
+        self.__stream_conn = None
+        self.__stream_entries = deque()
+        self.__stream_pending_id = '0'
+        self.__stream_heartbeat = None
+
+    @staticmethod
+    def use_streams():
+        return settings.REDIS_RPC_TRANSPORT == 'streams'
 
     async def req(self, data, timeout=settings.REDIS_CONN_TIMEOUT):
+        if settings.REDIS_RPC_MULTIPLEXED or self.use_streams():
+            return await self.__multiplexed_req(data, timeout)
         resp_channel_name = uuid.uuid4().hex
         resp_channel = await ReadOnlyChannel.create(resp_channel_name)
         try:
@@ -204,19 +317,136 @@ class AsyncReqResp:
         finally:
             await resp_channel.close()
 
-    async def wait_req(self):
+    async def __multiplexed_req(self, data, timeout):
+        inbox = ReplyInbox.instance()
+        req_id = uuid.uuid4().hex
+        fut = await inbox.expect(req_id)
+        try:
+            packet = dict(
+                resp_channel_name=inbox.name,
+                req_id=req_id,
+                data=data
+            )
+            if self.use_streams():
+                # Agent skips request if caller is not waiting for reply anymore
+                packet['expires'] = time.time() + timeout
+                cfg = settings.REDIS_STREAMS
+                success = await self.__get_stream().add_if_consumed(packet, cfg['MAX_BACKLOG'], cfg['MAX_LEN'])
+            else:
+                req_channel = await WriteOnlyChannel.create(self.address)
+                success = await req_channel.write(packet)
+            if success:
+                try:
+                    resp_data = await asyncio.wait_for(fut, timeout=timeout)
+                except asyncio.TimeoutError:
+                    return False, None
+                return True, resp_data
+            else:
+                return False, None
+        finally:
+            inbox.forget(req_id)
+
+    async def wait_req(self, timeout: float=None):
+        """Wait for request
+
+        Raise: ReadWriteTimeoutError if there is no request for timeout seconds
+        """
+        if self.use_streams():
+            return await self.__wait_stream_req(timeout)
         chan = await self.__get_listening_chan()
-        _, packet = await chan.read(timeout=None)
+        _, packet = await chan.read(timeout=timeout)
         chan = await WriteOnlyChannel.create(packet['resp_channel_name'])
+        if packet.get('req_id', None):
+            chan = ReplyChannel(chan, packet['req_id'])
         data = packet['data']
         return data, chan
 
     async def start_listening(self):
-        await self.__get_listening_chan()
+        if self.use_streams():
+            stream = self.__get_stream()
+            await stream.create_group()
+            await stream.mark_consumer_alive(settings.REDIS_STREAMS['CONSUMER_TTL'])
+            self.__start_stream_heartbeat()
+        else:
+            await self.__get_listening_chan()
 
     async def stop_listening(self):
         if self.__listening_chan:
             await self.__listening_chan.close()
+        if self.__stream_heartbeat is not None:
+            self.__stream_heartbeat.cancel()
+            self.__stream_heartbeat = None
+        if self.__stream is not None:
+            await self.__stream.mark_consumer_dead()
+        if self.__stream_conn is not None:
+            self.__stream_conn.close()
+            self.__stream_conn = None
+
+    async def backlog(self):
+        """Count of requests that are not processed yet, None for pub/sub transport"""
+        if self.use_streams():
+            return await self.__get_stream().length()
+        else:
+            return None
+
+    def __start_stream_heartbeat(self):
+        # Agent may process requests longer than consumer TTL, so alive mark is not bound to reads
+        if self.__stream_heartbeat is None:
+            self.__stream_heartbeat = asyncio.ensure_future(
+                self.__get_stream().keep_consumer_alive(settings.REDIS_STREAMS['CONSUMER_TTL'])
+            )
+
+    def __get_stream(self) -> RedisStream:
+        if self.__stream is None:
+            self.__stream = RedisStream('stream://' + self.address)
+        return self.__stream
+
+    async def __wait_stream_req(self, timeout: float=None):
+        stream = self.__get_stream()
+        until_to = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            while not self.__stream_entries:
+                if until_to is not None and time.monotonic() > until_to:
+                    raise ReadWriteTimeoutError()
+                await self.__read_stream()
+            entry_id, packet = self.__stream_entries.popleft()
+            expires = packet.get('expires', None) if packet else None
+            if packet is None or (expires is not None and expires < time.time()):
+                # Caller is not waiting for reply anymore
+                await stream.ack(entry_id)
+                continue
+            chan = await WriteOnlyChannel.create(packet['resp_channel_name'])
+            chan = StreamReplyChannel(chan, packet['req_id'], stream, entry_id)
+            return packet['data'], chan
+
+    async def __read_stream(self):
+        cfg = settings.REDIS_STREAMS
+        stream = self.__get_stream()
+        try:
+            if self.__stream_conn is None:
+                await stream.create_group()
+                self.__stream_conn = await stream.pool.dedicated_connection()
+            self.__start_stream_heartbeat()
+            if self.__stream_pending_id is not None:
+                # Requests were delivered before restart but not acknowledged
+                entries = await stream.read(
+                    self.STREAM_CONSUMER, self.__stream_conn, cfg['READ_COUNT'], latest_id=self.__stream_pending_id
+                )
+                if entries:
+                    self.__stream_pending_id = entries[-1][0]
+                else:
+                    self.__stream_pending_id = None
+            else:
+                entries = await stream.read(
+                    self.STREAM_CONSUMER, self.__stream_conn, cfg['READ_COUNT'], block=cfg['BLOCK_TIMEOUT']
+                )
+            self.__stream_entries.extend(entries)
+        except (aioredis.RedisError, ConnectionError, OSError):
+            logging.exception('Error while reading stream "%s"' % stream.name)
+            if self.__stream_conn is not None:
+                self.__stream_conn.close()
+                self.__stream_conn = None
+            await asyncio.sleep(cfg['BLOCK_TIMEOUT'])
 
     async def __get_listening_chan(self):
         if self.__listening_chan is None:
@@ -228,26 +458,39 @@ class EndpointTransport:
 
     DEFAULT_WIRE_CONTENT_TYPE = WIRED_CONTENT_TYPES[0]
 
-    def __init__(self, address: str):
+    def __init__(self, address: str, pooled: bool=True):
+        """
+        :param pooled: send http requests over keep-alive connections of shared HttpPool
+        """
         parts = address.split('://')
         if len(parts) != 2:
             raise ValueError('Expected scheme in address: %s' % address)
         self.__address = address
         self.__scheme = parts[0]
         self.__path = parts[1]
+        self.__pooled = pooled
 
     async def send_wire_message(self, wire_message: bytes, content_type=DEFAULT_WIRE_CONTENT_TYPE):
         if self.__scheme in ['http', 'https']:
-            async with aiohttp.ClientSession() as session:
-                headers = {
-                    'content-type': content_type
-                }
-                async with session.post(self.__address, data=wire_message, headers=headers) as resp:
-                    if resp.status not in [200, 202]:
-                        logging.error('Sending problem report to endpoint with error. Resp status: %d' % resp.status)
-                        err_message = await resp.text()
-                        logging.error(err_message)
-                    return resp.status
+            if self.__pooled:
+                return await self.__post(HttpPool.instance().session(), wire_message, content_type)
+            else:
+                async with aiohttp.ClientSession() as session:
+                    return await self.__post(session, wire_message, content_type)
         elif self.__scheme == 'channel':
             chan = await WriteOnlyChannel.create(self.__path)
-            await chan.write([content_type, wire_message.decode()])
+            await chan.write([content_type, wire_message])
+
+    async def __post(self, session: aiohttp.ClientSession, wire_message: bytes, content_type: str):
+        headers = {
+            'content-type': content_type
+        }
+        async with session.post(self.__address, data=wire_message, headers=headers) as resp:
+            if resp.status not in [200, 202]:
+                logging.error('Sending problem report to endpoint with error. Resp status: %d' % resp.status)
+                err_message = await resp.text()
+                logging.error(err_message)
+            else:
+                # Release connection back to pool only when response body is consumed
+                await resp.read()
+            return resp.status
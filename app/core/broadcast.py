@@ -0,0 +1,135 @@
+import json
+import asyncio
+import logging
+
+from django.conf import settings
+
+from core.base import EndpointTransport
+from core.wallet import WalletAgent, BaseWalletException, batch_item_result
+
+
+# Count of pairwise lookups or packs sent to wallet agent in single batch
+BATCH_SIZE = 100
+
+
+async def resolve_recipients(agent_name: str, pass_phrase: str, their_dids: list=None, query: dict=None):
+    """Pairwise of recipients
+
+    Return: (recipients, errors): list of dict(their_did, metadata) and dict their_did -> error message
+    """
+    recipients = []
+    errors = dict()
+    if their_dids is not None:
+        for offset in range(0, len(their_dids), BATCH_SIZE):
+            chunk = their_dids[offset:offset + BATCH_SIZE]
+            results = await WalletAgent.batch(
+                agent_name, pass_phrase,
+                [dict(command=WalletAgent.COMMAND_GET_PAIRWISE, kwargs=dict(their_did=did)) for did in chunk],
+                stop_on_error=False
+            )
+            for their_did, item in zip(chunk, results):
+                try:
+                    info = batch_item_result(item)
+                except BaseWalletException as e:
+                    errors[their_did] = e.error_message or 'Pairwise lookup error'
+                    continue
+                if info is None:
+                    errors[their_did] = 'Pairwise not found'
+                else:
+                    recipients.append(dict(their_did=their_did, metadata=info['metadata'] or {}))
+    else:
+        cursor = None
+        while True:
+            page = await WalletAgent.search_pairwise(agent_name, pass_phrase, query, BATCH_SIZE, cursor)
+            recipients.extend(dict(their_did=item['their_did'], metadata=item['metadata']) for item in page['items'])
+            cursor = page['cursor']
+            if not cursor:
+                break
+    return recipients, errors
+
+
+def group_by_endpoint(recipients: list):
+    """Group recipients that share endpoint and sender key, every group is packed once
+
+    Return: list of ((endpoint, my_vk), [recipient])
+    """
+    groups = dict()
+    order = []
+    for recipient in recipients:
+        metadata = recipient['metadata']
+        key = (metadata.get('their_endpoint', None), metadata.get('my_vk', None))
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(recipient)
+    return [(key, groups[key]) for key in order]
+
+
+async def broadcast(
+        agent_name: str, pass_phrase: str, message: dict, their_dids: list=None, query: dict=None,
+        extra: dict=None, fan_out: int=None
+):
+    """Send message to many pairwise
+
+    Recipients are chosen by their_dids or by pairwise search query.
+    Recipients with the same endpoint get single multi-recipient wire message.
+
+    Return: list of dict(their_did, status=HTTP status or None, error=message or None)
+    """
+    fan_out = fan_out or settings.INDY['MESSAGING']['BROADCAST_FAN_OUT']
+    recipients, errors = await resolve_recipients(agent_name, pass_phrase, their_dids, query)
+    statuses = {their_did: dict(status=None, error=error) for their_did, error in errors.items()}
+    groups = []
+    for (endpoint, my_vk), group in group_by_endpoint(recipients):
+        deliverable = []
+        for recipient in group:
+            if not endpoint:
+                statuses[recipient['their_did']] = dict(status=None, error='Endpoint is unknown')
+            elif not recipient['metadata'].get('their_vk', None):
+                statuses[recipient['their_did']] = dict(status=None, error='Verkey is unknown')
+            else:
+                deliverable.append(recipient)
+        if deliverable:
+            groups.append((endpoint, my_vk, deliverable))
+
+    wire_messages = []
+    for offset in range(0, len(groups), BATCH_SIZE):
+        chunk = groups[offset:offset + BATCH_SIZE]
+        commands = [
+            dict(
+                command=WalletAgent.COMMAND_PACK_MESSAGE,
+                kwargs=dict(
+                    message=message,
+                    their_ver_key=[recipient['metadata']['their_vk'] for recipient in group],
+                    my_ver_key=my_vk
+                )
+            )
+            for _, my_vk, group in chunk
+        ]
+        wire_messages.extend(await WalletAgent.batch(agent_name, pass_phrase, commands, stop_on_error=False))
+
+    semaphore = asyncio.Semaphore(fan_out)
+
+    async def deliver(endpoint: str, group: list, item: dict):
+        try:
+            encrypted = batch_item_result(item)
+            if isinstance(encrypted, bytes):
+                encrypted = encrypted.decode('utf-8')
+            encrypted = json.loads(encrypted)
+            encrypted.update(extra or {})
+            async with semaphore:
+                status = await EndpointTransport(endpoint).send_wire_message(json.dumps(encrypted).encode('utf-8'))
+            result = dict(status=status, error=None)
+        except BaseWalletException as e:
+            result = dict(status=None, error=e.error_message or 'Pack message error')
+        except Exception as e:
+            logging.exception('Error while broadcasting to endpoint "%s"' % endpoint)
+            result = dict(status=None, error=str(e))
+        for recipient in group:
+            statuses[recipient['their_did']] = result
+
+    await asyncio.gather(*[
+        deliver(endpoint, group, item) for (endpoint, _, group), item in zip(groups, wire_messages)
+    ])
+    order = their_dids if their_dids is not None else [recipient['their_did'] for recipient in recipients]
+    return [dict(their_did=their_did, **statuses[their_did]) for their_did in order if their_did in statuses]
@@ -0,0 +1,52 @@
+import copy
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Bounded cache that evicts least recently used entries
+
+    Values are copied on put and get, so callers can't corrupt cached values
+    """
+
+    MISSING = object()
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # Changed by invalidation, value loaded before invalidation must not be cached
+        self.generation = 0
+        self.__entries = OrderedDict()
+
+    def get(self, key):
+        """Return: cached value or LRUCache.MISSING"""
+        try:
+            value = self.__entries[key]
+        except KeyError:
+            self.misses += 1
+            return self.MISSING
+        self.__entries.move_to_end(key)
+        self.hits += 1
+        return copy.deepcopy(value)
+
+    def put(self, key, value, generation: int=None):
+        if self.max_size <= 0 or (generation is not None and generation != self.generation):
+            return
+        self.__entries[key] = copy.deepcopy(value)
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.max_size:
+            self.__entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self.__entries.pop(key, None)
+        self.generation += 1
+
+    def clear(self):
+        self.__entries.clear()
+        self.generation += 1
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def stats(self):
+        return dict(size=len(self.__entries), max_size=self.max_size, hits=self.hits, misses=self.misses)
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+
+
+class SchedulerBusyError(Exception):
+    pass
+
+
+class CommandScheduler:
+    """Run commands as concurrent tasks
+
+    Every command belongs to some class, each class has its own concurrency limit and
+    its own limit of queued commands, so expensive commands can't starve cheap ones.
+    Total count of in-flight commands is bounded too. Command over limit is rejected
+    at once instead of blocking the listener loop, so full class never delays others.
+    """
+
+    def __init__(self, max_in_flight: int, classes: dict):
+        """
+        :param max_in_flight: max count of running and queued commands
+        :param classes: class name -> dict(CONCURRENCY=<int>, MAX_QUEUED=<int>)
+        """
+        self.__in_flight = asyncio.Semaphore(max_in_flight)
+        self.__concurrency = {
+            name: asyncio.Semaphore(descr['CONCURRENCY']) for name, descr in classes.items()
+        }
+        self.__queued = {
+            name: asyncio.Semaphore(descr['MAX_QUEUED']) for name, descr in classes.items()
+        }
+        self.__tasks = set()
+
+    @property
+    def in_flight(self):
+        return len(self.__tasks)
+
+    async def submit(self, class_name: str, coro):
+        """Schedule coroutine execution
+
+        Raise: SchedulerBusyError if class queue or in-flight queue is full
+        """
+        if self.__queued[class_name].locked() or self.__in_flight.locked():
+            coro.close()
+            raise SchedulerBusyError('Too many "%s" commands in flight' % class_name)
+        # Semaphores are not locked, so they are acquired without waiting
+        await self.__queued[class_name].acquire()
+        await self.__in_flight.acquire()
+        task = asyncio.ensure_future(self.__run(class_name, coro))
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+        return task
+
+    async def drain(self):
+        """Wait until all submitted commands are done"""
+        while self.__tasks:
+            await asyncio.wait(list(self.__tasks))
+
+    def cancel(self):
+        for task in list(self.__tasks):
+            task.cancel()
+
+    async def __run(self, class_name: str, coro):
+        try:
+            async with self.__concurrency[class_name]:
+                await coro
+        except asyncio.CancelledError:
+            # command may be cancelled before it is started
+            coro.close()
+            raise
+        except Exception:
+            logging.exception('Command terminated with exception')
+        finally:
+            self.__in_flight.release()
+            self.__queued[class_name].release()
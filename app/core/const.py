@@ -8,3 +8,5 @@ PROOF = 'proof'
 WALLET_KEY_TO_DID_KEY = 'key-to-did'
 WALLET_KEY_CRED_DEF = 'cred-def'
 WALLET_KEY_ISSUER_SCHEMA = 'issuer-schema'
+WALLET_KEY_PAIRWISE_INDEX = 'pairwise-index'
+WALLET_KEY_PAIRWISE_INDEX_STATE = 'pairwise-index-state'
@@ -0,0 +1,23 @@
+import bisect
+import hashlib
+
+
+class HashRing:
+    """Consistent hashing: adding or removing node remaps only keys of that node"""
+
+    def __init__(self, nodes: list, replicas: int=64):
+        self.nodes = list(nodes)
+        self.__ring = sorted(
+            (self.__hash('%s#%d' % (node, n)), node) for node in self.nodes for n in range(replicas)
+        )
+        self.__hashes = [h for h, _ in self.__ring]
+
+    def get_node(self, key: str):
+        if not self.__ring:
+            return None
+        index = bisect.bisect(self.__hashes, self.__hash(key)) % len(self.__ring)
+        return self.__ring[index][1]
+
+    @staticmethod
+    def __hash(value: str):
+        return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
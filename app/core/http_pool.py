@@ -0,0 +1,54 @@
+import asyncio
+
+import aiohttp
+from django.conf import settings
+
+
+class HttpPool:
+    """HTTP client session shared by all outbound requests running on the same event loop.
+
+    Connections are kept alive and limited per destination host, DNS lookups are cached
+    """
+
+    __instances = dict()
+
+    def __init__(self):
+        self.__session = None
+
+    @classmethod
+    def instance(cls) -> 'HttpPool':
+        """Pool bound to the current event loop"""
+        loop = asyncio.get_event_loop()
+        inst = cls.__instances.get(loop, None)
+        if inst is None:
+            for closed_loop in [lp for lp in cls.__instances.keys() if lp.is_closed()]:
+                del cls.__instances[closed_loop]
+            inst = cls()
+            cls.__instances[loop] = inst
+        return inst
+
+    @staticmethod
+    def config():
+        return settings.HTTP_POOL
+
+    def session(self) -> aiohttp.ClientSession:
+        if self.__session is None or self.__session.closed:
+            cfg = self.config()
+            connector = aiohttp.TCPConnector(
+                limit=cfg['LIMIT'],
+                limit_per_host=cfg['LIMIT_PER_HOST'],
+                keepalive_timeout=cfg['KEEPALIVE_TIMEOUT'],
+                use_dns_cache=True,
+                ttl_dns_cache=cfg['DNS_CACHE_TTL']
+            )
+            self.__session = aiohttp.ClientSession(
+                connector=connector,
+                conn_timeout=cfg['CONN_TIMEOUT'],
+                read_timeout=cfg['READ_TIMEOUT']
+            )
+        return self.__session
+
+    async def close(self):
+        if self.__session is not None:
+            await self.__session.close()
+            self.__session = None
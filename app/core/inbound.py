@@ -0,0 +1,60 @@
+import json
+import logging
+
+from core.wallet import WalletAgent
+
+
+def message_family(message_type: str):
+    """Family of message type: "<doc-uri>/<family-name>/<version>/<name>" -> "<doc-uri>/<family-name>/<version>"
+
+    Return: family or None if type is not qualified
+    """
+    parts = message_type.rsplit('/', 1)
+    if len(parts) != 2:
+        return None
+    return parts[0]
+
+
+class InboundRouter:
+    """Dispatch inbound wire messages to features
+
+    Wire message is unpacked once, features are chosen by family of message type.
+    Families shared by many protocols (acks, trust ping) are offered to features that declare them
+    in order until one of them processes the message, since owner protocol can't be derived
+    from message type. Messages of unknown families are offered to fallback feature only.
+    """
+
+    def __init__(self, features: list, fallback=None):
+        self.__fallback = [fallback] if fallback else []
+        self.__index = dict()
+        for feature in features:
+            for family in feature.INBOUND_FAMILIES:
+                self.__index.setdefault(family.rstrip('/'), []).append(feature)
+
+    def candidates(self, message_type: str) -> list:
+        family = message_family(message_type)
+        return self.__index.get(family, self.__fallback) if family else self.__fallback
+
+    async def route(self, agent_name: str, wire_message: bytes, my_label: str=None, my_endpoint: str=None) -> bool:
+        """
+        Return: True if message was processed by some feature
+        """
+        unpacked = await WalletAgent.unpack_message(agent_name, wire_message)
+        try:
+            message_type = json.loads(unpacked['message']).get('@type', None)
+        except (ValueError, AttributeError):
+            return False
+        if not message_type:
+            return False
+        for feature in self.candidates(message_type):
+            success = await feature.handle(
+                agent_name=agent_name,
+                wire_message=wire_message,
+                my_label=my_label,
+                my_endpoint=my_endpoint,
+                unpacked=unpacked
+            )
+            if success:
+                logging.debug('Message "%s" is processed by %s' % (message_type, feature.__name__))
+                return True
+        return False
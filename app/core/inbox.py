@@ -0,0 +1,192 @@
+import time
+import zlib
+import asyncio
+import logging
+from collections import OrderedDict
+
+from django.conf import settings
+
+from core.redis_pool import RedisPool
+from core.streams import RedisStream
+from transport.const import WIRED_CONTENT_TYPES
+
+
+INBOX_STREAM = 'inbox:%d'
+INBOX_GROUP = 'processors'
+# Messages waiting for retry of partition, scored by due time
+RETRY_KEY = 'inbox:retry:%d'
+DEAD_LETTER_STREAM = 'inbox:dead'
+STATS_KEY = 'inbox:stats'
+
+
+def config():
+    return settings.INDY['MESSAGING']['INBOX']
+
+
+def is_enabled():
+    return config()['ENABLED']
+
+
+def partition_of(agent_name: str) -> int:
+    """Messages of the wallet always go to the same partition, so they are processed in order"""
+    return zlib.crc32(agent_name.encode('utf-8')) % config()['PARTITIONS']
+
+
+def partition_stream(partition: int) -> RedisStream:
+    return RedisStream(INBOX_STREAM % partition, INBOX_GROUP)
+
+
+async def enqueue(agent_name: str, my_label: str, my_endpoint: str, content_type: str, body: bytes) -> bool:
+    """Put inbound message to wallet inbox, it will be processed by inbox workers
+
+    Return: False if inbox workers are not running or backlog is full, caller should process message itself
+    """
+    cfg = config()
+    packet = dict(
+        agent_name=agent_name, my_label=my_label, my_endpoint=my_endpoint,
+        content_type=content_type, body=body, received=time.time()
+    )
+    stream = partition_stream(partition_of(agent_name))
+    accepted = await stream.add_if_consumed(packet, cfg['MAX_BACKLOG'], cfg['MAX_LEN'])
+    await count('enqueued' if accepted else 'rejected')
+    return accepted
+
+
+async def count(name: str, value: int=1):
+    redis = await RedisPool.instance().connection()
+    await redis.execute(b'HINCRBY', STATS_KEY, name, value)
+
+
+async def inbox_stats():
+    """Processing counters, backlog of every partition and dead letters count"""
+    redis = await RedisPool.instance().connection()
+    partitions = range(config()['PARTITIONS'])
+    counters, dead, *lengths = await asyncio.gather(
+        redis.execute(b'HGETALL', STATS_KEY),
+        redis.execute(b'XLEN', DEAD_LETTER_STREAM),
+        *[redis.execute(b'XLEN', INBOX_STREAM % partition) for partition in partitions],
+        *[redis.execute(b'ZCARD', RETRY_KEY % partition) for partition in partitions]
+    )
+    backlog, retries = lengths[:len(partitions)], lengths[len(partitions):]
+    stats = {name.decode('utf-8'): int(value) for name, value in zip(counters[::2], counters[1::2])}
+    stats.update(backlog=dict(zip(partitions, backlog)), retries=sum(retries), dead=dead)
+    return stats
+
+
+def retry_delay(attempt: int):
+    cfg = config()
+    return min(cfg['RETRY_DELAY_MAX'], cfg['RETRY_DELAY_MIN'] * 2 ** (attempt - 1))
+
+
+class InboxWorker:
+    """Process inbound messages of inbox partitions
+
+    Every partition must be consumed by single worker: messages of the same wallet are processed
+    one by one in order of arrival, messages of different wallets are processed concurrently.
+    Failed message is scheduled for retry with exponential backoff and is appended to partition
+    again when it is due, so retries do not delay partition. Messages that can't be processed
+    are moved to dead letter stream.
+    """
+
+    def __init__(self, handler, partitions: list=None):
+        """
+        :param handler: coroutine function(agent_name, my_label, my_endpoint, content_type, body) -> HTTP status
+        :param partitions: partitions to consume, all by default
+        """
+        self.handler = handler
+        self.partitions = list(partitions if partitions is not None else range(config()['PARTITIONS']))
+
+    async def run(self):
+        logging.info('Inbox worker is started for partitions: %s' % self.partitions)
+        await asyncio.gather(*[self.__consume(partition) for partition in self.partitions])
+
+    async def __consume(self, partition: int):
+        cfg = config()
+        stream = partition_stream(partition)
+        consumer = 'partition-%d' % partition
+        await stream.create_group()
+        redis = await RedisPool.instance().dedicated_connection()
+        # Batch may be processed longer than TTL, if alive mark expired meanwhile, new messages
+        # of the wallet would be processed inline ahead of its backlog
+        await stream.mark_consumer_alive(cfg['CONSUMER_TTL'])
+        heartbeat = asyncio.ensure_future(stream.keep_consumer_alive(cfg['CONSUMER_TTL']))
+        pump = asyncio.ensure_future(self.__pump_retries(partition))
+        try:
+            # Entries delivered before restart are processed first
+            latest_id = '0'
+            while True:
+                entries = await stream.read(
+                    consumer, redis, count=cfg['READ_COUNT'],
+                    block=None if latest_id != '>' else cfg['BLOCK_TIMEOUT'], latest_id=latest_id
+                )
+                if latest_id != '>':
+                    if not entries:
+                        latest_id = '>'
+                        continue
+                    latest_id = entries[-1][0]
+                wallets = OrderedDict()
+                for entry_id, packet in entries:
+                    agent_name = packet['agent_name'] if packet else None
+                    wallets.setdefault(agent_name, []).append((entry_id, packet))
+                await asyncio.gather(*[self.__process_wallet(stream, items) for items in wallets.values()])
+        finally:
+            heartbeat.cancel()
+            pump.cancel()
+            await stream.mark_consumer_dead()
+            redis.close()
+
+    async def __process_wallet(self, stream: RedisStream, entries: list):
+        for entry_id, packet in entries:
+            try:
+                if packet is not None:
+                    await self.__process(stream, packet)
+            except Exception:
+                logging.exception('Error while processing inbox entry %s' % entry_id)
+            await stream.ack(entry_id)
+
+    async def __process(self, stream: RedisStream, packet: dict):
+        cfg = config()
+        body = packet['body']
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        terminal = False
+        try:
+            status = await self.handler(
+                agent_name=packet['agent_name'],
+                my_label=packet['my_label'],
+                my_endpoint=packet['my_endpoint'],
+                content_type=packet['content_type'],
+                body=body
+            )
+            error = None if 200 <= status < 300 else 'HTTP status %d' % status
+            # Nobody listens wallet wired messages channel, retry will not help
+            terminal = status == 410 and packet['content_type'] not in WIRED_CONTENT_TYPES
+        except Exception as e:
+            logging.exception('Error while processing inbox message of "%s"' % packet['agent_name'])
+            error = str(e) or e.__class__.__name__
+        if error is None:
+            await count('processed')
+            return
+        await count('failed_attempts')
+        packet['attempt'] = packet.get('attempt', 0) + 1
+        if not terminal and packet['attempt'] < cfg['MAX_ATTEMPTS']:
+            retry_key = RETRY_KEY % partition_of(packet['agent_name'])
+            await stream.schedule(retry_key, packet, time.time() + retry_delay(packet['attempt']))
+            await count('retried')
+            return
+        packet['error'] = error
+        logging.error('Inbox message of "%s" is dead: %s' % (packet['agent_name'], error))
+        await RedisStream(DEAD_LETTER_STREAM).add(packet, cfg['MAX_LEN'])
+        await count('dead')
+
+    async def __pump_retries(self, partition: int):
+        cfg = config()
+        stream = partition_stream(partition)
+        while True:
+            try:
+                moved = await stream.pump_due(RETRY_KEY % partition, cfg['READ_COUNT'], cfg['MAX_LEN'])
+            except Exception:
+                logging.exception('Error while moving inbox retries of partition %d' % partition)
+                moved = 0
+            if not moved:
+                await asyncio.sleep(cfg['RETRY_POLL_INTERVAL'])
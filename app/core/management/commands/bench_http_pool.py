@@ -0,0 +1,67 @@
+import time
+import asyncio
+
+from aiohttp import web
+from django.core.management.base import BaseCommand
+
+from core.base import EndpointTransport
+from core.http_pool import HttpPool
+from core.management.commands.bench_packets import make_wire_message
+
+
+class Command(BaseCommand):
+
+    help = 'Compare outbound messages throughput with and without shared HTTP connections pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--port', type=int, default=8088)
+
+    def handle(self, *args, **options):
+        loop = asyncio.get_event_loop()
+        try:
+            loop.run_until_complete(self.__benchmark(options['messages'], options['concurrency'], options['port']))
+        finally:
+            loop.run_until_complete(HttpPool.instance().close())
+            loop.close()
+
+    async def __benchmark(self, messages: int, concurrency: int, port: int):
+        app = web.Application()
+        app.router.add_post('/endpoint', self.__endpoint)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        try:
+            address = 'http://127.0.0.1:%d/endpoint' % port
+            wire_message = make_wire_message(2048)
+            self.stdout.write('%-10s %10s %12s %10s' % ('mode', 'messages', 'messages/s', 'errors'))
+            for mode, pooled in [('no pool', False), ('pooled', True)]:
+                elapsed, errors = await self.__send(address, pooled, wire_message, messages, concurrency)
+                self.stdout.write('%-10s %10d %12.1f %10d' % (mode, messages, messages / elapsed, errors))
+        finally:
+            await runner.cleanup()
+
+    @staticmethod
+    async def __endpoint(request):
+        await request.read()
+        return web.Response(status=202)
+
+    @staticmethod
+    async def __send(address: str, pooled: bool, wire_message: bytes, messages: int, concurrency: int):
+        semaphore = asyncio.Semaphore(concurrency)
+        errors = 0
+
+        async def send():
+            nonlocal errors
+            async with semaphore:
+                try:
+                    status = await EndpointTransport(address, pooled=pooled).send_wire_message(wire_message)
+                except Exception:
+                    status = None
+                if status != 202:
+                    errors += 1
+
+        stamp = time.perf_counter()
+        await asyncio.gather(*[send() for _ in range(messages)])
+        return time.perf_counter() - stamp, errors
@@ -0,0 +1,53 @@
+import json
+import time
+import asyncio
+
+import aiohttp
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+
+    help = 'Load agent inbound endpoint, run against server with ASYNC_INBOUND_ENDPOINT=on and off to compare'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', type=str, help='endpoint url, like http://localhost:8888/agent/endpoints/<uid>/')
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=64)
+
+    def handle(self, *args, **options):
+        loop = asyncio.get_event_loop()
+        try:
+            loop.run_until_complete(self.__benchmark(options['url'], options['messages'], options['concurrency']))
+        finally:
+            loop.close()
+
+    async def __benchmark(self, url: str, messages: int, concurrency: int):
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        statuses = dict()
+        headers = {'content-type': 'application/json'}
+
+        async def post(session: aiohttp.ClientSession, n: int):
+            async with semaphore:
+                stamp = time.perf_counter()
+                try:
+                    async with session.post(url, data=json.dumps(dict(n=n)), headers=headers) as resp:
+                        await resp.read()
+                        code = resp.status
+                except aiohttp.ClientError:
+                    code = None
+                latencies.append(time.perf_counter() - stamp)
+                statuses[code] = statuses.get(code, 0) + 1
+
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            stamp = time.perf_counter()
+            await asyncio.gather(*[post(session, n) for n in range(messages)])
+            elapsed = time.perf_counter() - stamp
+        latencies.sort()
+        self.stdout.write('requests/s: %.1f' % (messages / elapsed))
+        for name, q in [('p50', 0.5), ('p99', 0.99), ('max', 1.0)]:
+            value = latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+            self.stdout.write('%s latency, ms: %.1f' % (name, value * 1000))
+        self.stdout.write('statuses: %s' % ', '.join('%s=%d' % item for item in sorted(statuses.items(), key=str)))
@@ -0,0 +1,98 @@
+import os
+import json
+import time
+import base64
+
+from django.core.management.base import BaseCommand
+
+from core.packets import PACKET_CODECS, decode_packet
+
+
+def b64(size: int):
+    return base64.urlsafe_b64encode(os.urandom(size)).decode('ascii')
+
+
+def make_wire_message(payload_size: int) -> bytes:
+    """Message shaped as indy pack_message output (authcrypt JWE)"""
+    protected = dict(
+        enc='xchacha20poly1305_ietf',
+        typ='JWM/1.0',
+        alg='Authcrypt',
+        recipients=[
+            dict(
+                encrypted_key=b64(48),
+                header=dict(kid=b64(32), sender=b64(96), iv=b64(24))
+            )
+        ]
+    )
+    wire = dict(
+        protected=base64.urlsafe_b64encode(json.dumps(protected).encode()).decode('ascii'),
+        iv=b64(12),
+        ciphertext=b64(payload_size),
+        tag=b64(16)
+    )
+    return json.dumps(wire).encode('utf-8')
+
+
+def make_proof(attrs_count: int) -> dict:
+    """Structure shaped as indy prover_create_proof output"""
+    revealed = {
+        'attr%d_referent' % n: dict(sub_proof_index=0, raw='value %d' % n, encoded=str(10**30 + n))
+        for n in range(attrs_count)
+    }
+    eq_proof = dict(
+        revealed_attrs={'attr%d' % n: str(10**70 + n) for n in range(attrs_count)},
+        a_prime=str(10**600),
+        e=str(10**150),
+        v=str(10**700),
+        m={'master_secret': str(10**180)},
+        m2=str(10**180)
+    )
+    return dict(
+        proof=dict(proofs=[dict(primary_proof=dict(eq_proof=eq_proof, ge_proofs=[]), non_revoc_proof=None)]),
+        requested_proof=dict(revealed_attrs=revealed, self_attested_attrs={}, unrevealed_attrs={}, predicates={}),
+        identifiers=[dict(schema_id='schema:1', cred_def_id='cred_def:1', rev_reg_id=None, timestamp=None)]
+    )
+
+
+class Command(BaseCommand):
+
+    help = 'Compare channel packet codecs on wallet agent traffic'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        wire_message = make_wire_message(2048)
+        samples = [
+            ('invoke_state_machine', dict(
+                kind='data',
+                body=dict(
+                    resp_channel_name='inbox', req_id='x' * 32,
+                    data=dict(
+                        command='invoke_state_machine',
+                        kwargs=dict(id_='x' * 32, content_type='application/ssi-agent-wire', data=wire_message, is_bytes=True)
+                    )
+                )
+            )),
+            ('pack_message reply', dict(kind='data', body=dict(req_id='x' * 32, data=dict(ret=wire_message)))),
+            ('create_proof reply', dict(kind='data', body=dict(req_id='x' * 32, data=dict(ret=make_proof(10))))),
+        ]
+        self.stdout.write('%-22s %-8s %8s %12s %12s' % ('packet', 'codec', 'size', 'encode, us', 'decode, us'))
+        for sample_name, packet in samples:
+            for codec_name, codec in sorted(PACKET_CODECS.items()):
+                encoded = codec.encode(packet)
+                stamp = time.perf_counter()
+                for _ in range(iterations):
+                    codec.encode(packet)
+                encode_time = (time.perf_counter() - stamp) / iterations
+                stamp = time.perf_counter()
+                for _ in range(iterations):
+                    decode_packet(encoded)
+                decode_time = (time.perf_counter() - stamp) / iterations
+                self.stdout.write(
+                    '%-22s %-8s %8d %12.1f %12.1f' % (
+                        sample_name, codec_name, len(encoded), encode_time * 10**6, decode_time * 10**6
+                    )
+                )
@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import asyncio
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.wallet import WalletAgent, WalletConnection, WalletAlreadyExists
+from core.wallet_host import WalletHost
+from core.redis_pool import RedisPool
+
+
+PASS_PHRASE = 'pass_phrase'
+
+
+def rss_kb(pid='self'):
+    """Resident set size of the process, Linux only"""
+    with open('/proc/%s/status' % pid) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+class Command(BaseCommand):
+
+    help = 'Compare memory per wallet for wallet host and process per wallet modes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wallets', type=int, default=20)
+
+    def handle(self, *args, **options):
+        names = ['bench_wallet_host_%d' % n for n in range(options['wallets'])]
+        loop = asyncio.get_event_loop()
+        try:
+            loop.run_until_complete(self.__create_wallets(names))
+            try:
+                host_kb = loop.run_until_complete(self.__measure_host(names))
+                process_kb = loop.run_until_complete(self.__measure_processes(names))
+            finally:
+                loop.run_until_complete(self.__delete_wallets(names))
+        finally:
+            loop.run_until_complete(RedisPool.instance().close())
+        self.stdout.write('Wallets: %d' % len(names))
+        self.stdout.write('Wallet host:          %8d KB per wallet' % (host_kb / len(names)))
+        self.stdout.write('Process per wallet:   %8d KB per wallet' % (process_kb / len(names)))
+
+    @staticmethod
+    async def __create_wallets(names):
+        for name in names:
+            try:
+                await WalletConnection(name, PASS_PHRASE).create()
+            except WalletAlreadyExists:
+                pass
+
+    @staticmethod
+    async def __delete_wallets(names):
+        for name in names:
+            await WalletConnection(name, PASS_PHRASE).delete()
+
+    @staticmethod
+    async def __open_all(names):
+        await asyncio.gather(*[WalletAgent.open(name, PASS_PHRASE) for name in names])
+
+    @staticmethod
+    async def __close_all(names):
+        await asyncio.gather(*[WalletAgent.close(name, PASS_PHRASE) for name in names])
+
+    async def __measure_host(self, names):
+        """Return: RSS growth of host process serving all wallets"""
+        host = WalletHost('bench', max_open_wallets=len(names))
+        before = rss_kb()
+        for name in names:
+            await host.attach(name)
+        await asyncio.sleep(1)
+        await self.__open_all(names)
+        after = rss_kb()
+        await self.__close_all(names)
+        await asyncio.wait(list(host.agents.values()), timeout=10)
+        return after - before
+
+    async def __measure_processes(self, names):
+        """Return: summary RSS of agents processes"""
+        processes = [
+            subprocess.Popen([sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'run_wallet_agent', name])
+            for name in names
+        ]
+        try:
+            for name in names:
+                while not await WalletAgent.ping(name, timeout=1):
+                    await asyncio.sleep(0.5)
+            await self.__open_all(names)
+            total = sum(rss_kb(proc.pid) for proc in processes)
+            await self.__close_all(names)
+            return total
+        finally:
+            stamp = time.monotonic()
+            for proc in processes:
+                while proc.poll() is None and time.monotonic() - stamp < 10:
+                    await asyncio.sleep(0.1)
+                if proc.poll() is None:
+                    proc.kill()
@@ -0,0 +1,25 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from core.supervisor import run_supervisor_service
+from core.http_pool import HttpPool
+from core.redis_pool import RedisPool
+
+
+class Command(BaseCommand):
+
+    help = 'Run Wallet agents supervisor'
+
+    def handle(self, *args, **options):
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self.__background_task())
+        loop.close()
+
+    @staticmethod
+    async def __background_task():
+        try:
+            await run_supervisor_service()
+        finally:
+            await HttpPool.instance().close()
+            await RedisPool.instance().close()
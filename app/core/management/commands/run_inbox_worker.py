@@ -0,0 +1,38 @@
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.inbox import InboxWorker, config
+from core.http_pool import HttpPool
+from core.redis_pool import RedisPool
+from transport.views import receive_wired_message
+
+
+class Command(BaseCommand):
+
+    help = 'Process inbound messages appended to inbox by agent endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=1, help='count of worker processes sharing inbox partitions'
+        )
+        parser.add_argument('--index', type=int, default=0, help='index of this worker process')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['index'] < options['workers']:
+            raise CommandError('Index must be in range [0, workers)')
+        partitions = [
+            partition for partition in range(config()['PARTITIONS'])
+            if partition % options['workers'] == options['index']
+        ]
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self.__background_task(partitions))
+        loop.close()
+
+    @staticmethod
+    async def __background_task(partitions: list):
+        try:
+            await InboxWorker(receive_wired_message, partitions).run()
+        finally:
+            await HttpPool.instance().close()
+            await RedisPool.instance().close()
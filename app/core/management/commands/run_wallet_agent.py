@@ -1,9 +1,12 @@
 import asyncio
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 
 from core.wallet import WalletAgent
+from core.wallet_host import WalletHost, config as hosts_config
+from core.http_pool import HttpPool
+from core.redis_pool import RedisPool
 
 
 class Command(BaseCommand):
@@ -11,18 +14,40 @@ class Command(BaseCommand):
     help = 'Run Wallet agent'
 
     def add_arguments(self, parser):
-        parser.add_argument('agent_name', type=str)
+        parser.add_argument('agent_name', type=str, nargs='?')
+        parser.add_argument(
+            '--host', type=str, default=None,
+            help='Run wallet host: serve many wallets assigned to host with the given name'
+        )
 
     def handle(self, *args, **options):
         agent_name = options['agent_name']
+        host_name = options['host']
+        if not agent_name and not host_name:
+            raise CommandError('agent_name or --host is required')
         loop = asyncio.get_event_loop()
-        loop.run_until_complete(self.__background_task(agent_name))
+        if host_name:
+            loop.run_until_complete(self.__host_task(host_name))
+        else:
+            loop.run_until_complete(self.__background_task(agent_name))
         loop.close()
 
     @staticmethod
     async def __background_task(agent_name):
         # If another agent is running then exit
-        ping = await WalletAgent.ping(agent_name)
-        if not ping:
-            await WalletAgent.process(agent_name)
-        pass
+        try:
+            ping = await WalletAgent.ping(agent_name)
+            if not ping:
+                await WalletAgent.process(agent_name)
+        finally:
+            await HttpPool.instance().close()
+            await RedisPool.instance().close()
+
+    @staticmethod
+    async def __host_task(host_name):
+        try:
+            host = WalletHost(host_name, hosts_config()['MAX_OPEN_WALLETS'])
+            await host.run()
+        finally:
+            await HttpPool.instance().close()
+            await RedisPool.instance().close()
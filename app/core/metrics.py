@@ -0,0 +1,64 @@
+import bisect
+
+
+class LatencyHistogram:
+    """Histogram of latencies in seconds, bucket counts are not cumulative"""
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, buckets: tuple=None):
+        self.__buckets = tuple(buckets or self.BUCKETS)
+        self.__counts = [0] * (len(self.__buckets) + 1)
+        self.__sum = 0.0
+        self.__count = 0
+        self.__max = 0.0
+
+    def observe(self, value: float):
+        self.__counts[bisect.bisect_left(self.__buckets, value)] += 1
+        self.__sum += value
+        self.__count += 1
+        self.__max = max(self.__max, value)
+
+    @property
+    def count(self):
+        return self.__count
+
+    def to_dict(self):
+        buckets = {str(le): n for le, n in zip(self.__buckets, self.__counts)}
+        buckets['+Inf'] = self.__counts[-1]
+        return dict(
+            buckets=buckets,
+            count=self.__count,
+            sum=self.__sum,
+            avg=self.__sum / self.__count if self.__count else 0.0,
+            max=self.__max
+        )
+
+
+class CallStats:
+    """Calls, errors and latency histogram per operation name"""
+
+    def __init__(self):
+        self.__calls = dict()
+        self.__errors = dict()
+        self.__latency = dict()
+
+    def observe(self, name: str, elapsed: float, failed: bool=False):
+        self.__calls[name] = self.__calls.get(name, 0) + 1
+        if failed:
+            self.__errors[name] = self.__errors.get(name, 0) + 1
+        histogram = self.__latency.get(name, None)
+        if histogram is None:
+            histogram = LatencyHistogram()
+            self.__latency[name] = histogram
+        histogram.observe(elapsed)
+
+    def to_dict(self):
+        return {
+            name: dict(
+                calls=calls,
+                errors=self.__errors.get(name, 0),
+                latency=self.__latency[name].to_dict()
+            )
+            for name, calls in self.__calls.items()
+        }
@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import logging
+from urllib.parse import urlparse
+
+from django.conf import settings
+
+from core.base import EndpointTransport
+from core.metrics import LatencyHistogram
+from core.redis_pool import RedisPool
+from core.streams import RedisStream
+
+
+OUTBOX_STREAM = 'outbox'
+OUTBOX_GROUP = 'senders'
+RETRY_KEY = 'outbox:retry'
+DEAD_LETTER_STREAM = 'outbox:dead'
+STATS_KEY = 'outbox:stats'
+# Delivery latency histograms published by workers: consumer -> json
+LATENCY_KEY = 'outbox:latency'
+
+
+def config():
+    return settings.INDY['MESSAGING']['OUTBOX']
+
+
+def is_enabled():
+    return config()['ENABLED']
+
+
+async def enqueue(endpoint: str, wire_message: bytes, content_type: str=EndpointTransport.DEFAULT_WIRE_CONTENT_TYPE):
+    """Put wire message to outbox, it will be delivered by sender workers
+
+    Return: message id
+    """
+    message_id = uuid.uuid4().hex
+    packet = dict(
+        id=message_id, endpoint=endpoint, wire_message=wire_message, content_type=content_type,
+        attempt=0, enqueued=time.time()
+    )
+    await RedisStream(OUTBOX_STREAM, OUTBOX_GROUP).add(packet, config()['MAX_LEN'])
+    await count('enqueued')
+    return message_id
+
+
+async def send_wire_message(
+        endpoint: str, wire_message: bytes, content_type: str=EndpointTransport.DEFAULT_WIRE_CONTENT_TYPE
+):
+    """Enqueue message to http endpoint if outbox is enabled, else send it immediately"""
+    if is_enabled() and urlparse(endpoint).scheme in ['http', 'https']:
+        await enqueue(endpoint, wire_message, content_type)
+    else:
+        await EndpointTransport(address=endpoint).send_wire_message(wire_message, content_type)
+
+
+async def count(name: str, value: int=1):
+    redis = await RedisPool.instance().connection()
+    await redis.execute(b'HINCRBY', STATS_KEY, name, value)
+
+
+async def outbox_stats():
+    """Delivery counters, backlog, retries and dead letters count"""
+    redis = await RedisPool.instance().connection()
+    counters, backlog, retries, dead, workers = await asyncio.gather(
+        redis.execute(b'HGETALL', STATS_KEY),
+        redis.execute(b'XLEN', OUTBOX_STREAM),
+        redis.execute(b'ZCARD', RETRY_KEY),
+        redis.execute(b'XLEN', DEAD_LETTER_STREAM),
+        redis.execute(b'HGETALL', LATENCY_KEY)
+    )
+    stats = {name.decode('utf-8'): int(value) for name, value in zip(counters[::2], counters[1::2])}
+    # Latency of workers that are running now, histograms of stopped workers expire
+    latency = dict()
+    expired = []
+    for consumer, value in zip(workers[::2], workers[1::2]):
+        worker_stats = json.loads(value.decode('utf-8'))
+        if worker_stats['updated'] < time.time() - 3 * config()['MAINTENANCE_INTERVAL']:
+            expired.append(consumer)
+        else:
+            latency[consumer.decode('utf-8')] = worker_stats['latency']
+    if expired:
+        await redis.execute(b'HDEL', LATENCY_KEY, *expired)
+    stats.update(backlog=backlog, retries=retries, dead=dead, latency=latency)
+    return stats
+
+
+def retry_delay(attempt: int):
+    cfg = config()
+    return min(cfg['BACKOFF_MAX'], cfg['BACKOFF_MIN'] * 2 ** (attempt - 1))
+
+
+class OutboxWorker:
+    """Deliver outbox messages
+
+    Count of concurrent deliveries is limited in total and per destination host.
+    Failed deliveries are retried with exponential backoff, messages that can't be
+    delivered are moved to dead letter stream. Entries that are not acknowledged for
+    CLAIM_IDLE seconds, because their worker crashed or failed to process them,
+    are taken over by running workers.
+    """
+
+    def __init__(self):
+        self.consumer = '%s:%d' % (socket.gethostname(), os.getpid())
+        self.stream = RedisStream(OUTBOX_STREAM, OUTBOX_GROUP)
+        self.latency = LatencyHistogram()
+        self.__in_flight = asyncio.Semaphore(config()['MAX_IN_FLIGHT'])
+        self.__destinations = dict()
+        self.__tasks = set()
+        self.__in_progress = set()
+
+    async def run(self):
+        cfg = config()
+        await self.stream.create_group()
+        pump = asyncio.ensure_future(self.__pump_retries())
+        maintenance = asyncio.ensure_future(self.__maintain())
+        redis = await RedisPool.instance().dedicated_connection()
+        logging.info('Outbox worker "%s" is started' % self.consumer)
+        try:
+            # Entries delivered to this consumer before restart are processed first
+            latest_id = '0'
+            while True:
+                entries = await self.stream.read(
+                    self.consumer, redis, count=cfg['READ_COUNT'],
+                    block=None if latest_id != '>' else cfg['BLOCK_TIMEOUT'], latest_id=latest_id
+                )
+                if latest_id != '>':
+                    if not entries:
+                        latest_id = '>'
+                        continue
+                    latest_id = entries[-1][0]
+                for entry_id, packet in entries:
+                    await self.__dispatch(entry_id, packet)
+        finally:
+            pump.cancel()
+            maintenance.cancel()
+            for task in list(self.__tasks):
+                task.cancel()
+            redis.close()
+
+    async def __dispatch(self, entry_id, packet: dict):
+        # Acquire before reading next entries: stream is backpressured by in-flight limit
+        await self.__in_flight.acquire()
+        self.__in_progress.add(entry_id)
+        task = asyncio.ensure_future(self.__process(entry_id, packet))
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+    async def __process(self, entry_id, packet: dict):
+        try:
+            if packet is not None:
+                await self.__deliver(packet)
+            await self.stream.ack(entry_id)
+        except Exception:
+            # Entry is left pending and will be claimed again after CLAIM_IDLE
+            logging.exception('Error while processing outbox entry %s' % entry_id)
+        finally:
+            self.__in_progress.discard(entry_id)
+            self.__in_flight.release()
+
+    async def __deliver(self, packet: dict):
+        cfg = config()
+        endpoint = packet['endpoint']
+        wire_message = packet['wire_message']
+        if isinstance(wire_message, str):
+            wire_message = wire_message.encode('utf-8')
+        destination = urlparse(endpoint).netloc
+        semaphore = self.__destinations.get(destination, None)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(cfg['MAX_PER_DESTINATION'])
+            self.__destinations[destination] = semaphore
+        stamp = time.monotonic()
+        error = None
+        async with semaphore:
+            try:
+                status = await asyncio.wait_for(
+                    EndpointTransport(address=endpoint).send_wire_message(wire_message, packet['content_type']),
+                    cfg['REQUEST_TIMEOUT']
+                )
+            except Exception as e:
+                status = None
+                error = str(e) or e.__class__.__name__
+        self.latency.observe(time.monotonic() - stamp)
+        if status is not None and 200 <= status < 300:
+            await count('delivered')
+            return
+        await count('failed_attempts')
+        packet['attempt'] += 1
+        packet['error'] = error or 'HTTP status %d' % status
+        # Client errors except throttling will not be fixed by retry
+        permanent = status is not None and 400 <= status < 500 and status != 429
+        if permanent or packet['attempt'] >= cfg['MAX_ATTEMPTS']:
+            logging.error('Outbox message %s to "%s" is dead: %s' % (packet['id'], endpoint, packet['error']))
+            await RedisStream(DEAD_LETTER_STREAM).add(packet, cfg['MAX_LEN'])
+            await count('dead')
+        else:
+            await self.stream.schedule(RETRY_KEY, packet, time.time() + retry_delay(packet['attempt']))
+            await count('retried')
+
+    async def __pump_retries(self):
+        cfg = config()
+        while True:
+            try:
+                moved = await self.stream.pump_due(RETRY_KEY, cfg['READ_COUNT'], cfg['MAX_LEN'])
+            except Exception:
+                logging.exception('Error while moving outbox retries')
+                moved = 0
+            if not moved:
+                await asyncio.sleep(cfg['RETRY_POLL_INTERVAL'])
+
+    async def __maintain(self):
+        cfg = config()
+        while True:
+            await asyncio.sleep(cfg['MAINTENANCE_INTERVAL'])
+            try:
+                redis = await RedisPool.instance().connection()
+                worker_stats = dict(latency=self.latency.to_dict(), updated=time.time())
+                await redis.execute(b'HSET', LATENCY_KEY, self.consumer, json.dumps(worker_stats))
+                entries = await self.stream.claim(
+                    self.consumer, cfg['CLAIM_IDLE'], cfg['READ_COUNT'], exclude=self.__in_progress
+                )
+                if entries:
+                    await count('claimed', len(entries))
+            except Exception:
+                logging.exception('Error while maintaining outbox worker "%s"' % self.consumer)
+                entries = []
+            for entry_id, packet in entries:
+                logging.warning('Outbox entry %s is claimed by "%s"' % (entry_id, self.consumer))
+                await self.__dispatch(entry_id, packet)
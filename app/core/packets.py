@@ -0,0 +1,97 @@
+import json
+
+import msgpack
+from django.conf import settings
+
+
+PACKET_CODECS = {}
+
+
+class PacketCodecMeta(type):
+
+    def __new__(mcs, name, bases, class_dict):
+        cls = type.__new__(mcs, name, bases, class_dict)
+        if cls.name:
+            PACKET_CODECS[cls.name] = cls
+        return cls
+
+
+class BasePacketCodec:
+    """Channel packets codec
+
+    Every encoded packet starts with codec version byte, JSON packets are not prefixed:
+    this is legacy format that was used before codecs were introduced
+    """
+
+    name = None
+    version = None
+
+    @classmethod
+    def encode(cls, packet) -> bytes:
+        raise NotImplementedError()
+
+    @classmethod
+    def decode(cls, data: bytes):
+        raise NotImplementedError()
+
+
+class JSONPacketCodec(BasePacketCodec, metaclass=PacketCodecMeta):
+    """Legacy format, bytes are sent as UTF-8 strings"""
+
+    name = 'json'
+
+    @classmethod
+    def encode(cls, packet) -> bytes:
+        return json.dumps(packet, default=cls.__default).encode('utf-8')
+
+    @classmethod
+    def decode(cls, data: bytes):
+        return json.loads(data.decode('utf-8'))
+
+    @staticmethod
+    def __default(o):
+        if isinstance(o, bytes):
+            return o.decode('utf-8')
+        raise TypeError('Object of type %s is not JSON serializable' % o.__class__.__name__)
+
+
+class MsgPackPacketCodec(BasePacketCodec, metaclass=PacketCodecMeta):
+    """Binary format, bytes are carried as is"""
+
+    name = 'msgpack'
+    version = 1
+
+    @classmethod
+    def encode(cls, packet) -> bytes:
+        return bytes([cls.version]) + msgpack.packb(packet, use_bin_type=True)
+
+    @classmethod
+    def decode(cls, data: bytes):
+        return msgpack.unpackb(data[1:], raw=False)
+
+
+VERSIONED_CODECS = {cls.version: cls for cls in PACKET_CODECS.values() if cls.version is not None}
+
+
+def get_codec(name: str=None):
+    name = name or settings.REDIS_PACKET_CODEC
+    try:
+        return PACKET_CODECS[name]
+    except KeyError:
+        raise ValueError('Unknown packet codec: %s' % name)
+
+
+def encode_packet(packet, codec: str=None) -> bytes:
+    return get_codec(codec).encode(packet)
+
+
+def decode_packet(data: bytes):
+    """Decode packet encoded with any known codec"""
+    if not data:
+        raise ValueError('Empty packet')
+    if data[:1] in (b'{', b'['):
+        return JSONPacketCodec.decode(data)
+    codec = VERSIONED_CODECS.get(data[0], None)
+    if codec is None:
+        raise ValueError('Unknown packet codec version: %d' % data[0])
+    return codec.decode(data)
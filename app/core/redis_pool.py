@@ -0,0 +1,204 @@
+import asyncio
+import logging
+
+import aioredis
+from django.conf import settings
+
+
+class RedisPool:
+    """Redis connections shared by all channels running on the same event loop.
+
+    Commands are multiplexed over aioredis connections pool, subscriptions share
+    single pub/sub connection: every incoming message is fan-out to local readers queues
+    """
+
+    __instances = dict()
+
+    def __init__(self):
+        self.__redis = None
+        self.__lock = asyncio.Lock()
+        self.__subscribers = dict()
+        self.__subscriptions = dict()
+        self.__channels = dict()
+        self.__health_checker = None
+        self.__recovering = None
+
+    @classmethod
+    def instance(cls) -> 'RedisPool':
+        """Pool bound to the current event loop"""
+        loop = asyncio.get_event_loop()
+        inst = cls.__instances.get(loop, None)
+        if inst is None:
+            for closed_loop in [lp for lp in cls.__instances.keys() if lp.is_closed()]:
+                del cls.__instances[closed_loop]
+            inst = cls()
+            cls.__instances[loop] = inst
+        return inst
+
+    @staticmethod
+    def config():
+        return settings.REDIS_POOL
+
+    async def connection(self, timeout: float=None) -> aioredis.Redis:
+        if self.__redis is None or self.__redis.closed:
+            async with self.__lock:
+                if self.__redis is None or self.__redis.closed:
+                    await self.__connect(timeout)
+        return self.__redis
+
+    async def dedicated_connection(self, timeout: float=None) -> aioredis.Redis:
+        """Connection for blocking commands, caller is responsible for closing it"""
+        return await aioredis.create_redis(
+            'redis://%s' % settings.REDIS_ADDRESS,
+            timeout=timeout or self.config()['CONN_TIMEOUT']
+        )
+
+    async def publish(self, name: str, data):
+        """Publish data to channel
+
+        Return: count of recipients, local readers sharing subscription are counted separately
+        """
+        redis = await self.connection()
+        counter = await redis.publish(name, data)
+        local_readers = len(self.__subscribers.get(name, ()))
+        if counter > 0 and local_readers > 1 and name in self.__channels:
+            counter += local_readers - 1
+        return counter
+
+    async def subscribe(self, name: str) -> asyncio.Queue:
+        """Subscribe to channel, messages will be put to returned queue as raw bytes"""
+        queue = asyncio.Queue()
+        self.__subscribers.setdefault(name, set()).add(queue)
+        ready = self.__subscriptions.get(name, None)
+        if ready is None:
+            ready = asyncio.ensure_future(self.__subscribe(name))
+            self.__subscriptions[name] = ready
+        try:
+            await asyncio.shield(ready)
+        except Exception:
+            if self.__subscriptions.get(name, None) is ready and ready.done():
+                del self.__subscriptions[name]
+            self.discard(name, queue)
+            raise
+        return queue
+
+    async def unsubscribe(self, name: str, queue: asyncio.Queue):
+        if self.discard(name, queue):
+            if self.__redis is not None and not self.__redis.closed:
+                try:
+                    await self.__redis.unsubscribe(name)
+                except aioredis.RedisError:
+                    logging.exception('Error while unsubscribe from "%s"' % name)
+
+    def discard(self, name: str, queue: asyncio.Queue):
+        """Forget local reader queue
+
+        Return: True if channel has no local readers anymore
+        """
+        queues = self.__subscribers.get(name, None)
+        if queues is None:
+            return False
+        queues.discard(queue)
+        if queues:
+            return False
+        del self.__subscribers[name]
+        self.__subscriptions.pop(name, None)
+        self.__channels.pop(name, None)
+        return True
+
+    async def check_health(self) -> bool:
+        """Ping Redis and recover connections if they are broken
+
+        Return: True if connections were healthy
+        """
+        cfg = self.config()
+        healthy = False
+        if self.__redis is not None and not self.__redis.closed:
+            try:
+                await asyncio.wait_for(self.__redis.ping(), timeout=cfg['CONN_TIMEOUT'])
+                healthy = True
+            except (asyncio.TimeoutError, aioredis.RedisError, ConnectionError, OSError):
+                logging.exception('Redis health check failed')
+        if not healthy:
+            await self.__recover()
+        else:
+            await self.__unsubscribe_abandoned()
+        return healthy
+
+    async def close(self):
+        if self.__health_checker:
+            self.__health_checker.cancel()
+            self.__health_checker = None
+        self.__subscribers.clear()
+        self.__subscriptions.clear()
+        self.__channels.clear()
+        if self.__redis is not None:
+            self.__redis.close()
+            await self.__redis.wait_closed()
+            self.__redis = None
+
+    async def __connect(self, timeout: float=None):
+        cfg = self.config()
+        self.__redis = await aioredis.create_redis_pool(
+            'redis://%s' % settings.REDIS_ADDRESS,
+            minsize=cfg['MIN_SIZE'],
+            maxsize=cfg['MAX_SIZE'],
+            timeout=timeout or cfg['CONN_TIMEOUT']
+        )
+        if self.__health_checker is None and cfg['HEALTH_CHECK_INTERVAL']:
+            self.__health_checker = asyncio.ensure_future(self.__health_check_loop(cfg['HEALTH_CHECK_INTERVAL']))
+
+    async def __subscribe(self, name: str):
+        redis = await self.connection()
+        channel, = await redis.subscribe(name)
+        self.__channels[name] = channel
+        asyncio.ensure_future(self.__read(name, channel))
+
+    async def __read(self, name: str, channel: aioredis.Channel):
+        while await channel.wait_message():
+            msg = await channel.get()
+            for queue in list(self.__subscribers.get(name, ())):
+                queue.put_nowait(msg)
+        if self.__channels.get(name, None) is channel:
+            # Channel was closed without unsubscribe: connection is lost
+            logging.error('Redis subscription to "%s" is lost' % name)
+            await self.__recover()
+
+    async def __recover(self):
+        if self.__recovering is None or self.__recovering.done():
+            self.__recovering = asyncio.ensure_future(self.__reconnect())
+        await asyncio.shield(self.__recovering)
+
+    async def __reconnect(self):
+        if self.__redis is not None:
+            self.__redis.close()
+            self.__redis = None
+        self.__channels.clear()
+        self.__subscriptions.clear()
+        for name in list(self.__subscribers.keys()):
+            self.__subscriptions[name] = asyncio.ensure_future(self.__subscribe(name))
+        if self.__subscriptions:
+            done, _ = await asyncio.wait(list(self.__subscriptions.values()))
+            for fut in done:
+                if fut.exception():
+                    logging.error('Redis subscription was not restored: %s' % fut.exception())
+            for name, fut in list(self.__subscriptions.items()):
+                if fut.exception():
+                    del self.__subscriptions[name]
+        else:
+            await self.connection()
+
+    async def __unsubscribe_abandoned(self):
+        for name in list(self.__channels.keys()):
+            if not self.__subscribers.get(name, None):
+                self.__channels.pop(name, None)
+                self.__subscriptions.pop(name, None)
+                await self.__redis.unsubscribe(name)
+
+    async def __health_check_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.check_health()
+            except Exception:
+                logging.exception('Error while checking Redis connections')
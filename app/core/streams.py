@@ -0,0 +1,188 @@
+import time
+import asyncio
+import logging
+
+import aioredis
+
+from core.redis_pool import RedisPool
+from core.packets import encode_packet, decode_packet
+
+
+# Append entry only if stream has alive consumer and its backlog is not full
+ADD_IF_CONSUMED_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return -1
+end
+local backlog = redis.call('XLEN', KEYS[1])
+if backlog >= tonumber(ARGV[1]) then
+    return -2
+end
+redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[2], '*', 'packet', ARGV[3])
+return backlog
+"""
+
+# Move due packets of sorted set (score is due time) to stream, ZREM guards against moving packet by many workers
+POP_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, packet in ipairs(due) do
+    if redis.call('ZREM', KEYS[1], packet) == 1 then
+        redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], '*', 'packet', packet)
+    end
+end
+return #due
+"""
+
+
+class RedisStream:
+    """Redis stream of packets processed by consumer group
+
+    Processed entries are acknowledged and deleted, so stream length is backlog:
+    entries that are not delivered yet plus delivered entries that are still in progress
+    """
+
+    FIELD = b'packet'
+    DEFAULT_GROUP = 'consumers'
+
+    def __init__(self, name: str, group: str=DEFAULT_GROUP):
+        self.name = name
+        self.group = group
+        self.pool = RedisPool.instance()
+
+    @property
+    def consumer_alive_key(self):
+        return '%s:alive' % self.name
+
+    async def add(self, packet, max_len: int=None):
+        """Append packet to stream
+
+        Return: entry id
+        """
+        redis = await self.pool.connection()
+        args = [self.name]
+        if max_len:
+            args.extend([b'MAXLEN', b'~', max_len])
+        args.extend([b'*', self.FIELD, encode_packet(packet)])
+        return await redis.execute(b'XADD', *args)
+
+    async def add_if_consumed(self, packet, max_backlog: int, max_len: int) -> bool:
+        """Append packet to stream if consumer is alive and backlog is not full
+
+        Return: True if packet was appended
+        """
+        redis = await self.pool.connection()
+        ret = await redis.eval(
+            ADD_IF_CONSUMED_SCRIPT,
+            keys=[self.name, self.consumer_alive_key],
+            args=[max_backlog, max_len, encode_packet(packet)]
+        )
+        if ret == -2:
+            logging.warning('Stream "%s" backlog is full, packet is rejected' % self.name)
+        return ret >= 0
+
+    async def schedule(self, schedule_key: str, packet, due: float):
+        """Put packet to sorted set to append it to stream at due time by pump_due()"""
+        redis = await self.pool.connection()
+        await redis.execute(b'ZADD', schedule_key, due, encode_packet(packet))
+
+    async def pump_due(self, schedule_key: str, count: int, max_len: int) -> int:
+        """Append scheduled packets that are due to stream
+
+        Return: count of due packets
+        """
+        redis = await self.pool.connection()
+        return await redis.eval(POP_DUE_SCRIPT, keys=[schedule_key, self.name], args=[time.time(), count, max_len])
+
+    async def length(self) -> int:
+        redis = await self.pool.connection()
+        return await redis.execute(b'XLEN', self.name)
+
+    async def create_group(self, latest_id: str='0'):
+        redis = await self.pool.connection()
+        try:
+            await redis.execute(b'XGROUP', b'CREATE', self.name, self.group, latest_id, b'MKSTREAM')
+        except aioredis.ReplyError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    async def mark_consumer_alive(self, ttl: int):
+        redis = await self.pool.connection()
+        await redis.execute(b'SET', self.consumer_alive_key, 1, b'EX', ttl)
+
+    async def keep_consumer_alive(self, ttl: int):
+        """Refresh consumer alive mark until cancelled
+
+        Run it as separate task: consumer may be busy with delivered entries longer than ttl
+        """
+        while True:
+            try:
+                await self.mark_consumer_alive(ttl)
+            except (aioredis.RedisError, ConnectionError, OSError):
+                logging.exception('Error while marking consumer of stream "%s" alive' % self.name)
+            await asyncio.sleep(ttl / 3)
+
+    async def mark_consumer_dead(self):
+        redis = await self.pool.connection()
+        await redis.execute(b'DEL', self.consumer_alive_key)
+
+    async def read(self, consumer: str, redis=None, count: int=None, block: float=None, latest_id: str='>'):
+        """Read entries delivered to consumer
+
+        :param redis: connection, blocking reads require dedicated one
+        :param block: timeout in seconds
+        :param latest_id: '>' - read new entries, otherwise read pending entries with greater id
+        Return: list of (entry_id, packet), packet is None if entry was deleted or malformed
+        """
+        redis = redis or await self.pool.connection()
+        args = [b'GROUP', self.group, consumer]
+        if count:
+            args.extend([b'COUNT', count])
+        if block is not None:
+            args.extend([b'BLOCK', int(block * 1000)])
+        args.extend([b'STREAMS', self.name, latest_id])
+        reply = await redis.execute(b'XREADGROUP', *args)
+        entries = []
+        for _, stream_entries in reply or []:
+            entries.extend(self.__decode_entries(stream_entries))
+        return entries
+
+    async def claim(self, consumer: str, min_idle: float, count: int, exclude: set=None):
+        """Take over entries delivered to any consumer of the group but not acknowledged for min_idle seconds
+
+        Entries of crashed consumers and entries that failed to be processed are delivered again this way
+
+        :param exclude: ids of entries that are still in progress by this consumer
+        Return: list of (entry_id, packet) like read
+        """
+        redis = await self.pool.connection()
+        min_idle_ms = int(min_idle * 1000)
+        pending = await redis.execute(b'XPENDING', self.name, self.group, b'-', b'+', count)
+        entry_ids = [
+            entry_id for entry_id, _, idle, _ in pending or []
+            if idle >= min_idle_ms and (not exclude or entry_id not in exclude)
+        ]
+        if not entry_ids:
+            return []
+        # XCLAIM checks idle time again, so entry is taken over by single consumer
+        claimed = await redis.execute(b'XCLAIM', self.name, self.group, consumer, min_idle_ms, *entry_ids)
+        return self.__decode_entries([item for item in claimed or [] if item])
+
+    def __decode_entries(self, stream_entries):
+        entries = []
+        for entry_id, fields in stream_entries:
+            packet = None
+            if fields:
+                fields = dict(zip(fields[::2], fields[1::2]))
+                try:
+                    packet = decode_packet(fields[self.FIELD])
+                except (KeyError, ValueError):
+                    logging.error('Malformed entry %s in stream "%s"' % (entry_id, self.name))
+            entries.append((entry_id, packet))
+        return entries
+
+    async def ack(self, *entry_ids):
+        """Acknowledge and delete processed entries"""
+        redis = await self.pool.connection()
+        await asyncio.gather(
+            redis.execute(b'XACK', self.name, self.group, *entry_ids),
+            redis.execute(b'XDEL', self.name, *entry_ids)
+        )
@@ -0,0 +1,230 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import logging
+import subprocess
+
+from django.conf import settings
+
+from core.base import AsyncReqResp
+from core.metrics import LatencyHistogram
+from core.redis_pool import RedisPool
+from core.wallet import WalletAgent, AgentTimeOutError
+from core.wallet_host import attach_to_host
+
+
+SUPERVISOR_ADDRESS = 'wallet-agents-supervisor'
+COMMAND_START = 'start'
+COMMAND_STATS = 'stats'
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def config():
+    return settings.INDY['WALLET_SETTINGS']['SUPERVISOR']
+
+
+class AgentSupervisor:
+    """Start wallet agents processes and restart them if they crash
+
+    Starts are deduplicated: concurrent requests for the same agent share single start,
+    across processes start is guarded by Redis lock. Count of concurrent starts is limited.
+    """
+
+    __instances = dict()
+
+    def __init__(self):
+        cfg = config()
+        self.__owner = '%s:%d' % (socket.gethostname(), os.getpid())
+        self.__starting = dict()
+        self.__processes = dict()
+        self.__restarts = dict()
+        self.__start_semaphore = asyncio.Semaphore(cfg['MAX_CONCURRENT_STARTS'])
+        self.__start_latency = LatencyHistogram()
+        self.__counters = dict(starts=0, restarts=0, crashes=0, start_failures=0)
+        self.__watcher = None
+
+    @classmethod
+    def instance(cls) -> 'AgentSupervisor':
+        """Supervisor bound to the current event loop"""
+        loop = asyncio.get_event_loop()
+        inst = cls.__instances.get(loop, None)
+        if inst is None:
+            for closed_loop in [lp for lp in cls.__instances.keys() if lp.is_closed()]:
+                del cls.__instances[closed_loop]
+            inst = cls()
+            cls.__instances[loop] = inst
+        return inst
+
+    async def ensure_running(self, agent_name: str, timeout: float):
+        """Start agent if it is not running and wait until it responds"""
+        fut = self.__starting.get(agent_name, None)
+        if fut is None:
+            fut = asyncio.ensure_future(self.__ensure_running(agent_name, timeout))
+            self.__starting[agent_name] = fut
+            fut.add_done_callback(lambda f: self.__starting.pop(agent_name, None))
+        await asyncio.shield(fut)
+
+    def stats(self):
+        stats = dict(self.__counters)
+        stats['running'] = len(self.__processes)
+        stats['start_latency'] = self.__start_latency.to_dict()
+        return stats
+
+    def terminate(self):
+        """Stop supervising, agents processes are left running"""
+        if self.__watcher:
+            self.__watcher.cancel()
+            self.__watcher = None
+        for task in self.__restarts.values():
+            task.cancel()
+        self.__processes.clear()
+
+    async def __ensure_running(self, agent_name: str, timeout: float):
+        stamp = time.monotonic()
+        until_to = stamp + timeout
+        async with self.__start_semaphore:
+            if not await WalletAgent.ping(agent_name, timeout=1):
+                lock = await self.__acquire_start_lock(agent_name, timeout)
+                try:
+                    if lock:
+                        self.__spawn(agent_name)
+                    # If lock is not acquired then agent is started by another process
+                    while time.monotonic() < until_to:
+                        if await WalletAgent.ping(agent_name, timeout=1):
+                            break
+                        await asyncio.sleep(0.5)
+                    else:
+                        self.__counters['start_failures'] += 1
+                        raise AgentTimeOutError('Agent is not running')
+                finally:
+                    if lock:
+                        await self.__release_start_lock(agent_name)
+        self.__start_latency.observe(time.monotonic() - stamp)
+
+    def __spawn(self, agent_name: str):
+        # New session: agent outlives the process that started it, like nohup did
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'run_wallet_agent', agent_name],
+            start_new_session=True
+        )
+        self.__processes[agent_name] = (proc, time.monotonic())
+        self.__counters['starts'] += 1
+        if self.__watcher is None:
+            self.__watcher = asyncio.ensure_future(self.__watch())
+        logging.info('Wallet agent "%s" is spawned, pid: %d' % (agent_name, proc.pid))
+
+    async def __watch(self):
+        cfg = config()
+        failures = dict()
+        while True:
+            await asyncio.sleep(cfg['POLL_INTERVAL'])
+            for agent_name, (proc, started_at) in list(self.__processes.items()):
+                returncode = proc.poll()
+                if returncode is None:
+                    continue
+                del self.__processes[agent_name]
+                if returncode == 0:
+                    # Agent was closed or another agent is serving the wallet
+                    failures.pop(agent_name, None)
+                    continue
+                self.__counters['crashes'] += 1
+                if time.monotonic() - started_at > cfg['RESTART_BACKOFF_MAX']:
+                    failures[agent_name] = 0
+                failures[agent_name] = failures.get(agent_name, 0) + 1
+                if failures[agent_name] > cfg['MAX_RESTARTS']:
+                    logging.error('Wallet agent "%s" crashed too many times, it is not restarted' % agent_name)
+                    failures.pop(agent_name, None)
+                    continue
+                delay = min(cfg['RESTART_BACKOFF_MAX'], cfg['RESTART_BACKOFF_MIN'] * 2 ** (failures[agent_name] - 1))
+                logging.warning(
+                    'Wallet agent "%s" exited with code %d, restart in %.1f sec' % (agent_name, returncode, delay)
+                )
+                self.__restarts[agent_name] = asyncio.ensure_future(self.__restart(agent_name, delay))
+
+    async def __restart(self, agent_name: str, delay: float):
+        try:
+            await asyncio.sleep(delay)
+            if await WalletAgent.ping(agent_name, timeout=1):
+                return
+            if await self.__acquire_start_lock(agent_name, config()['POLL_INTERVAL'] + delay):
+                self.__spawn(agent_name)
+                self.__counters['restarts'] += 1
+        except Exception:
+            logging.exception('Error while restarting wallet agent "%s"' % agent_name)
+        finally:
+            self.__restarts.pop(agent_name, None)
+
+    async def __acquire_start_lock(self, agent_name: str, ttl: float) -> bool:
+        redis = await RedisPool.instance().connection()
+        ret = await redis.execute(
+            b'SET', self.__start_lock_key(agent_name), self.__owner, b'NX', b'PX', int(ttl * 1000)
+        )
+        return ret is not None
+
+    async def __release_start_lock(self, agent_name: str):
+        redis = await RedisPool.instance().connection()
+        await redis.eval(RELEASE_LOCK_SCRIPT, keys=[self.__start_lock_key(agent_name)], args=[self.__owner])
+
+    @staticmethod
+    def __start_lock_key(agent_name: str):
+        return 'wallet-agent-start:%s' % agent_name
+
+
+async def ensure_agent_running(agent_name: str, timeout: float):
+    """Start wallet agent on wallet host, via supervisor service or by this process if service is not available"""
+    if await attach_to_host(agent_name, timeout):
+        return
+    if config()['MODE'] == 'service':
+        packet = dict(command=COMMAND_START, agent_name=agent_name, timeout=timeout)
+        success, resp = await AsyncReqResp(SUPERVISOR_ADDRESS).req(packet, timeout=timeout + 1)
+        if success:
+            if resp.get('error', None):
+                raise AgentTimeOutError(resp['error'])
+            return
+        logging.warning('Wallet agents supervisor is not available, agent "%s" is started locally' % agent_name)
+    await AgentSupervisor.instance().ensure_running(agent_name, timeout)
+
+
+async def supervisor_stats(timeout: float=5):
+    """Statistics of supervisor service"""
+    success, resp = await AsyncReqResp(SUPERVISOR_ADDRESS).req(dict(command=COMMAND_STATS), timeout=timeout)
+    return resp.get('ret') if success else None
+
+
+async def run_supervisor_service():
+    listener = AsyncReqResp(SUPERVISOR_ADDRESS)
+    supervisor = AgentSupervisor.instance()
+    await listener.start_listening()
+    logging.info('Wallet agents supervisor is started')
+
+    async def handle(req: dict, chan):
+        try:
+            try:
+                if req['command'] == COMMAND_START:
+                    await supervisor.ensure_running(req['agent_name'], req['timeout'])
+                    resp = dict(ret=True)
+                elif req['command'] == COMMAND_STATS:
+                    resp = dict(ret=supervisor.stats())
+                else:
+                    resp = dict(error='Unknown command: %s' % req['command'])
+            except Exception as e:
+                resp = dict(error=str(e))
+            await chan.write(resp)
+        finally:
+            await chan.close()
+
+    try:
+        while True:
+            req, chan = await listener.wait_req()
+            asyncio.ensure_future(handle(req, chan))
+    finally:
+        supervisor.terminate()
+        await listener.stop_listening()
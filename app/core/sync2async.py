@@ -1,46 +1,130 @@
+import time
+import zlib
 import asyncio
+import itertools
 import threading
+import concurrent.futures
 
+from django.conf import settings
 
-def run_async(coro, timeout=15):
-    return Scheduler.run_async(coro, timeout)
+
+def run_async(coro, timeout=15, shard_key: str=None):
+    return Scheduler.run_async(coro, timeout, shard_key)
+
+
+class EventLoopThread:
+    """Event loop running forever in daemon thread, lag of loop is probed periodically"""
+
+    def __init__(self, name: str, lag_probe_interval: float):
+        self.loop = asyncio.new_event_loop()
+        self.submitted = 0
+        self.timeouts = 0
+        self.queue_depth = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.__lag_probe_interval = lag_probe_interval
+        self.__lock = threading.Lock()
+        self.__thread = threading.Thread(target=self.__run_event_loop_in_thread, name=name)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        with self.__lock:
+            self.submitted += 1
+            self.queue_depth += 1
+        fut = asyncio.run_coroutine_threadsafe(coro, loop=self.loop)
+        fut.add_done_callback(self.__on_done)
+        return fut
+
+    def on_timeout(self):
+        with self.__lock:
+            self.timeouts += 1
+
+    def stats(self):
+        return dict(
+            name=self.__thread.name,
+            submitted=self.submitted,
+            timeouts=self.timeouts,
+            queue_depth=self.queue_depth,
+            lag=self.lag,
+            max_lag=self.max_lag
+        )
+
+    def __on_done(self, fut):
+        with self.__lock:
+            self.queue_depth -= 1
+
+    def __run_event_loop_in_thread(self):
+        asyncio.set_event_loop(self.loop)
+        if self.__lag_probe_interval:
+            self.loop.create_task(self.__probe_lag())
+        self.loop.run_forever()
+
+    async def __probe_lag(self):
+        # Sleep takes longer than requested when loop is busy with other callbacks
+        while True:
+            stamp = time.monotonic()
+            await asyncio.sleep(self.__lag_probe_interval)
+            self.lag = max(0.0, time.monotonic() - stamp - self.__lag_probe_interval)
+            self.max_lag = max(self.max_lag, self.lag)
 
 
 class Scheduler:
+    """Run coroutines of sync code on pool of event loops
+
+    Calls of the same thread go to the same loop, so coroutines of single request are
+    serialized as before. Calls with shard key (wallet uid for example) go to loop chosen by key,
+    so they are ordered regardless of caller thread.
+    """
 
     __instance = None
+    __instance_lock = threading.Lock()
 
     def __init__(self):
         if self.__instance is not None:
             raise RuntimeError()
         else:
-            self.__loop = asyncio.new_event_loop()
-            self.__thread = threading.Thread(target=self.__run_event_loop_in_thread, args=(self.__loop,))
-            self.__thread.daemon = True
-            self.__thread.start()
+            cfg = settings.SYNC2ASYNC
+            self.__loops = [
+                EventLoopThread('sync2async-%d' % n, cfg['LAG_PROBE_INTERVAL']) for n in range(cfg['LOOPS'])
+            ]
+            self.__counter = itertools.count()
+            self.__local = threading.local()
 
     @classmethod
-    def run_async(cls, coro, timeout=5):
+    def run_async(cls, coro, timeout=5, shard_key: str=None):
         assert asyncio.coroutines.iscoroutine(coro)
-        fut = asyncio.run_coroutine_threadsafe(coro, loop=cls.__get_instance().__loop)
+        loop_thread = cls.__get_instance().__choose(shard_key)
+        fut = loop_thread.submit(coro)
         try:
             return fut.result(timeout)
-        except asyncio.TimeoutError:
+        except concurrent.futures.TimeoutError:
+            # Coroutine is cancelled instead of being left running
+            fut.cancel()
+            loop_thread.on_timeout()
             raise TimeoutError()
 
-    @staticmethod
-    def __run_event_loop_in_thread(loop):
-        asyncio.set_event_loop(loop)
-        loop.run_forever()
-
     @classmethod
-    def __get_loop(cls):
-        return cls.__get_instance().__loop
+    def stats(cls):
+        """Counters, queue depth (submitted and not finished coroutines) and lag in seconds of every loop"""
+        return [loop_thread.stats() for loop_thread in cls.__get_instance().__loops]
+
+    def __choose(self, shard_key: str=None) -> EventLoopThread:
+        if shard_key is not None:
+            index = zlib.crc32(shard_key.encode('utf-8'))
+        else:
+            index = getattr(self.__local, 'index', None)
+            if index is None:
+                index = next(self.__counter)
+                self.__local.index = index
+        return self.__loops[index % len(self.__loops)]
 
     @classmethod
     def __get_instance(cls):
         if not cls.__instance:
-            cls.__instance = Scheduler()
+            with cls.__instance_lock:
+                if not cls.__instance:
+                    cls.__instance = Scheduler()
         return cls.__instance
 
 
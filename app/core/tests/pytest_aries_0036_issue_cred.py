@@ -5,7 +5,7 @@ import pytest
 from django.db import connection
 from channels.db import database_sync_to_async
 
-from core.base import ReadOnlyChannel
+from core.base import ReadOnlyChannel, EndpointTransport
 from core.aries_rfcs.features.feature_0036_issue_credential.feature import *
 from core.indy_sdk_utils import *
 from state_machines.base import MachineIsDone
@@ -99,7 +99,6 @@ async def test_state_machines():
             success, data = await holder_endpoint.read(timeout=10)
             assert success is True
             content_type, wire_message = data
-            wire_message = wire_message.encode()
             assert content_type == EndpointTransport.DEFAULT_WIRE_CONTENT_TYPE
             # Holder receive offer
             await holder_state_machine.invoke(
@@ -108,7 +107,6 @@ async def test_state_machines():
             success, data = await issuer_endpoint.read(timeout=10)
             assert success is True
             content_type, wire_message = data
-            wire_message = wire_message.encode()
             assert content_type == EndpointTransport.DEFAULT_WIRE_CONTENT_TYPE
             # Issuer issue credential
             await issuer_state_machine.invoke(
@@ -117,7 +115,6 @@ async def test_state_machines():
             success, data = await holder_endpoint.read(timeout=10)
             assert success is True
             content_type, wire_message = data
-            wire_message = wire_message.encode()
             assert content_type == EndpointTransport.DEFAULT_WIRE_CONTENT_TYPE
             # Holder ack
             try:
@@ -131,7 +128,6 @@ async def test_state_machines():
             success, data = await issuer_endpoint.read(timeout=10)
             assert success is True
             content_type, wire_message = data
-            wire_message = wire_message.encode()
             # Issuer recv ack
             try:
                 await issuer_state_machine.invoke(
@@ -7,7 +7,7 @@ from django.conf import settings
 from channels.db import database_sync_to_async
 
 import core.codec
-from core.base import ReadOnlyChannel
+from core.base import ReadOnlyChannel, EndpointTransport
 from core.aries_rfcs.features.feature_0037_present_proof.feature import *
 from core.indy_sdk_utils import *
 from state_machines.base import MachineIsDone
@@ -155,7 +155,6 @@ async def test_state_machines_verify_success():
             success, data = await prover_endpoint.read(timeout=10)
             assert success is True
             content_type, wire_message = data
-            wire_message = wire_message.encode()
             assert content_type == EndpointTransport.DEFAULT_WIRE_CONTENT_TYPE
             # Prover receive request
             await prover_state_machine.invoke(
@@ -164,7 +163,6 @@ async def test_state_machines_verify_success():
             success, data = await verifier_endpoint.read(timeout=100)
             assert success is True
             content_type, wire_message = data
-            wire_message = wire_message.encode()
             assert content_type == EndpointTransport.DEFAULT_WIRE_CONTENT_TYPE
             # Verifier receive proof
             try:
@@ -178,7 +176,6 @@ async def test_state_machines_verify_success():
             success, data = await prover_endpoint.read(timeout=100)
             assert success is True
             content_type, wire_message = data
-            wire_message = wire_message.encode()
             try:
                 await prover_state_machine.invoke(
                     content_type, wire_message, prover_wallet
@@ -324,7 +321,6 @@ async def test_state_machines_verify_error():
             success, data = await prover_endpoint.read(timeout=10)
             assert success is True
             content_type, wire_message = data
-            wire_message = wire_message.encode()
             assert content_type == EndpointTransport.DEFAULT_WIRE_CONTENT_TYPE
             # Prover receive request
             await prover_state_machine.invoke(
@@ -333,7 +329,6 @@ async def test_state_machines_verify_error():
             success, data = await verifier_endpoint.read(timeout=10)
             assert success is True
             content_type, wire_message = data
-            wire_message = wire_message.encode()
             assert content_type == EndpointTransport.DEFAULT_WIRE_CONTENT_TYPE
             # Verifier receive proof
             try:
@@ -347,7 +342,6 @@ async def test_state_machines_verify_error():
             success, data = await prover_endpoint.read(timeout=100)
             assert success is True
             content_type, wire_message = data
-            wire_message = wire_message.encode()
             try:
                 await prover_state_machine.invoke(
                     content_type, wire_message, prover_wallet
@@ -5,7 +5,7 @@ from django.db import connection
 from channels.db import database_sync_to_async
 
 from core.wallet import WalletConnection, WalletAgent
-from core.base import ReadOnlyChannel, WriteOnlyChannel
+from core.base import ReadOnlyChannel, WriteOnlyChannel, EndpointTransport
 from core.aries_rfcs.features.feature_0160_connection_protocol.feature import *
 from state_machines.base import MachineIsDone
 
@@ -77,7 +77,6 @@ async def test_state_machines():
             success, data = await inviter_endpoint.read(timeout=10)
             assert success is True
             content_type, wire_message = data
-            wire_message = wire_message.encode()
             assert content_type == EndpointTransport.DEFAULT_WIRE_CONTENT_TYPE
             # inviter receive connection request
             await inviter_state_machine.invoke(
@@ -86,7 +85,6 @@ async def test_state_machines():
             success, data = await invitee_endpoint.read(timeout=10)
             assert success is True
             content_type, wire_message = data
-            wire_message = wire_message.encode()
             assert content_type == EndpointTransport.DEFAULT_WIRE_CONTENT_TYPE
             # Invitee receive connection response
             try:
@@ -100,7 +98,6 @@ async def test_state_machines():
             success, data = await inviter_endpoint.read(timeout=10)
             assert success is True
             content_type, wire_message = data
-            wire_message = wire_message.encode()
             assert content_type == EndpointTransport.DEFAULT_WIRE_CONTENT_TYPE
             # Inviter receive ack
             try:
@@ -167,21 +164,18 @@ async def test_feature_interfaces():
             success, data = await inviter_endpoint.read(timeout=10)
             assert success is True
             content_type, wire_message = data
-            wire_message = wire_message.encode()
             ok = await ConnectionProtocol.handle('inviter', wire_message, 'Inviter', inviter_endpoint.name)
             assert ok is True
             # Wait answer (connection response) on Invitee endpoint
             success, data = await invitee_endpoint.read(timeout=10)
             assert success is True
             content_type, wire_message = data
-            wire_message = wire_message.encode()
             # Emulate Invitee receiving connection response
             ok = await ConnectionProtocol.handle('invitee', wire_message, 'Invitee', invitee_endpoint.name)
             assert ok is True
             success, data = await inviter_endpoint.read(timeout=10)
             assert success is True
             content_type, wire_message = data
-            wire_message = wire_message.encode()
             # Emulate Inviter received ack message
             ok = await ConnectionProtocol.handle('inviter', wire_message, 'Inviter', inviter_endpoint.name)
             assert ok is True
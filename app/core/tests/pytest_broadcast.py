@@ -0,0 +1,103 @@
+import json
+import uuid
+import asyncio
+
+import pytest
+from aiohttp import web
+from django.db import connection
+from channels.db import database_sync_to_async
+
+from core.wallet import WalletConnection, WalletAgent
+from core.broadcast import group_by_endpoint, broadcast
+
+
+ENDPOINT_PORT = 8766
+
+
+async def remove_wallets(*names):
+
+    def remove_wallets_sync(*wallet_names):
+        with connection.cursor() as cursor:
+            for name in wallet_names:
+                db_name = WalletConnection.make_wallet_address(name)
+                cursor.execute("DROP DATABASE  IF EXISTS %s" % db_name)
+
+    await database_sync_to_async(remove_wallets_sync)(*names)
+
+
+def test_group_by_endpoint():
+    recipients = [
+        dict(their_did='did1', metadata=dict(their_endpoint='http://a', my_vk='vk1', their_vk='t1')),
+        dict(their_did='did2', metadata=dict(their_endpoint='http://b', my_vk='vk1', their_vk='t2')),
+        dict(their_did='did3', metadata=dict(their_endpoint='http://a', my_vk='vk1', their_vk='t3')),
+        dict(their_did='did4', metadata=dict(their_endpoint='http://a', my_vk='vk2', their_vk='t4')),
+    ]
+    groups = group_by_endpoint(recipients)
+    assert [key for key, _ in groups] == [('http://a', 'vk1'), ('http://b', 'vk1'), ('http://a', 'vk2')]
+    assert [r['their_did'] for r in groups[0][1]] == ['did1', 'did3']
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db
+async def test_broadcast():
+    agent_name = 'test_broadcast'
+    pass_phrase = 'pass_phrase'
+    received = []
+
+    async def handler(request):
+        received.append((request.match_info['path'], await request.read()))
+        return web.Response(status=202 if request.match_info['path'] == 'shared' else 410)
+
+    app = web.Application()
+    app.router.add_post('/{path}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', ENDPOINT_PORT).start()
+    await remove_wallets(agent_name)
+    conn = WalletConnection(agent_name, pass_phrase)
+    await conn.create()
+    try:
+        async def tests():
+            await asyncio.sleep(0.5)
+            await WalletAgent.open(agent_name, pass_phrase)
+            try:
+                my_did, my_vk = await WalletAgent.create_and_store_my_did(agent_name, pass_phrase)
+                base = 'http://127.0.0.1:%d/' % ENDPOINT_PORT
+                endpoints = [base + 'shared', base + 'shared', base + 'gone', None]
+                their_dids = []
+                for endpoint in endpoints:
+                    their_did, their_vk = await WalletAgent.create_and_store_my_did(agent_name, pass_phrase)
+                    metadata = dict(their_endpoint=endpoint, my_vk=my_vk, their_vk=their_vk)
+                    await WalletAgent.create_pairwise_statically(
+                        agent_name, pass_phrase, their_did, their_vk, my_did, metadata
+                    )
+                    their_dids.append(their_did)
+                message = dict(content=uuid.uuid4().hex)
+                results = await broadcast(
+                    agent_name, pass_phrase, message, their_dids=their_dids + ['unknown'], extra=dict(marker='x')
+                )
+                assert [item['their_did'] for item in results] == their_dids + ['unknown']
+                assert [item['status'] for item in results] == [202, 202, 410, None, None]
+                assert results[3]['error'] == 'Endpoint is unknown'
+                assert results[4]['error']
+                # Recipients sharing endpoint get single multi-recipient message
+                assert sorted(path for path, _ in received) == ['gone', 'shared']
+                wire_message = json.loads(dict(received)['shared'].decode('utf-8'))
+                assert wire_message.pop('marker') == 'x'
+                unpacked = await WalletAgent.unpack_message(agent_name, json.dumps(wire_message).encode('utf-8'))
+                assert message['content'] in unpacked['message']
+            finally:
+                await WalletAgent.close(agent_name, pass_phrase)
+
+        done, pending = await asyncio.wait(
+            [tests(), WalletAgent.process(agent_name)],
+            timeout=10
+        )
+        for f in pending:
+            f.cancel()
+        for f in done:
+            if f.exception():
+                raise f.exception()
+    finally:
+        await conn.delete()
+        await runner.cleanup()
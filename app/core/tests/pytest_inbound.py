@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from core.base import WireMessageFeature
+from core.wallet import WalletAgent
+from core.inbound import InboundRouter, message_family
+from core.aries_rfcs.features.feature_0015_acks.feature import AckMessage
+from core.aries_rfcs.features.feature_0048_trust_ping.feature import TrustPing
+from core.aries_rfcs.features.feature_0023_did_exchange.feature import DIDExchange
+from core.aries_rfcs.features.feature_0160_connection_protocol.feature import ConnectionProtocol
+from core.aries_rfcs.features.feature_0036_issue_credential.feature import IssueCredentialProtocol
+from core.aries_rfcs.features.feature_0037_present_proof.feature import PresentProofProtocol
+
+
+def make_feature(name: str, families: tuple, calls: list, success: bool=True):
+
+    class Feature(WireMessageFeature):
+
+        INBOUND_FAMILIES = families
+
+        @classmethod
+        async def handle(
+                cls, agent_name: str, wire_message: bytes, my_label: str=None, my_endpoint: str=None,
+                unpacked: dict=None
+        ) -> bool:
+            calls.append((name, unpacked))
+            return success
+
+    return Feature
+
+
+def test_inbound_router_candidates():
+    features = [IssueCredentialProtocol, PresentProofProtocol, ConnectionProtocol, DIDExchange]
+    router = InboundRouter(features, fallback=DIDExchange)
+    assert message_family(ConnectionProtocol.REQUEST) == ConnectionProtocol.FAMILY
+    assert message_family('problem_report') is None
+    assert router.candidates(ConnectionProtocol.REQUEST) == [ConnectionProtocol]
+    assert router.candidates(DIDExchange.RESPONSE) == [DIDExchange]
+    assert router.candidates(PresentProofProtocol.REQUEST_PRESENTATION) == [PresentProofProtocol]
+    assert router.candidates(IssueCredentialProtocol.set_protocol_version(
+        IssueCredentialProtocol.OFFER_CREDENTIAL, '1.0')
+    ) == [IssueCredentialProtocol]
+    assert router.candidates(AckMessage.ACK) == [IssueCredentialProtocol, PresentProofProtocol]
+    assert router.candidates(TrustPing.PING) == [ConnectionProtocol, DIDExchange]
+    # Unknown families are offered to fallback only
+    assert router.candidates('did:sov:BzCbsNYhMrjHiqZDTUASHg;spec/unknown/1.0/message') == [DIDExchange]
+    assert router.candidates(DIDExchange.PROBLEM_REPORT) == [DIDExchange]
+    assert InboundRouter(features).candidates('problem_report') == []
+
+
+@pytest.mark.asyncio
+async def test_inbound_router_unpacks_once(monkeypatch):
+    unpacks = []
+    calls = []
+
+    async def unpack_message(agent_name: str, wire_message: bytes):
+        unpacks.append(wire_message)
+        return dict(message=wire_message.decode('utf-8'), sender_verkey='sender', recipient_verkey='recipient')
+
+    monkeypatch.setattr(WalletAgent, 'unpack_message', unpack_message)
+    router = InboundRouter([
+        make_feature('connections', (ConnectionProtocol.FAMILY, TrustPing.FAMILY), calls),
+        make_feature('proofs', (PresentProofProtocol.FAMILY,), calls)
+    ])
+    wire_message = json.dumps({'@type': ConnectionProtocol.REQUEST}).encode('utf-8')
+    assert await router.route('agent', wire_message) is True
+    assert len(unpacks) == 1
+    assert [name for name, _ in calls] == ['connections']
+    assert calls[0][1]['sender_verkey'] == 'sender'
+    # Message without type is not routed
+    calls.clear()
+    assert await router.route('agent', json.dumps({'content': 'x'}).encode('utf-8')) is False
+    assert calls == []
+
+
+@pytest.mark.asyncio
+async def test_inbound_router_stops_at_first_success(monkeypatch):
+    calls = []
+
+    async def unpack_message(agent_name: str, wire_message: bytes):
+        return dict(message=wire_message.decode('utf-8'), sender_verkey='sender', recipient_verkey='recipient')
+
+    monkeypatch.setattr(WalletAgent, 'unpack_message', unpack_message)
+    router = InboundRouter(
+        [
+            make_feature('connections', (ConnectionProtocol.FAMILY, TrustPing.FAMILY), calls, success=False),
+            make_feature('didexchange', (DIDExchange.FAMILY, TrustPing.FAMILY), calls),
+            make_feature('pings', (TrustPing.FAMILY,), calls)
+        ],
+        fallback=make_feature('fallback', (), calls)
+    )
+    assert await router.route('agent', json.dumps({'@type': TrustPing.PING}).encode('utf-8')) is True
+    assert [name for name, _ in calls] == ['connections', 'didexchange']
+    # Unknown family is offered to fallback only
+    calls.clear()
+    assert await router.route('agent', json.dumps({'@type': 'problem_report'}).encode('utf-8')) is True
+    assert [name for name, _ in calls] == ['fallback']
+    # Without fallback message is left unprocessed
+    calls.clear()
+    router = InboundRouter([make_feature('connections', (ConnectionProtocol.FAMILY,), calls)])
+    assert await router.route('agent', json.dumps({'@type': 'problem_report'}).encode('utf-8')) is False
+    assert calls == []
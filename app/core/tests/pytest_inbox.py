@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+from django.conf import settings
+
+from core import inbox
+from core.redis_pool import RedisPool
+
+
+async def clean_inbox():
+    redis = await RedisPool.instance().connection()
+    keys = [inbox.DEAD_LETTER_STREAM, inbox.STATS_KEY]
+    for partition in range(inbox.config()['PARTITIONS']):
+        stream = inbox.partition_stream(partition)
+        keys.extend([stream.name, stream.consumer_alive_key, inbox.RETRY_KEY % partition])
+    await redis.execute(b'DEL', *keys)
+
+
+def test_inbox_partitions():
+    partitions = settings.INDY['MESSAGING']['INBOX']['PARTITIONS']
+    assert inbox.partition_of('wallet-1') == inbox.partition_of('wallet-1')
+    assert len({inbox.partition_of('wallet-%d' % n) for n in range(1000)}) == partitions
+
+
+@pytest.mark.asyncio
+async def test_inbox_ordering_and_retry():
+    await clean_inbox()
+    processed = []
+    failures = {'wallet-2': 1}
+
+    async def handler(agent_name, my_label, my_endpoint, content_type, body):
+        if body == b'dead':
+            raise RuntimeError('Malformed message')
+        if body == b'unheard':
+            # Nobody listens wallet wired messages
+            return 410
+        if failures.get(agent_name, 0) > 0:
+            failures[agent_name] -= 1
+            return 503
+        processed.append((agent_name, body))
+        return 202
+
+    cfg = settings.INDY['MESSAGING']['INBOX']
+    saved = dict(cfg)
+    cfg.update(ENABLED=True, MAX_ATTEMPTS=2, RETRY_DELAY_MIN=0.5, RETRY_POLL_INTERVAL=0.1)
+    try:
+        # Inbox does not accept messages while workers are not running
+        assert await inbox.enqueue('wallet-1', 'label', 'endpoint', 'application/json', b'0') is False
+        worker = asyncio.ensure_future(inbox.InboxWorker(handler).run())
+        await asyncio.sleep(0.5)
+        try:
+            for n in range(5):
+                for agent_name in ['wallet-1', 'wallet-2']:
+                    accepted = await inbox.enqueue(agent_name, 'label', 'endpoint', 'application/json', b'%d' % n)
+                    assert accepted is True
+            assert await inbox.enqueue('wallet-3', 'label', 'endpoint', 'application/json', b'dead') is True
+            assert await inbox.enqueue('wallet-4', 'label', 'endpoint', 'application/json', b'unheard') is True
+            for n in range(50):
+                stats = await inbox.inbox_stats()
+                if stats.get('processed') == 10 and stats.get('dead') == 2:
+                    break
+                await asyncio.sleep(0.1)
+            bodies = [body for name, body in processed if name == 'wallet-1']
+            assert bodies == [b'%d' % n for n in range(5)]
+            # Failed message is retried out of band, it doesn't block next messages
+            bodies = [body for name, body in processed if name == 'wallet-2']
+            assert bodies == [b'%d' % n for n in range(1, 5)] + [b'0']
+            stats = await inbox.inbox_stats()
+            assert stats['rejected'] == 1
+            assert stats['enqueued'] == 12
+            # 410 for JSON message is not retried
+            assert stats['failed_attempts'] == 4
+            assert stats['retried'] == 2
+            assert stats['dead'] == 2
+            assert stats['retries'] == 0
+            assert sum(stats['backlog'].values()) == 0
+        finally:
+            worker.cancel()
+            await asyncio.sleep(0.1)
+    finally:
+        cfg.clear()
+        cfg.update(saved)
+        await clean_inbox()
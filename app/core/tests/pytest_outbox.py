@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from django.conf import settings
+
+from core import outbox
+from core.base import EndpointTransport
+from core.http_pool import HttpPool
+from core.redis_pool import RedisPool
+from core.streams import RedisStream
+
+
+OUTBOX_PORT = 8765
+
+
+async def clean_outbox():
+    redis = await RedisPool.instance().connection()
+    await redis.execute(
+        b'DEL', outbox.OUTBOX_STREAM, outbox.RETRY_KEY, outbox.DEAD_LETTER_STREAM, outbox.STATS_KEY,
+        outbox.LATENCY_KEY
+    )
+
+
+async def start_endpoint(handler):
+    app = web.Application()
+    app.router.add_post('/{path}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', OUTBOX_PORT)
+    await site.start()
+    return runner
+
+
+def test_outbox_retry_delay():
+    cfg = settings.INDY['MESSAGING']['OUTBOX']
+    assert outbox.retry_delay(1) == cfg['BACKOFF_MIN']
+    assert outbox.retry_delay(2) == cfg['BACKOFF_MIN'] * 2
+    assert outbox.retry_delay(100) == cfg['BACKOFF_MAX']
+
+
+@pytest.mark.asyncio
+async def test_outbox_delivery():
+    await clean_outbox()
+    received = []
+    failures = {'retry': 1}
+
+    async def handler(request):
+        path = request.match_info['path']
+        if path == 'retry' and failures['retry'] > 0:
+            failures['retry'] -= 1
+            return web.Response(status=503)
+        if path == 'rejected':
+            return web.Response(status=400)
+        received.append((path, await request.read()))
+        return web.Response(status=202)
+
+    cfg = settings.INDY['MESSAGING']['OUTBOX']
+    saved = dict(cfg)
+    cfg.update(ENABLED=True, BACKOFF_MIN=0.1, RETRY_POLL_INTERVAL=0.1)
+    runner = await start_endpoint(handler)
+    worker = asyncio.ensure_future(outbox.OutboxWorker().run())
+    try:
+        base = 'http://127.0.0.1:%d/' % OUTBOX_PORT
+        await outbox.send_wire_message(base + 'ok', b'{"message": 1}')
+        await outbox.send_wire_message(base + 'retry', b'{"message": 2}')
+        await outbox.send_wire_message(base + 'rejected', b'{"message": 3}')
+        for n in range(50):
+            stats = await outbox.outbox_stats()
+            if stats.get('delivered') == 2 and stats.get('dead') == 1:
+                break
+            await asyncio.sleep(0.1)
+        assert sorted(received) == [('ok', b'{"message": 1}'), ('retry', b'{"message": 2}')]
+        assert stats['enqueued'] == 3
+        assert stats['delivered'] == 2
+        assert stats['retried'] == 1
+        assert stats['dead'] == 1
+        assert stats['retries'] == 0
+    finally:
+        worker.cancel()
+        await runner.cleanup()
+        cfg.clear()
+        cfg.update(saved)
+        await clean_outbox()
+
+
+@pytest.mark.asyncio
+async def test_outbox_claim_pending():
+    await clean_outbox()
+    received = []
+
+    async def handler(request):
+        received.append(await request.read())
+        return web.Response(status=202)
+
+    cfg = settings.INDY['MESSAGING']['OUTBOX']
+    saved = dict(cfg)
+    cfg.update(ENABLED=True, CLAIM_IDLE=0.2, MAINTENANCE_INTERVAL=0.1)
+    runner = await start_endpoint(handler)
+    stream = RedisStream(outbox.OUTBOX_STREAM, outbox.OUTBOX_GROUP)
+    await stream.create_group()
+    await outbox.enqueue('http://127.0.0.1:%d/endpoint' % OUTBOX_PORT, b'{"message": 1}')
+    # Worker crashed after message was delivered to it
+    assert len(await stream.read('crashed-worker')) == 1
+    worker = outbox.OutboxWorker()
+    task = asyncio.ensure_future(worker.run())
+    try:
+        for n in range(50):
+            stats = await outbox.outbox_stats()
+            if stats.get('delivered') == 1 and worker.consumer in stats['latency']:
+                break
+            await asyncio.sleep(0.1)
+        assert received == [b'{"message": 1}']
+        assert stats['claimed'] == 1
+        assert stats['backlog'] == 0
+        assert stats['latency'][worker.consumer]['count'] == 1
+    finally:
+        task.cancel()
+        await runner.cleanup()
+        cfg.clear()
+        cfg.update(saved)
+        await clean_outbox()
+
+
+@pytest.mark.asyncio
+async def test_http_pool_keep_alive():
+    peers = []
+
+    async def handler(request):
+        peers.append(request.transport.get_extra_info('peername'))
+        return web.Response(status=202)
+
+    runner = await start_endpoint(handler)
+    try:
+        session = HttpPool.instance().session()
+        address = 'http://127.0.0.1:%d/endpoint' % OUTBOX_PORT
+        for n in range(3):
+            assert await EndpointTransport(address).send_wire_message(b'{}') == 202
+        assert HttpPool.instance().session() is session
+        # Requests are sent over single keep-alive connection
+        assert len(peers) == 3
+        assert len(set(peers)) == 1
+    finally:
+        await HttpPool.instance().close()
+        await runner.cleanup()
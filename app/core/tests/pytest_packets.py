@@ -0,0 +1,42 @@
+import uuid
+
+import pytest
+
+from core.base import *
+from core.packets import encode_packet, decode_packet, JSONPacketCodec, MsgPackPacketCodec
+
+
+def test_packet_codecs():
+    packet = dict(kind='data', body=dict(wire_message=b'{"protected": "xxx"}', items=[1, 'two', None]))
+    encoded = encode_packet(packet, codec='msgpack')
+    assert encoded[0] == MsgPackPacketCodec.version
+    assert decode_packet(encoded) == packet
+    # Legacy packets are not prefixed with version
+    encoded = encode_packet(packet, codec='json')
+    assert encoded.startswith(b'{')
+    decoded = decode_packet(encoded)
+    assert decoded['body']['wire_message'] == '{"protected": "xxx"}'
+    assert decoded['body']['items'] == [1, 'two', None]
+    with pytest.raises(ValueError):
+        decode_packet(b'\xff')
+
+
+@pytest.mark.asyncio
+async def test_channel_carries_bytes():
+    name = 'test-channel-bytes'
+    r_chan = await ReadOnlyChannel.create(name=name)
+    w_chan = await WriteOnlyChannel.create(name=name)
+    try:
+        expected_data = ['application/ssi-agent-wire', uuid.uuid4().hex.encode()]
+        assert await w_chan.write(expected_data) is True
+        success, data = await r_chan.read(timeout=3)
+        assert success is True
+        assert data == expected_data
+        # Reader accepts legacy json packets
+        await w_chan.pool.publish(w_chan.name, JSONPacketCodec.encode(dict(kind='data', body='legacy')))
+        success, data = await r_chan.read(timeout=3)
+        assert success is True
+        assert data == 'legacy'
+    finally:
+        await r_chan.close()
+        await w_chan.close()
@@ -0,0 +1,67 @@
+import uuid
+import asyncio
+
+import pytest
+
+from core.base import *
+from core.redis_pool import RedisPool
+
+
+@pytest.mark.asyncio
+async def test_redis_pool_shared_between_channels():
+    name = 'test-channel-pool'
+    r_chan1 = await ReadOnlyChannel.create(name=name)
+    r_chan2 = await ReadOnlyChannel.create(name=name)
+    w_chan = await WriteOnlyChannel.create(name=name)
+    try:
+        assert r_chan1.pool is r_chan2.pool is w_chan.pool is RedisPool.instance()
+        expected_data = {'marker': uuid.uuid4().hex}
+        counter = await w_chan.broadcast(expected_data)
+        assert counter == 2
+        success1, data1 = await r_chan1.read(timeout=3)
+        success2, data2 = await r_chan2.read(timeout=3)
+        assert success1 is True and success2 is True
+        assert data1 == expected_data
+        assert data2 == expected_data
+    finally:
+        await r_chan1.close()
+        await r_chan2.close()
+        await w_chan.close()
+
+
+@pytest.mark.asyncio
+async def test_redis_pool_unsubscribe_last_reader():
+    name = 'test-channel-pool-unsubscribe'
+    r_chan1 = await ReadOnlyChannel.create(name=name)
+    r_chan2 = await ReadOnlyChannel.create(name=name)
+    w_chan = await WriteOnlyChannel.create(name=name)
+    try:
+        await r_chan1.close()
+        assert await w_chan.write({'marker': uuid.uuid4().hex}) is True
+        await r_chan2.close()
+        assert await w_chan.write({'marker': uuid.uuid4().hex}) is False
+    finally:
+        await w_chan.close()
+
+
+@pytest.mark.asyncio
+async def test_redis_pool_reconnect():
+    name = 'test-channel-pool-reconnect'
+    pool = RedisPool.instance()
+    r_chan = await ReadOnlyChannel.create(name=name)
+    w_chan = await WriteOnlyChannel.create(name=name)
+    try:
+        redis = await pool.connection()
+        redis.close()
+        await redis.wait_closed()
+        # lost subscription is restored by pool itself or by health check
+        await pool.check_health()
+        assert await pool.check_health() is True
+        expected_data = {'marker': uuid.uuid4().hex}
+        assert await w_chan.write(expected_data) is True
+        success, data = await r_chan.read(timeout=3)
+        assert success is True
+        assert data == expected_data
+    finally:
+        await r_chan.close()
+        await w_chan.close()
@@ -31,3 +31,98 @@ async def test_req_resp_sane():
         assert resp == ping
     finally:
         f.cancel()
+
+
+@pytest.mark.asyncio
+async def test_req_resp_multiplexed(settings):
+    settings.REDIS_RPC_MULTIPLEXED = True
+    reqresp = AsyncReqResp('test-address-multiplexed')
+    pings = [{'marker': uuid.uuid4().hex} for _ in range(10)]
+    reply_channels = set()
+
+    async def ponger():
+        await reqresp.start_listening()
+        try:
+            # reply in reverse order to check requests matching
+            received = []
+            for _ in range(len(pings)):
+                received.append(await reqresp.wait_req())
+            for data, chan in reversed(received):
+                reply_channels.add(chan.__class__)
+                await chan.write(data)
+                await chan.close()
+        finally:
+            await reqresp.stop_listening()
+    try:
+        f = asyncio.ensure_future(ponger())
+        await asyncio.sleep(1)
+
+        results = await asyncio.gather(*[reqresp.req(ping, timeout=5) for ping in pings])
+        assert reply_channels == {ReplyChannel}
+        for ping, (success, resp) in zip(pings, results):
+            assert success is True
+            assert resp == ping
+    finally:
+        f.cancel()
+
+
+@pytest.mark.asyncio
+async def test_req_resp_streams(settings):
+    settings.REDIS_RPC_TRANSPORT = 'streams'
+    address = 'test-address-streams-%s' % uuid.uuid4().hex
+    pings = [{'marker': uuid.uuid4().hex} for _ in range(5)]
+
+    # Agent is not running: request is rejected immediately
+    success, resp = await AsyncReqResp(address).req(pings[0], timeout=5)
+    assert success is False
+
+    listener = AsyncReqResp(address)
+    await listener.start_listening()
+    # Agent is "restarted" while requests are delivered but not acknowledged
+    req_futures = [asyncio.ensure_future(AsyncReqResp(address).req(ping, timeout=10)) for ping in pings]
+    await asyncio.sleep(0.5)
+    data, chan = await listener.wait_req()
+    assert data == pings[0]
+    await listener.stop_listening()
+    assert await listener.backlog() == len(pings)
+
+    restarted = AsyncReqResp(address)
+    await restarted.start_listening()
+    try:
+        for _ in range(len(pings)):
+            data, chan = await restarted.wait_req()
+            assert isinstance(chan, StreamReplyChannel)
+            await chan.write(data)
+            await chan.close()
+        results = await asyncio.gather(*req_futures)
+        for ping, (success, resp) in zip(pings, results):
+            assert success is True
+            assert resp == ping
+        assert await restarted.backlog() == 0
+    finally:
+        await restarted.stop_listening()
+
+
+@pytest.mark.asyncio
+async def test_req_resp_streams_busy_agent(settings):
+    settings.REDIS_RPC_TRANSPORT = 'streams'
+    settings.REDIS_STREAMS = dict(settings.REDIS_STREAMS, CONSUMER_TTL=1)
+    address = 'test-address-streams-%s' % uuid.uuid4().hex
+    listener = AsyncReqResp(address)
+    await listener.start_listening()
+    try:
+        # Agent doesn't read stream for several TTLs while it is busy but is still reachable
+        await asyncio.sleep(3)
+        ping = {'marker': uuid.uuid4().hex}
+        req_future = asyncio.ensure_future(AsyncReqResp(address).req(ping, timeout=5))
+        data, chan = await listener.wait_req()
+        await chan.write(data)
+        await chan.close()
+        success, resp = await req_future
+        assert success is True
+        assert resp == ping
+    finally:
+        await listener.stop_listening()
+    # Stopped agent is not reachable
+    success, resp = await AsyncReqResp(address).req(ping, timeout=5)
+    assert success is False
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+from django.db import connection
+from channels.db import database_sync_to_async
+
+from core.wallet import *
+from core.supervisor import AgentSupervisor
+
+
+async def remove_wallets(*names):
+
+    def remove_wallets_sync(*wallet_names):
+        with connection.cursor() as cursor:
+            for name in wallet_names:
+                db_name = WalletConnection.make_wallet_address(name)
+                cursor.execute("DROP DATABASE  IF EXISTS %s" % db_name)
+
+    await database_sync_to_async(remove_wallets_sync)(*names)
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db
+async def test_supervisor_deduplicates_starts():
+    agent_name = 'test_supervisor_dedup'
+    pass_phrase = 'pass_phrase'
+    await remove_wallets(agent_name)
+    conn = WalletConnection(agent_name, pass_phrase)
+    await conn.create()
+    supervisor = AgentSupervisor.instance()
+    try:
+        await asyncio.gather(*[supervisor.ensure_running(agent_name, timeout=30) for _ in range(5)])
+        assert await WalletAgent.ping(agent_name) is True
+        stats = supervisor.stats()
+        assert stats['starts'] == 1
+        assert stats['start_latency']['count'] == 1
+        # Agent is already running
+        await supervisor.ensure_running(agent_name, timeout=30)
+        assert supervisor.stats()['starts'] == 1
+    finally:
+        await WalletAgent.open(agent_name, pass_phrase)
+        await WalletAgent.close(agent_name, pass_phrase)
+        supervisor.terminate()
+        await conn.delete()
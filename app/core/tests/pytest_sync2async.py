@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+from core.sync2async import run_async, Scheduler
+
+
+async def current_loop():
+    return asyncio.get_event_loop()
+
+
+def test_run_async_sharding():
+    assert run_async(current_loop()) is run_async(current_loop())
+    assert run_async(current_loop(), shard_key='wallet-1') is run_async(current_loop(), shard_key='wallet-1')
+    loops = {run_async(current_loop(), shard_key='wallet-%d' % n) for n in range(100)}
+    assert len(loops) == len(Scheduler.stats())
+
+
+def test_run_async_timeout_cancels_coroutine():
+    state = dict(cancelled=False)
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            state['cancelled'] = True
+            raise
+
+    timeouts = sum(stat['timeouts'] for stat in Scheduler.stats())
+    with pytest.raises(TimeoutError):
+        run_async(slow(), timeout=0.5, shard_key='slow')
+    run_async(asyncio.sleep(0.1), shard_key='slow')
+    assert state['cancelled'] is True
+    stats = Scheduler.stats()
+    assert sum(stat['timeouts'] for stat in stats) == timeouts + 1
+    assert all(stat['queue_depth'] >= 0 for stat in stats)
+    assert all(stat['lag'] >= 0 for stat in stats)
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+from django.db import connection
+from channels.db import database_sync_to_async
+
+from core.wallet import *
+from core.hashring import HashRing
+from core.wallet_host import WalletHost, attach_to_host
+
+
+async def remove_wallets(*names):
+
+    def remove_wallets_sync(*wallet_names):
+        with connection.cursor() as cursor:
+            for name in wallet_names:
+                db_name = WalletConnection.make_wallet_address(name)
+                cursor.execute("DROP DATABASE  IF EXISTS %s" % db_name)
+
+    await database_sync_to_async(remove_wallets_sync)(*names)
+
+
+def test_hash_ring_stable():
+    keys = ['wallet-%d' % n for n in range(1000)]
+    ring = HashRing(['host-1', 'host-2', 'host-3'])
+    assignment = {key: ring.get_node(key) for key in keys}
+    assert set(assignment.values()) == {'host-1', 'host-2', 'host-3'}
+    # Only keys of the new node are remapped
+    ring = HashRing(['host-1', 'host-2', 'host-3', 'host-4'])
+    moved = [key for key in keys if ring.get_node(key) != assignment[key]]
+    assert all(ring.get_node(key) == 'host-4' for key in moved)
+    assert len(moved) < len(keys) / 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db
+async def test_wallet_host_serves_many_wallets(settings):
+    agent_names = ['test_wallet_host_1', 'test_wallet_host_2']
+    pass_phrase = 'pass_phrase'
+    settings.INDY['WALLET_SETTINGS']['HOSTS']['NAMES'] = ['test-host']
+    await remove_wallets(*agent_names)
+    for name in agent_names:
+        await WalletConnection(name, pass_phrase).create()
+    host = WalletHost('test-host', max_open_wallets=1)
+    host_task = asyncio.ensure_future(host.run())
+    try:
+        await asyncio.sleep(0.5)
+        assert await attach_to_host(agent_names[0], timeout=5) is True
+        await WalletAgent.open(agent_names[0], pass_phrase)
+        did, verkey = await WalletAgent.create_and_store_my_did(agent_names[0], pass_phrase)
+        # Host is full: least recently used agent is evicted
+        assert await attach_to_host(agent_names[1], timeout=5) is True
+        await WalletAgent.open(agent_names[1], pass_phrase)
+        assert host.stats()['evictions'] == 1
+        assert list(host.agents.keys()) == [agent_names[1]]
+        await asyncio.sleep(0.5)
+        assert await WalletAgent.ping(agent_names[0]) is False
+        assert await is_hibernated(agent_names[0]) is True
+        # Evicted wallet is reopened on demand
+        assert await WalletAgent.key_for_local_did(agent_names[0], pass_phrase, did) == verkey
+        assert await is_hibernated(agent_names[0]) is False
+        await WalletAgent.close(agent_names[0], pass_phrase)
+    finally:
+        settings.INDY['WALLET_SETTINGS']['HOSTS']['NAMES'] = []
+        host_task.cancel()
+        for name in agent_names:
+            await WalletConnection(name, pass_phrase).delete()
+
+
+@pytest.mark.asyncio
+async def test_wallet_host_concurrent_attach():
+    agent_names = ['test_wallet_host_concurrent_%d' % n for n in range(3)]
+    host = WalletHost('test-host-concurrent', max_open_wallets=2)
+    try:
+        # Every wallet is requested twice while pings are in progress
+        await asyncio.gather(*[host.attach(name) for name in agent_names + agent_names])
+        assert len(host.agents) == 2
+        assert host.evictions == 1
+    finally:
+        tasks = list(host.agents.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
@@ -7,7 +7,9 @@ from channels.db import database_sync_to_async
 
 from state_machines.base import *
 from core.wallet import *
+from core.cache import LRUCache
 from core.models import *
+from core.concurrency import CommandScheduler, SchedulerBusyError
 from core.aries_rfcs.features.feature_0095_basic_message.feature import BasicMessage
 from core.serializer.json_serializer import JSONSerializer as Serializer
 
@@ -406,3 +408,450 @@ async def test_pack_message_multi_recp_keys():
         await conn_sender.delete()
         await conn_recipient1.delete()
         await conn_recipient2.delete()
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db
+async def test_wallet_agent_concurrent_commands():
+    agent_name = 'test_wallet_agent_concurrent'
+    pass_phrase = 'pass_phrase'
+
+    await remove_wallets(agent_name)
+    conn = WalletConnection(agent_name, pass_phrase)
+    await conn.create()
+    try:
+        async def tests():
+            await asyncio.sleep(0.5)
+            await WalletAgent.open(agent_name, pass_phrase)
+            try:
+                dids = await asyncio.gather(
+                    *[WalletAgent.create_and_store_my_did(agent_name, pass_phrase) for _ in range(10)]
+                )
+                pings = await asyncio.gather(*[WalletAgent.ping(agent_name) for _ in range(10)])
+                assert all(pings)
+                verkeys = await asyncio.gather(
+                    *[WalletAgent.key_for_local_did(agent_name, pass_phrase, did) for did, _ in dids]
+                )
+                assert verkeys == [verkey for _, verkey in dids]
+            finally:
+                await WalletAgent.close(agent_name, pass_phrase)
+
+        done, pending = await asyncio.wait(
+            [tests(), WalletAgent.process(agent_name)],
+            timeout=10
+        )
+        for f in pending:
+            f.cancel()
+        for f in done:
+            if f.exception():
+                raise f.exception()
+    finally:
+        await conn.delete()
+
+
+@pytest.mark.asyncio
+async def test_command_scheduler_limits():
+    scheduler = CommandScheduler(
+        max_in_flight=4,
+        classes={
+            'cheap': {'CONCURRENCY': 4, 'MAX_QUEUED': 4},
+            'expensive': {'CONCURRENCY': 1, 'MAX_QUEUED': 2}
+        }
+    )
+    running = dict(cheap=0, expensive=0)
+    max_running = dict(cheap=0, expensive=0)
+    order = []
+
+    async def command(class_name, marker):
+        running[class_name] += 1
+        max_running[class_name] = max(max_running[class_name], running[class_name])
+        await asyncio.sleep(0.1)
+        running[class_name] -= 1
+        order.append(marker)
+
+    await scheduler.submit('expensive', command('expensive', 'e1'))
+    await scheduler.submit('expensive', command('expensive', 'e2'))
+    await scheduler.submit('cheap', command('cheap', 'c1'))
+    await scheduler.submit('cheap', command('cheap', 'c2'))
+    assert scheduler.in_flight == 4
+    # Commands over limit are rejected without waiting
+    with pytest.raises(SchedulerBusyError):
+        await scheduler.submit('cheap', command('cheap', 'c3'))
+    await scheduler.drain()
+    assert scheduler.in_flight == 0
+    assert max_running == dict(cheap=2, expensive=1)
+    # cheap commands are not blocked by queued expensive ones
+    assert order.index('c1') < order.index('e2')
+    assert order.index('c2') < order.index('e2')
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db
+async def test_wallet_agent_create_many():
+    agent_name = 'test_wallet_agent_create_many'
+    pass_phrase = 'pass_phrase'
+
+    await remove_wallets(agent_name)
+    conn = WalletConnection(agent_name, pass_phrase)
+    await conn.create()
+    try:
+        task = asyncio.ensure_future(WalletAgent.process(agent_name))
+        await asyncio.sleep(1)
+        try:
+            await WalletAgent.open(agent_name, pass_phrase)
+            seed = '0' * 32
+            items = [dict(seed=seed, metadata=dict(label='first')), dict(), dict(seed=seed)]
+            results = await WalletAgent.create_many(agent_name, pass_phrase, items)
+            assert len(results) == 3
+            # Items are created concurrently, one of DIDs with the same seed fails
+            seeded = [result for result in (results[0], results[2]) if 'ret' in result]
+            failed = [result for result in (results[0], results[2]) if 'error' in result]
+            assert len(seeded) == 1 and len(failed) == 1
+            assert failed[0]['error']['error_code'] == WalletOperationError.error_code
+            did = seeded[0]['ret']['did']
+            verkey = seeded[0]['ret']['verkey']
+            assert results[1]['ret']['did'] != did
+            assert await WalletAgent.did_for_key(agent_name, pass_phrase, verkey) == did
+            results = await WalletAgent.create_many(agent_name, pass_phrase, [dict(), dict()], keys_only=True)
+            assert all(result['ret']['did'] is None and result['ret']['verkey'] for result in results)
+            with pytest.raises(WalletOperationError):
+                await WalletAgent.create_many(
+                    agent_name, pass_phrase, [dict()] * (WalletAgent.CREATE_MANY_CHUNK + 1)
+                )
+        finally:
+            await WalletAgent.close(agent_name, pass_phrase)
+            await asyncio.sleep(1)
+    finally:
+        await conn.delete()
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db
+async def test_wallet_agent_stats():
+    agent_name = 'test_wallet_agent_stats'
+    pass_phrase = 'pass_phrase'
+
+    await remove_wallets(agent_name)
+    conn = WalletConnection(agent_name, pass_phrase)
+    await conn.create()
+    try:
+        async def tests():
+            await asyncio.sleep(0.5)
+            await WalletAgent.open(agent_name, pass_phrase)
+            try:
+                did, verkey = await WalletAgent.create_and_store_my_did(agent_name, pass_phrase)
+                await WalletAgent.key_for_local_did(agent_name, pass_phrase, did)
+                with pytest.raises(WalletAccessDenied):
+                    await WalletAgent.key_for_local_did(agent_name, 'invalid', did)
+                stats = await WalletAgent.stats(agent_name, pass_phrase)
+                assert stats[WalletAgent.COMMAND_CREATE_AND_STORE_MY_DID]['calls'] == 1
+                assert stats[WalletAgent.COMMAND_CREATE_AND_STORE_MY_DID]['errors'] == 0
+                assert stats[WalletAgent.COMMAND_KEY_FOR_LOCAL_DID]['calls'] == 2
+                assert stats[WalletAgent.COMMAND_KEY_FOR_LOCAL_DID]['errors'] == 1
+                latency = stats[WalletAgent.COMMAND_KEY_FOR_LOCAL_DID]['latency']
+                assert latency['count'] == 2
+                assert sum(latency['buckets'].values()) == 2
+            finally:
+                await WalletAgent.close(agent_name, pass_phrase)
+
+        done, pending = await asyncio.wait(
+            [tests(), WalletAgent.process(agent_name)],
+            timeout=10
+        )
+        for f in pending:
+            f.cancel()
+        for f in done:
+            if f.exception():
+                raise f.exception()
+    finally:
+        await conn.delete()
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db
+async def test_wallet_agent_batch():
+    agent_name = 'test_wallet_agent_batch'
+    pass_phrase = 'pass_phrase'
+
+    await remove_wallets(agent_name)
+    conn = WalletConnection(agent_name, pass_phrase)
+    await conn.create()
+    try:
+        async def tests():
+            await asyncio.sleep(0.5)
+            await WalletAgent.open(agent_name, pass_phrase)
+            try:
+                results = await WalletAgent.batch(
+                    agent_name, pass_phrase,
+                    commands=[
+                        dict(command=WalletAgent.COMMAND_CREATE_AND_STORE_MY_DID, kwargs=dict()),
+                        dict(command=WalletAgent.COMMAND_KEY_FOR_LOCAL_DID, kwargs=dict(did={'$ref': '0.0'})),
+                        dict(command=WalletAgent.COMMAND_DID_FOR_KEY, kwargs=dict(key={'$ref': '1'})),
+                    ]
+                )
+                assert len(results) == 3
+                did, verkey = batch_item_result(results[0])
+                assert batch_item_result(results[1]) == verkey
+                assert batch_item_result(results[2]) == did
+                # Errors are reported per item
+                results = await WalletAgent.batch(
+                    agent_name, pass_phrase,
+                    commands=[
+                        dict(command=WalletAgent.COMMAND_CLOSE),
+                        dict(command=WalletAgent.COMMAND_KEY_FOR_LOCAL_DID, kwargs=dict(did=did)),
+                    ],
+                    stop_on_error=False
+                )
+                assert len(results) == 2
+                with pytest.raises(WalletOperationError):
+                    batch_item_result(results[0])
+                assert batch_item_result(results[1]) == verkey
+                # Credentials are checked for whole batch
+                with pytest.raises(WalletAccessDenied):
+                    await WalletAgent.batch(
+                        agent_name, 'invalid',
+                        commands=[dict(command=WalletAgent.COMMAND_KEY_FOR_LOCAL_DID, kwargs=dict(did=did))]
+                    )
+            finally:
+                await WalletAgent.close(agent_name, pass_phrase)
+
+        done, pending = await asyncio.wait(
+            [tests(), WalletAgent.process(agent_name)],
+            timeout=10
+        )
+        for f in pending:
+            f.cancel()
+        for f in done:
+            if f.exception():
+                raise f.exception()
+    finally:
+        await conn.delete()
+
+
+def test_wallet_agent_batch_command_class():
+    cheap = [dict(command=WalletAgent.COMMAND_CREATE_KEY), dict(command=WalletAgent.COMMAND_PING)]
+    expensive = cheap + [dict(command=WalletAgent.COMMAND_PROVER_CREATE_PROOF)]
+    assert WalletAgent.command_class(WalletAgent.COMMAND_BATCH, dict(commands=cheap)) == 'cheap'
+    assert WalletAgent.command_class(WalletAgent.COMMAND_BATCH, dict(commands=expensive)) == 'expensive'
+    assert WalletAgent.command_class(WalletAgent.COMMAND_BATCH, dict(commands='malformed')) == 'cheap'
+    assert WalletAgent.command_class(WalletAgent.COMMAND_BATCH) == 'cheap'
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db
+async def test_wallet_agent_hibernation():
+    agent_name = 'test_wallet_agent_hibernation'
+    pass_phrase = 'pass_phrase'
+    agent_settings = settings.INDY['WALLET_SETTINGS']['AGENT']
+
+    await remove_wallets(agent_name)
+    conn = WalletConnection(agent_name, pass_phrase)
+    await conn.create()
+    idle_ttl = agent_settings['IDLE_TTL']
+    agent_settings['IDLE_TTL'] = 1
+    try:
+        process = asyncio.ensure_future(WalletAgent.process(agent_name))
+        await asyncio.sleep(0.5)
+        await WalletAgent.open(agent_name, pass_phrase)
+        # Pings do not keep agent alive
+        assert await WalletAgent.ping(agent_name) is True
+        await asyncio.wait([process], timeout=3)
+        assert process.done()
+        assert await is_hibernated(agent_name) is True
+        assert await WalletAgent.ping(agent_name) is False
+    finally:
+        agent_settings['IDLE_TTL'] = idle_ttl
+        await conn.delete()
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db
+async def test_wallet_agent_heartbeat():
+    agent_name = 'test_wallet_agent_heartbeat'
+    pass_phrase = 'pass_phrase'
+
+    await remove_wallets(agent_name)
+    conn = WalletConnection(agent_name, pass_phrase)
+    await conn.create()
+    try:
+        assert await read_heartbeat(agent_name) is None
+        process = asyncio.ensure_future(WalletAgent.process(agent_name))
+        await asyncio.sleep(0.5)
+        heartbeat = await read_heartbeat(agent_name)
+        assert heartbeat['state'] == HEARTBEAT_STATE_RUNNING
+        assert heartbeat['pid'] == os.getpid()
+        assert await WalletAgent.is_open(agent_name) is False
+        await WalletAgent.open(agent_name, pass_phrase)
+        assert (await read_heartbeat(agent_name))['state'] == HEARTBEAT_STATE_OPEN
+        assert await WalletAgent.is_open(agent_name) is True
+        live = await WalletAgent.live_agents([agent_name, 'test_wallet_agent_heartbeat_missing'])
+        assert list(live.keys()) == [agent_name]
+        await WalletAgent.close(agent_name, pass_phrase)
+        await asyncio.wait([process], timeout=5)
+        assert process.done()
+        assert await read_heartbeat(agent_name) is None
+        assert await WalletAgent.live_agents([agent_name]) == {}
+    finally:
+        await conn.delete()
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db
+async def test_wallet_agent_session_token():
+    agent_name = 'test_wallet_agent_session_token'
+    pass_phrase = 'pass_phrase'
+
+    await remove_wallets(agent_name)
+    conn = WalletConnection(agent_name, pass_phrase)
+    await conn.create()
+    try:
+        process = asyncio.ensure_future(WalletAgent.process(agent_name))
+        await asyncio.sleep(0.5)
+        await WalletAgent.open(agent_name, pass_phrase)
+        key = session_key(agent_name, pass_phrase)
+        token, _ = AGENT_SESSIONS[key]
+        # Commands are authorized with session token
+        packet = session_packet(
+            agent_name, dict(command=WalletAgent.COMMAND_LIST_MY_DIDS_WITH_META, pass_phrase=pass_phrase)
+        )
+        assert 'pass_phrase' not in packet
+        assert packet['session_token'] == token
+        await WalletAgent.list_my_dids_with_meta(agent_name, pass_phrase)
+        # Token of another caller is rejected
+        requests = AsyncReqResp(WalletConnection.make_wallet_address(agent_name))
+        success, resp = await requests.req(dict(packet, caller='other:1'), 5)
+        assert success is True
+        assert resp['error']['error_code'] == WalletAccessDenied.error_code
+        # Unknown token is replaced by the new one
+        AGENT_SESSIONS[key] = ('invalid', AGENT_SESSIONS[key][1])
+        await WalletAgent.list_my_dids_with_meta(agent_name, pass_phrase)
+        assert AGENT_SESSIONS[key][0] not in ['invalid', token]
+        with pytest.raises(WalletAccessDenied):
+            await WalletAgent.list_my_dids_with_meta(agent_name, 'invalid')
+        await WalletAgent.close(agent_name, pass_phrase)
+        assert key not in AGENT_SESSIONS
+        await asyncio.wait([process], timeout=5)
+    finally:
+        await conn.delete()
+
+
+def test_lru_cache():
+    cache = LRUCache(max_size=2)
+    cache.put('a', dict(value=1))
+    cache.put('b', 2)
+    value = cache.get('a')
+    value['value'] = 100
+    assert cache.get('a') == dict(value=1)
+    # 'b' is least recently used
+    cache.put('c', 3)
+    assert cache.get('b') is LRUCache.MISSING
+    generation = cache.generation
+    cache.invalidate('a')
+    assert cache.get('a') is LRUCache.MISSING
+    cache.put('a', 1, generation)
+    assert cache.get('a') is LRUCache.MISSING
+    assert cache.stats() == dict(size=1, max_size=2, hits=2, misses=3)
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db
+async def test_wallet_connection_cache():
+    agent_name = 'test_wallet_connection_cache'
+    pass_phrase = 'pass_phrase'
+
+    await remove_wallets(agent_name)
+    conn = WalletConnection(agent_name, pass_phrase)
+    await conn.create()
+    try:
+        await conn.open()
+        my_did, my_vk = await conn.create_and_store_my_did()
+        their_did, their_vk = await conn.create_and_store_my_did()
+        assert await conn.key_for_local_did(my_did) == my_vk
+        assert await conn.key_for_local_did(my_did) == my_vk
+        assert conn.cache_stats()['hits'] == 1
+        assert await conn.get_pairwise(their_did) is None
+        await conn.create_pairwise(their_did, my_did, dict(label='x'))
+        pairwise = await conn.get_pairwise(their_did)
+        assert pairwise['metadata'] == dict(label='x')
+        await conn.set_pairwise_metadata(their_did, dict(label='y'))
+        assert (await conn.get_pairwise(their_did))['metadata'] == dict(label='y')
+        await conn.add_wallet_record('test', 'id', 'value')
+        assert await conn.get_wallet_record('test', 'id') == 'value'
+        await conn.update_wallet_record_value('test', 'id', 'new value')
+        assert await conn.get_wallet_record('test', 'id') == 'new value'
+        await conn.delete_wallet_record('test', 'id')
+        with pytest.raises(WalletItemNotFound):
+            await conn.get_wallet_record('test', 'id')
+        await conn.close()
+    finally:
+        await conn.delete()
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db
+async def test_wallet_pairwise_search():
+    agent_name = 'test_wallet_pairwise_search'
+    pass_phrase = 'pass_phrase'
+
+    await remove_wallets(agent_name)
+    conn = WalletConnection(agent_name, pass_phrase)
+    await conn.create()
+    try:
+        await conn.open()
+        my_did, my_vk = await conn.create_and_store_my_did()
+        their = []
+        for n in range(3):
+            their_did, their_vk = await conn.create_and_store_my_did()
+            metadata = dict(label='Peer %d' % n, their_vk=their_vk, connection_key='key%d' % n)
+            await conn.create_pairwise(their_did, my_did, metadata)
+            their.append((their_did, their_vk))
+        page = await conn.search_pairwise(limit=2)
+        assert page['total'] == 3
+        assert len(page['items']) == 2
+        assert page['cursor']
+        next_page = await conn.search_pairwise(limit=2, cursor=page['cursor'])
+        assert len(next_page['items']) == 1
+        assert next_page['cursor'] is None
+        dids = {item['their_did'] for item in page['items'] + next_page['items']}
+        assert dids == {their_did for their_did, _ in their}
+        with pytest.raises(WalletOperationError):
+            await conn.search_pairwise(cursor=page['cursor'])
+        page = await conn.search_pairwise({'~label': {'$like': 'Peer 1%'}})
+        assert [item['their_did'] for item in page['items']] == [their[1][0]]
+        found = await conn.find_pairwise(their_vk=their[2][1])
+        assert found['their_did'] == their[2][0]
+        assert found['metadata']['label'] == 'Peer 2'
+        await conn.set_pairwise_metadata(their[2][0], dict(label='Renamed', their_vk=their[2][1]))
+        assert (await conn.find_pairwise(their_vk=their[2][1]))['metadata']['label'] == 'Renamed'
+        assert await conn.find_pairwise(connection_key='key2') is None
+        assert (await conn.find_pairwise(connection_key='key0'))['their_did'] == their[0][0]
+        await conn.close()
+    finally:
+        await conn.delete()
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db
+async def test_wallet_agent_embedded():
+    agent_name = 'test_wallet_agent_embedded'
+    pass_phrase = 'pass_phrase'
+    wallet_settings = settings.INDY['WALLET_SETTINGS']
+
+    await remove_wallets(agent_name)
+    conn = WalletConnection(agent_name, pass_phrase)
+    await conn.create()
+    embedded = wallet_settings['EMBEDDED_WALLETS']
+    wallet_settings['EMBEDDED_WALLETS'] = [agent_name]
+    try:
+        # No agent process is running
+        await WalletAgent.ensure_agent_is_open(agent_name, pass_phrase)
+        assert await WalletAgent.is_open(agent_name) is True
+        with pytest.raises(WalletAccessDenied):
+            await WalletAgent.create_and_store_my_did(agent_name, 'invalid')
+        did, verkey = await WalletAgent.create_and_store_my_did(agent_name, pass_phrase)
+        assert await WalletAgent.key_for_local_did(agent_name, pass_phrase, did) == verkey
+        await WalletAgent.close(agent_name, pass_phrase)
+        assert await WalletAgent.is_open(agent_name) is False
+    finally:
+        wallet_settings['EMBEDDED_WALLETS'] = embedded
+        await conn.delete()
@@ -1,8 +1,12 @@
 import os
 import json
 import uuid
+import hashlib
+import time
+import socket
 import asyncio
 import logging
+import threading
 import contextlib
 from datetime import datetime
 
@@ -11,9 +15,13 @@ from django.utils.timezone import now, timedelta
 from django.conf import settings
 from channels.db import database_sync_to_async
 
-from core import AsyncReqResp, WriteOnlyChannel, ReadOnlyChannel
-from core.const import WALLET_KEY_TO_DID_KEY
+from core import AsyncReqResp, WriteOnlyChannel, ReadOnlyChannel, ReadWriteTimeoutError
+from core.const import WALLET_KEY_TO_DID_KEY, WALLET_KEY_PAIRWISE_INDEX, WALLET_KEY_PAIRWISE_INDEX_STATE
 from core.pool import get_pool_handle
+from core.cache import LRUCache
+from core.concurrency import CommandScheduler, SchedulerBusyError
+from core.metrics import CallStats
+from core.redis_pool import RedisPool
 from .models import StartedStateMachine
 
 
@@ -84,6 +92,11 @@ class WalletMachineNotStartedError(BaseWalletException, metaclass=WalletExceptio
     error_code = 9
 
 
+class AgentBusyError(AgentTimeOutError):
+    """Agent rejected command because too many commands are in flight, callers handle it as timeout"""
+    error_code = 10
+
+
 def raise_wallet_exception(error_code, error_message):
     exception_cls = WALLET_EXCEPTION_CODES.get(error_code, None)
     if exception_cls:
@@ -92,9 +105,145 @@ def raise_wallet_exception(error_code, error_message):
         raise RuntimeError(error_message)
 
 
+def batch_item_result(item: dict):
+    """Return result of batch command item or raise its error"""
+    error = item.get('error', None)
+    if error:
+        raise_wallet_exception(**error)
+    return item.get('ret')
+
+
+HIBERNATED_KEY = 'wallet-agent-hibernated:%s'
+HIBERNATED_KEY_TTL = 30 * 24 * 60 * 60  # sec
+WARM_STATS_KEY = 'wallet-agents:warm'
+
+
+async def mark_hibernated(agent_name: str, hibernated: bool):
+    redis = await RedisPool.instance().connection()
+    if hibernated:
+        await redis.execute(b'SET', HIBERNATED_KEY % agent_name, 1, b'EX', HIBERNATED_KEY_TTL)
+    else:
+        await redis.execute(b'DEL', HIBERNATED_KEY % agent_name)
+
+
+async def is_hibernated(agent_name: str) -> bool:
+    redis = await RedisPool.instance().connection()
+    return await redis.execute(b'EXISTS', HIBERNATED_KEY % agent_name) == 1
+
+
+# Warm hits and misses are counted locally and added to shared counters at most once per interval
+WARM_STATS_FLUSH_INTERVAL = 5  # sec
+_warm_counts = {b'hits': 0, b'misses': 0}
+_warm_flushed = time.monotonic()
+
+
+async def count_warm_hit(hit: bool):
+    _warm_counts[b'hits' if hit else b'misses'] += 1
+    if time.monotonic() - _warm_flushed < WARM_STATS_FLUSH_INTERVAL:
+        return
+    await flush_warm_hits()
+
+
+async def flush_warm_hits():
+    global _warm_flushed
+    _warm_flushed = time.monotonic()
+    counts = [(name, value) for name, value in _warm_counts.items() if value]
+    for name, _ in counts:
+        _warm_counts[name] = 0
+    if counts:
+        redis = await RedisPool.instance().connection()
+        await asyncio.gather(*[redis.execute(b'HINCRBY', WARM_STATS_KEY, name, value) for name, value in counts])
+
+
+HEARTBEAT_KEY = 'wallet-agent-heartbeat:%s'
+HEARTBEAT_STATE_RUNNING = 'running'
+HEARTBEAT_STATE_OPEN = 'open'
+
+
+async def publish_heartbeat(agent_name: str, state: str, load: int, ttl: int):
+    """Announce agent is alive, key expires if agent stops publishing"""
+    value = json.dumps(dict(state=state, pid=os.getpid(), host=socket.gethostname(), load=load))
+    redis = await RedisPool.instance().connection()
+    await redis.execute(b'SET', HEARTBEAT_KEY % agent_name, value, b'EX', ttl)
+
+
+async def drop_heartbeat(agent_name: str):
+    redis = await RedisPool.instance().connection()
+    await redis.execute(b'DEL', HEARTBEAT_KEY % agent_name)
+
+
+async def read_heartbeats(*agent_names) -> list:
+    """Return: heartbeat dict or None for every agent name"""
+    if not agent_names:
+        return []
+    redis = await RedisPool.instance().connection()
+    values = await redis.execute(b'MGET', *[HEARTBEAT_KEY % agent_name for agent_name in agent_names])
+    return [json.loads(value.decode('utf-8')) if value else None for value in values]
+
+
+async def read_heartbeat(agent_name: str):
+    heartbeats = await read_heartbeats(agent_name)
+    return heartbeats[0]
+
+
+# Session tokens issued by agents to this process: (agent_name, pass phrase digest) -> (token, expires_at)
+AGENT_SESSIONS = {}
+
+
+def caller_id():
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def session_key(agent_name: str, pass_phrase: str):
+    return agent_name, hashlib.sha256(pass_phrase.encode('utf-8')).hexdigest()
+
+
+def session_packet(agent_name: str, packet: dict) -> dict:
+    """Packet to send: pass phrase is replaced with session token if agent issued one"""
+    pass_phrase = packet.get('pass_phrase', None)
+    if not isinstance(pass_phrase, str):
+        return packet
+    packet = dict(packet, caller=caller_id())
+    if packet.get('command', None) not in [WalletAgent.COMMAND_OPEN, WalletAgent.COMMAND_CLOSE]:
+        session = AGENT_SESSIONS.get(session_key(agent_name, pass_phrase), None)
+        if session and session[1] > time.monotonic():
+            del packet['pass_phrase']
+            packet['session_token'] = session[0]
+    return packet
+
+
+async def req_with_session(requests: AsyncReqResp, agent_name: str, packet: dict, timeout):
+    wire_packet = session_packet(agent_name, packet)
+    success, resp = await requests.req(wire_packet, timeout)
+    if success and 'session_token' in wire_packet:
+        error = resp.get('error', None)
+        if error and error.get('error_code', None) == WalletAccessDenied.error_code:
+            # Session is expired or agent was restarted, authorize with pass phrase
+            AGENT_SESSIONS.pop(session_key(agent_name, packet['pass_phrase']), None)
+            success, resp = await requests.req(session_packet(agent_name, packet), timeout)
+    if success and isinstance(packet.get('pass_phrase', None), str):
+        key = session_key(agent_name, packet['pass_phrase'])
+        if resp.get('session_token', None):
+            AGENT_SESSIONS[key] = (resp['session_token'], time.monotonic() + resp['session_ttl'] - 1)
+        elif packet.get('command', None) == WalletAgent.COMMAND_CLOSE:
+            AGENT_SESSIONS.pop(key, None)
+    return success, resp
+
+
 async def call_agent(agent_name: str, packet: dict, timeout=settings.REDIS_CONN_TIMEOUT):
+    if EmbeddedAgents.is_embedded(agent_name):
+        resp = await EmbeddedAgents.call(agent_name, packet, timeout)
+        error = resp.get('error', None)
+        if error:
+            raise_wallet_exception(**error)
+        return resp
     requests = AsyncReqResp(WalletConnection.make_wallet_address(agent_name))
-    success, resp = await requests.req(packet, timeout)
+    success, resp = await req_with_session(requests, agent_name, packet, timeout)
+    reopen = packet.get('pass_phrase', None) and packet.get('command', None) != WalletAgent.COMMAND_OPEN
+    if not success and reopen and await is_hibernated(agent_name):
+        # Idle wallet was closed by agent, reopen it transparently
+        await WalletAgent.ensure_agent_is_open(agent_name, packet['pass_phrase'])
+        success, resp = await req_with_session(requests, agent_name, packet, timeout)
     if success:
         error = resp.get('error', None)
         if error:
@@ -102,6 +251,8 @@ async def call_agent(agent_name: str, packet: dict, timeout=settings.REDIS_CONN_
         else:
             return resp
     else:
+        # Agent may be dead, don't let its heartbeat hide it until expiration
+        await drop_heartbeat(agent_name)
         raise AgentTimeOutError()
 
 
@@ -122,6 +273,11 @@ class WalletConnection:
         cred.update(settings.INDY.get('WALLET_SETTINGS', {}).get('credentials', {}))
         self.__wallet_config = json.dumps(cfg)
         self.__wallet_credentials = json.dumps(cred)
+        # Lookups of immutable or rarely changing items, invalidated by wallet mutators
+        self.__cache = LRUCache(settings.INDY['WALLET_SETTINGS'].get('CONNECTION_CACHE_SIZE', 0))
+        # Open pairwise searches: cursor -> (search handle, total count, last access time)
+        self.__pairwise_searches = {}
+        self.__pairwise_indexed = False
 
     @contextlib.contextmanager
     def enter(self):
@@ -154,6 +310,17 @@ class WalletConnection:
     async def error(self, error_message: str):
         await self.log(message='Error', details=dict(error_message=error_message))
 
+    def cache_stats(self):
+        return self.__cache.stats()
+
+    async def __cached(self, key, coro_func, *args):
+        value = self.__cache.get(key)
+        if value is LRUCache.MISSING:
+            generation = self.__cache.generation
+            value = await coro_func(*args)
+            self.__cache.put(key, value, generation)
+        return value
+
     @property
     def agent_name(self):
         return self.__agent_name
@@ -190,6 +357,7 @@ class WalletConnection:
                 self.__wallet_credentials
             )
             self.__is_open = True
+            self.__cache.clear()
         except indy.error.IndyError as e:
             if e.error_code is indy.error.ErrorCode.WalletNotFoundError:
                 raise WalletNotCreated(error_message=e.message)
@@ -200,6 +368,10 @@ class WalletConnection:
 
     async def close(self):
         """ Close the wallet and set back state to non initialised. """
+        for search_handle, _, _ in self.__pairwise_searches.values():
+            await indy.non_secrets.close_wallet_search(search_handle)
+        self.__pairwise_searches.clear()
+        self.__pairwise_indexed = False
         if self.__handle:
             await indy.wallet.close_wallet(self.__handle)
         if self.__log_channel and not self.__log_channel.is_closed:
@@ -266,11 +438,13 @@ class WalletConnection:
                 identity['verkey'] = verkey
             identity_str = json.dumps(identity)
             await indy.did.store_their_did(self.__handle, identity_str)
+            self.__cache.invalidate(('key_for_local_did', did))
 
     async def set_did_metadata(self, did: str, metadata: dict=None):
         with self.enter():
             metadata_str = json.dumps(metadata) if metadata else ''
             await indy.did.set_did_metadata(self.__handle, did, metadata_str)
+            self.__cache.invalidate(('did_metadata', did))
 
     async def list_my_dids_with_meta(self):
         with self.enter():
@@ -278,6 +452,9 @@ class WalletConnection:
             return json.loads(list_as_str)
 
     async def get_did_metadata(self, did):
+        return await self.__cached(('did_metadata', did), self.__get_did_metadata, did)
+
+    async def __get_did_metadata(self, did):
         with self.enter():
             metadata_str = await indy.did.get_did_metadata(self.__handle, did)
             if metadata_str:
@@ -286,6 +463,9 @@ class WalletConnection:
                 return None
 
     async def key_for_local_did(self, did):
+        return await self.__cached(('key_for_local_did', did), self.__key_for_local_did, did)
+
+    async def __key_for_local_did(self, did):
         with self.enter():
             vk = await indy.did.key_for_local_did(self.__handle, did)
             return vk
@@ -299,12 +479,23 @@ class WalletConnection:
             verkey = await indy.did.create_key(self.__handle, key_json_str)
             return verkey
 
+    async def set_key_metadata(self, verkey: str, metadata: dict=None):
+        with self.enter():
+            metadata_str = json.dumps(metadata) if metadata else ''
+            await indy.did.set_key_metadata(self.__handle, verkey, metadata_str)
+
     async def add_wallet_record(self, type_: str, id_: str, value: str, tags: dict=None):
         with self.enter():
             tags_ = tags or {}
             await indy.non_secrets.add_wallet_record(self.__handle, type_, id_, value, json.dumps(tags_))
+            self.__cache.invalidate(('wallet_record', type_, id_))
 
     async def get_wallet_record(self, type_: str, id_: str, options: dict=None):
+        if options:
+            return await self.__get_wallet_record(type_, id_, options)
+        return await self.__cached(('wallet_record', type_, id_), self.__get_wallet_record, type_, id_)
+
+    async def __get_wallet_record(self, type_: str, id_: str, options: dict=None):
         with self.enter():
             options_ = options or {}
             json_str = await indy.non_secrets.get_wallet_record(self.__handle, type_, id_, json.dumps(options_))
@@ -313,12 +504,17 @@ class WalletConnection:
     async def delete_wallet_record(self, type_: str, id_: str):
         with self.enter():
             await indy.non_secrets.delete_wallet_record(self.__handle, type_, id_)
+            self.__cache.invalidate(('wallet_record', type_, id_))
 
     async def update_wallet_record_value(self, type_: str, id_: str, value: str):
         with self.enter():
             await indy.non_secrets.update_wallet_record_value(self.__handle, type_, id_, value)
+            self.__cache.invalidate(('wallet_record', type_, id_))
 
     async def get_pairwise(self, their_did):
+        return await self.__cached(('pairwise', their_did), self.__get_pairwise, their_did)
+
+    async def __get_pairwise(self, their_did):
         with self.enter():
             try:
                 info_str = await indy.pairwise.get_pairwise(self.__handle, their_did)
@@ -334,11 +530,20 @@ class WalletConnection:
         with self.enter():
             metadata_str = json.dumps(metadata)
             await indy.pairwise.set_pairwise_metadata(self.__handle, their_did, metadata_str)
+            self.__cache.invalidate(('pairwise', their_did))
+        info = await self.__get_pairwise(their_did)
+        if info:
+            await self.__index_pairwise(their_did, info['my_did'], metadata)
 
     async def create_pairwise(self, their_did: str, my_did: str, metadata: dict=None):
         with self.enter():
             metadata = metadata or {}
-            return await indy.pairwise.create_pairwise(self.__handle, their_did, my_did, json.dumps(metadata))
+            try:
+                ret = await indy.pairwise.create_pairwise(self.__handle, their_did, my_did, json.dumps(metadata))
+            finally:
+                self.__cache.invalidate(('pairwise', their_did))
+        await self.__index_pairwise(their_did, my_did, metadata)
+        return ret
 
     async def list_pairwise(self):
         with self.enter():
@@ -351,6 +556,123 @@ class WalletConnection:
                 result.append(item)
             return result
 
+    async def search_pairwise(self, query: dict=None, limit: int=100, cursor: str=None):
+        """Page through pairwise index
+
+        Index record tags: my_did, their_vk, connection_key (encrypted, equality only),
+        ~label, ~created (unix time) (plain, support $like, $gt, $lt etc)
+
+        :param query: WQL query to index tags
+        :param cursor: value returned by previous call to fetch next page
+        Return: dict(items=[pairwise], total=count, cursor=str or None if there are no more items)
+        """
+        self.__close_expired_searches()
+        with self.enter():
+            if cursor:
+                try:
+                    search_handle, total, _ = self.__pairwise_searches.pop(cursor)
+                except KeyError:
+                    raise WalletOperationError(error_message='Search cursor is expired')
+            else:
+                await self.__ensure_pairwise_index()
+                options = dict(retrieveRecords=True, retrieveTotalCount=True, retrieveType=False, retrieveValue=True)
+                search_handle = await indy.non_secrets.open_wallet_search(
+                    self.__handle, WALLET_KEY_PAIRWISE_INDEX, json.dumps(query or {}), json.dumps(options)
+                )
+                total = None
+            try:
+                fetched = json.loads(await indy.non_secrets.fetch_wallet_search_next_records(
+                    self.__handle, search_handle, limit
+                ))
+            except Exception:
+                await indy.non_secrets.close_wallet_search(search_handle)
+                raise
+            if total is None:
+                total = fetched.get('totalCount', None)
+            items = [json.loads(record['value']) for record in fetched.get('records', None) or []]
+            if len(items) < limit:
+                await indy.non_secrets.close_wallet_search(search_handle)
+                next_cursor = None
+            else:
+                next_cursor = uuid.uuid4().hex
+                self.__pairwise_searches[next_cursor] = (search_handle, total, time.monotonic())
+            return dict(items=items, total=total, cursor=next_cursor)
+
+    async def find_pairwise(self, their_vk: str=None, connection_key: str=None):
+        """Return: pairwise with given their verkey or connection key, None if not found"""
+        query = dict()
+        if their_vk:
+            query['their_vk'] = their_vk
+        if connection_key:
+            query['connection_key'] = connection_key
+        if not query:
+            raise WalletOperationError(error_message='Expected their_vk or connection_key')
+        page = await self.search_pairwise(query, limit=1)
+        if page['cursor']:
+            await indy.non_secrets.close_wallet_search(self.__pairwise_searches.pop(page['cursor'])[0])
+        return page['items'][0] if page['items'] else None
+
+    async def __index_pairwise(self, their_did: str, my_did: str, metadata: dict=None):
+        metadata = metadata or {}
+        value = json.dumps(dict(their_did=their_did, my_did=my_did, metadata=metadata))
+        tags = {'my_did': my_did, '~created': str(int(time.time()))}
+        for name in ['their_vk', 'connection_key']:
+            if metadata.get(name, None):
+                tags[name] = metadata[name]
+        if metadata.get('label', None):
+            tags['~label'] = metadata['label']
+        try:
+            try:
+                await indy.non_secrets.add_wallet_record(
+                    self.__handle, WALLET_KEY_PAIRWISE_INDEX, their_did, value, json.dumps(tags)
+                )
+            except indy.error.IndyError as e:
+                if e.error_code is not indy.error.ErrorCode.WalletItemAlreadyExists:
+                    raise
+                options = dict(retrieveType=False, retrieveValue=False, retrieveTags=True)
+                record = json.loads(await indy.non_secrets.get_wallet_record(
+                    self.__handle, WALLET_KEY_PAIRWISE_INDEX, their_did, json.dumps(options)
+                ))
+                tags['~created'] = (record.get('tags', None) or {}).get('~created', tags['~created'])
+                await indy.non_secrets.update_wallet_record_value(
+                    self.__handle, WALLET_KEY_PAIRWISE_INDEX, their_did, value
+                )
+                await indy.non_secrets.update_wallet_record_tags(
+                    self.__handle, WALLET_KEY_PAIRWISE_INDEX, their_did, json.dumps(tags)
+                )
+        except indy.error.IndyError as e:
+            # Pairwise itself is stored, index will be rebuilt by next search
+            logging.error('Error while indexing pairwise "%s": %s' % (their_did, e.message))
+            self.__pairwise_indexed = False
+            try:
+                await self.delete_wallet_record(WALLET_KEY_PAIRWISE_INDEX_STATE, 'version')
+            except WalletItemNotFound:
+                pass
+
+    async def __ensure_pairwise_index(self):
+        """Index pairwise created before index was introduced"""
+        if self.__pairwise_indexed:
+            return
+        try:
+            await self.get_wallet_record(WALLET_KEY_PAIRWISE_INDEX_STATE, 'version')
+        except WalletItemNotFound:
+            for item in await self.list_pairwise():
+                await self.__index_pairwise(item['their_did'], item['my_did'], item['metadata'])
+            try:
+                await self.add_wallet_record(WALLET_KEY_PAIRWISE_INDEX_STATE, 'version', '1')
+            except WalletOperationError:
+                # Concurrent search has built index
+                pass
+        self.__pairwise_indexed = True
+
+    def __close_expired_searches(self):
+        ttl = settings.INDY['WALLET_SETTINGS']['PAIRWISE_SEARCH_TTL']
+        stamp = time.monotonic()
+        for cursor, (search_handle, _, accessed) in list(self.__pairwise_searches.items()):
+            if stamp - accessed > ttl:
+                del self.__pairwise_searches[cursor]
+                asyncio.ensure_future(indy.non_secrets.close_wallet_search(search_handle))
+
     async def pack_message(self, message, their_ver_key, my_ver_key=None):
         with self.enter():
             if type(their_ver_key) is not list:
@@ -607,6 +929,7 @@ class WalletAgent:
     COMMAND_CLOSE = 'close'
     COMMAND_IS_OPEN = 'is_open'
     COMMAND_CREATE_KEY = 'create_key'
+    COMMAND_CREATE_MANY = 'create_many'
     COMMAND_ADD_WALLET_RECORD = 'add_wallet_record'
     COMMAND_GET_WALLET_RECORD = 'get_wallet_record'
     COMMAND_LIST_MY_DIDS_WITH_META = 'list_my_dids_with_meta'
@@ -616,6 +939,8 @@ class WalletAgent:
     COMMAND_UPDATE_WALLET_RECORD = 'update_wallet_record'
     COMMAND_GET_PAIRWISE = 'get_pairwise'
     COMMAND_LIST_PAIRWISE = 'list_pairwise'
+    COMMAND_SEARCH_PAIRWISE = 'search_pairwise'
+    COMMAND_FIND_PAIRWISE = 'find_pairwise'
     COMMAND_CREATE_PAIRWISE = 'create_pairwise'
     COMMAND_CREATE_PAIRWISE_STATICALLY = 'create_pairwise_statically'
     COMMAND_PACK_MESSAGE = 'pack_message'
@@ -641,26 +966,63 @@ class WalletAgent:
     COMMAND_PROVER_CLOSE_CRED_SEARCH_FOR_PROOF_REQ = 'prover_close_credentials_search_for_proof_req'
     COMMAND_PROVER_FETCH_CRED_FOR_PROOF_REQ = 'prover_fetch_credentials_for_proof_req'
     COMMAND_PROVER_CREATE_PROOF = 'prover_create_proof'
+    COMMAND_STATS = 'stats'
+    COMMAND_CACHE_STATS = 'cache_stats'
+    COMMAND_BATCH = 'batch'
     TIMEOUT = settings.INDY['WALLET_SETTINGS']['TIMEOUTS']['AGENT_REQUEST']
     TIMEOUT_START = settings.INDY['WALLET_SETTINGS']['TIMEOUTS']['AGENT_START']
+    # Commands executed when all other in-flight commands are done if they change wallet state,
+    # see WalletAgentProcessor.is_exclusive()
+    EXCLUSIVE_COMMANDS = [COMMAND_OPEN, COMMAND_CLOSE]
+    # Commands that do not prevent idle agent from hibernation
+    PASSIVE_COMMANDS = [COMMAND_PING, COMMAND_IS_OPEN, COMMAND_STATS, COMMAND_CACHE_STATS]
+    # Commands executed one by one in order they were received
+    SERIAL_COMMANDS = [
+        COMMAND_START_STATE_MACHINE, COMMAND_INVOKE_STATE_MACHINE, COMMAND_KILL_STATE_MACHINE
+    ]
+    # Heavy crypto and ledger commands with limited concurrency
+    EXPENSIVE_COMMANDS = [
+        COMMAND_SIGN_AND_SUBMIT_REQUEST, COMMAND_BUILD_SCHEMA_REQUEST, COMMAND_ISSUER_CREATE_CRED_DEF,
+        COMMAND_ISSUER_CREATE_CRED_OFFER, COMMAND_PROVER_CREATE_MASTER_SECRET, COMMAND_PROVER_CREATE_CRED_REQ,
+        COMMAND_ISSUER_CREATE_CRED, COMMAND_PROVER_STORE_CRED, COMMAND_PROVER_SEARCH_CREDS_FOR_PROOF_REQ,
+        COMMAND_PROVER_FETCH_CRED_FOR_PROOF_REQ, COMMAND_PROVER_CREATE_PROOF, COMMAND_LIST_PAIRWISE,
+        COMMAND_CREATE_MANY
+    ]
+    # Max count of DIDs or keys created by single create_many command
+    CREATE_MANY_CHUNK = 100
+
+    @classmethod
+    def command_class(cls, command: str, kwargs: dict=None):
+        if command == cls.COMMAND_BATCH:
+            # Batch is as expensive as the most expensive command in it
+            commands = (kwargs or {}).get('commands', None)
+            nested = [item.get('command', None) for item in commands if isinstance(item, dict)] \
+                if isinstance(commands, list) else []
+            return 'expensive' if any(name in cls.EXPENSIVE_COMMANDS for name in nested) else 'cheap'
+        elif command in cls.SERIAL_COMMANDS:
+            return 'serial'
+        elif command in cls.EXPENSIVE_COMMANDS:
+            return 'expensive'
+        else:
+            return 'cheap'
 
     @classmethod
     async def ensure_agent_is_running(cls, agent_name: str, timeout=TIMEOUT_START):
-        until_to = datetime.now() + timedelta(seconds=timeout)
-        if await cls.ping(agent_name):
+        if EmbeddedAgents.is_embedded(agent_name):
+            return
+        if await read_heartbeat(agent_name) or await cls.ping(agent_name):
+            await count_warm_hit(True)
             return
         else:
-            os.system('nohup python /app/manage.py run_wallet_agent %s &' % agent_name)
-            while datetime.now() <= until_to:
-                if await cls.ping(agent_name, 1):
-                    return
-                else:
-                    asyncio.sleep(1)
-            raise AgentTimeOutError('Agent is not running')
+            await count_warm_hit(False)
+            # supervisor depends on WalletAgent
+            from core.supervisor import ensure_agent_running
+            await ensure_agent_running(agent_name, timeout)
 
     @classmethod
     async def ensure_agent_is_open(cls, agent_name: str, pass_phrase: str):
         await cls.ensure_agent_is_running(agent_name)
+        # Open is sent even if wallet is open already: it checks pass phrase
         await cls.open(agent_name, pass_phrase)
 
     @classmethod
@@ -677,6 +1039,10 @@ class WalletAgent:
 
     @classmethod
     async def is_open(cls, agent_name: str, timeout=TIMEOUT):
+        if not EmbeddedAgents.is_embedded(agent_name):
+            heartbeat = await read_heartbeat(agent_name)
+            if heartbeat:
+                return heartbeat['state'] == HEARTBEAT_STATE_OPEN
         packet = dict(
             command=cls.COMMAND_IS_OPEN,
         )
@@ -722,6 +1088,24 @@ class WalletAgent:
         resp = await call_agent(agent_name, packet, timeout)
         return resp.get('ret')
 
+    @classmethod
+    async def create_many(
+            cls, agent_name: str, pass_phrase: str, items: list, keys_only: bool=False, timeout=TIMEOUT
+    ):
+        """Create DIDs or keys in single agent round-trip
+
+        :param items: list of dict(seed=optional str, metadata=optional dict)
+        :param keys_only: create keys instead of DIDs
+        Return: list of dict(ret=dict(did, verkey)) or dict(error=dict(error_code, error_message)) per item
+        """
+        packet = dict(
+            command=cls.COMMAND_CREATE_MANY,
+            pass_phrase=pass_phrase,
+            kwargs=dict(items=items, keys_only=keys_only)
+        )
+        resp = await call_agent(agent_name, packet, timeout)
+        return resp.get('ret')
+
     @classmethod
     async def key_for_local_did(cls, agent_name: str, pass_phrase: str, did, timeout=TIMEOUT):
         packet = dict(
@@ -804,6 +1188,32 @@ class WalletAgent:
         resp = await call_agent(agent_name, packet, timeout)
         return resp.get('ret')
 
+    @classmethod
+    async def search_pairwise(
+            cls, agent_name: str, pass_phrase: str, query: dict=None, limit: int=100, cursor: str=None,
+            timeout=TIMEOUT
+    ):
+        """Return: dict(items=[pairwise], total=count, cursor=str or None)"""
+        packet = dict(
+            command=cls.COMMAND_SEARCH_PAIRWISE,
+            pass_phrase=pass_phrase,
+            kwargs=dict(query=query, limit=limit, cursor=cursor)
+        )
+        resp = await call_agent(agent_name, packet, timeout)
+        return resp.get('ret')
+
+    @classmethod
+    async def find_pairwise(
+            cls, agent_name: str, pass_phrase: str, their_vk: str=None, connection_key: str=None, timeout=TIMEOUT
+    ):
+        packet = dict(
+            command=cls.COMMAND_FIND_PAIRWISE,
+            pass_phrase=pass_phrase,
+            kwargs=dict(their_vk=their_vk, connection_key=connection_key)
+        )
+        resp = await call_agent(agent_name, packet, timeout)
+        return resp.get('ret')
+
     @classmethod
     async def create_pairwise(
             cls, agent_name: str, pass_phrase: str, their_did: str, my_did: str,
@@ -838,13 +1248,14 @@ class WalletAgent:
             kwargs=dict(message=message, their_ver_key=their_ver_key, my_ver_key=my_ver_key)
         )
         resp = await call_agent(agent_name, packet, timeout)
-        return resp.get('ret').encode('utf-8')
+        ret = resp.get('ret')
+        return ret.encode('utf-8') if isinstance(ret, str) else ret
 
     @classmethod
     async def unpack_message(cls, agent_name: str, wire_msg_bytes: bytes, timeout=TIMEOUT):
         packet = dict(
             command=cls.COMMAND_UNPACK_MESSAGE,
-            kwargs=dict(wire_msg_bytes=wire_msg_bytes.decode('utf-8'))
+            kwargs=dict(wire_msg_bytes=wire_msg_bytes)
         )
         resp = await call_agent(agent_name, packet, timeout)
         return resp.get('ret')
@@ -951,15 +1362,9 @@ class WalletAgent:
     @classmethod
     async def invoke_state_machine(cls, agent_name: str, id_: str, content_type: str, data):
         await cls.ensure_agent_is_running(agent_name)
-        if isinstance(data, bytes):
-            wire_msg_utf = data.decode('utf-8')
-            is_bytes = True
-        else:
-            wire_msg_utf = data
-            is_bytes = False
         packet = dict(
             command=cls.COMMAND_INVOKE_STATE_MACHINE,
-            kwargs=dict(id_=id_, content_type=content_type, data=wire_msg_utf, is_bytes=is_bytes)
+            kwargs=dict(id_=id_, content_type=content_type, data=data, is_bytes=isinstance(data, bytes))
         )
         resp = await call_agent(agent_name, packet)
         return resp.get('ret')
@@ -1124,427 +1529,743 @@ class WalletAgent:
         await call_agent(agent_name, packet)
 
     @classmethod
-    async def process(cls, agent_name: str):
+    async def stats(cls, agent_name: str, pass_phrase: str, timeout=TIMEOUT):
+        packet = dict(
+            command=cls.COMMAND_STATS,
+            pass_phrase=pass_phrase
+        )
+        resp = await call_agent(agent_name, packet, timeout)
+        return resp.get('ret')
+
+    @classmethod
+    async def cache_stats(cls, agent_name: str, pass_phrase: str, timeout=TIMEOUT):
+        """Hit/miss counters of wallet lookups cache"""
+        packet = dict(
+            command=cls.COMMAND_CACHE_STATS,
+            pass_phrase=pass_phrase
+        )
+        resp = await call_agent(agent_name, packet, timeout)
+        return resp.get('ret')
+
+    @classmethod
+    async def warm_stats(cls):
+        """Count of calls that found agent running (hits) and that had to start it (misses)"""
+        await flush_warm_hits()
+        redis = await RedisPool.instance().connection()
+        stats = await redis.execute(b'HGETALL', WARM_STATS_KEY)
+        stats = dict(zip(stats[::2], stats[1::2]))
+        return dict(hits=int(stats.get(b'hits', 0)), misses=int(stats.get(b'misses', 0)))
+
+    @classmethod
+    async def live_agents(cls, agent_names: list):
+        """Heartbeats of running agents: {agent_name: {state, pid, host, load}}"""
+        heartbeats = await read_heartbeats(*agent_names)
+        return {name: heartbeat for name, heartbeat in zip(agent_names, heartbeats) if heartbeat}
+
+    @classmethod
+    async def batch(
+            cls, agent_name: str, pass_phrase: str, commands: list, stop_on_error: bool=True, timeout=TIMEOUT
+    ):
+        """Execute commands in single agent round-trip
+
+        :param commands: list of dict(command=<name>, kwargs=<dict>), kwargs value may be reference
+          to result of previous command: {'$ref': '<index>.<key>.<key>...'}
+        :param stop_on_error: do not execute commands after failed one
+        :return: list of dict(ret=<result>) or dict(error=<error>) in commands order,
+          see batch_item_result()
+        """
+        packet = dict(
+            command=cls.COMMAND_BATCH,
+            pass_phrase=pass_phrase,
+            kwargs=dict(commands=commands, stop_on_error=stop_on_error)
+        )
+        resp = await call_agent(agent_name, packet, timeout)
+        return resp.get('ret')
+
+    @classmethod
+    async def process(cls, agent_name: str, agent: 'WalletAgentProcessor'=None):
         address = WalletConnection.make_wallet_address(agent_name)
         logging.info('Wallet Agent "%s" is started' % agent_name)
         listener = AsyncReqResp(address)
         await listener.start_listening()
-        wallet__ = None
-        machines = {}
-        machines_die_time = {}
+        agent = agent or WalletAgentProcessor(agent_name)
+        agent_settings = settings.INDY['WALLET_SETTINGS']['AGENT']
+        scheduler = CommandScheduler(agent_settings['MAX_IN_FLIGHT'], agent_settings['COMMAND_CLASSES'])
+        idle_ttl = agent_settings['IDLE_TTL']
 
-        def check_access_denied(pass_phrase_):
-            if not wallet__.check_credentials(agent_name, pass_phrase_):
-                raise WalletAccessDenied()
-        pass
+        async def heartbeat():
+            while True:
+                try:
+                    await agent.publish_heartbeat()
+                except Exception as e:
+                    logging.error('Wallet Agent "%s" heartbeat error: %s' % (agent_name, str(e)))
+                await asyncio.sleep(agent_settings['HEARTBEAT_INTERVAL'])
 
-        async def invoke_state_machine(id_: str, content_type: str, data):
-            nonlocal machines
-            if (wallet__ is None) or (not wallet__.is_open):
-                raise WalletIsNotOpen()
-            instance, write_channel = machines.get(id_, (None, None))
-            if not instance:
-                instance = await database_sync_to_async(try_load_started_machine)(id_)
-                if instance:
-                    # Wrap state machine into Future
-                    uid = uuid.uuid4().hex
-                    write_channel = await WriteOnlyChannel.create(uid)
-                    read_channel = await ReadOnlyChannel.create(uid)
-
-                    async def processor(machine, read_chan: ReadOnlyChannel, wallet):
+        heartbeat_task = asyncio.ensure_future(heartbeat())
+        try:
+            try:
+                while not agent.is_stopped:
+                    try:
+                        req, chan = await listener.wait_req(
+                            timeout=max(idle_ttl - agent.idle_time(), 1) if idle_ttl else None
+                        )
+                    except ReadWriteTimeoutError:
+                        if agent.idle_time() >= idle_ttl:
+                            logging.info('Wallet Agent "%s" is idle, hibernate' % agent_name)
+                            agent.hibernate()
+                        continue
+                    command = req.get('command', None) if isinstance(req, dict) else None
+                    if agent.is_exclusive(req):
+                        # open/close are serialized with all other commands
+                        await scheduler.drain()
+                        await agent.reply(req, chan)
+                    else:
                         try:
-                            try:
-                                while True:
-                                    s, d = await read_chan.read(timeout=None)
-                                    if s:
-                                        content_type_, data_descr = d
-                                        is_bytes_ = data_descr['is_bytes']
-                                        data_ = data_descr['data']
-                                        if is_bytes_:
-                                            data_ = data_.encode()
-                                        await machine.invoke(content_type_, data_, wallet)
-                                    else:
-                                        break
-                            except Exception as e:
-                                if e.__class__.__name__ == 'MachineIsDone':
-                                    pass
-                                else:
-                                    logging.exception('State Machine terminated with exception')
-                        finally:
-                            await read_chan.close()
-                    pass
+                            await scheduler.submit(
+                                cls.command_class(command, req.get('kwargs', None) if command else None),
+                                agent.reply(req, chan)
+                            )
+                        except SchedulerBusyError as e:
+                            asyncio.ensure_future(agent.reply_error(req, chan, AgentBusyError(str(e))))
+            finally:
+                # terminate all active commands and machines
+                heartbeat_task.cancel()
+                scheduler.cancel()
+                await agent.terminate()
+                await drop_heartbeat(agent_name)
+                if agent.is_hibernated:
+                    await mark_hibernated(agent_name, True)
+        finally:
+            await listener.stop_listening()
+            logging.debug('Wallet Agent "%s" is stopped' % agent_name)
 
-                    fut = asyncio.ensure_future(
-                        processor(instance, read_channel, wallet__)
-                    )
-                    machines[id_] = (fut, write_channel)
-                else:
-                    print('------------------------------------')
-                    print('State machine with id: %s not found' % id_)
-                    print('Running state machines ids:')
-                    machines_ids = [k for k in machines.keys()]
-                    print(json.dumps(machines_ids, indent=2))
-                    print('------------------------------------')
-                    raise WalletMachineNotStartedError('MachineID: %s' % id_)
-            if isinstance(data, bytes):
-                data_descr = dict(is_bytes=True, data=data.decode())
-            else:
-                data_descr = dict(is_bytes=False, data=data)
-            await write_channel.write((content_type, data_descr))
-        pass
 
-        async def kill_state_machine(id_: str):
-            ret = False
-            if id_ in machines:
-                f_, ch_ = machines[id_]
-                f_.cancel()
-                await ch_.close()
-                ret = True
-            if id_ in machines_die_time:
-                del machines_die_time[id_]
-            await database_sync_to_async(machine_stopped)(id_)
-            return ret
-
-        async def clean_done_machines():
-            while True:
-                await asyncio.sleep(30)
-                deletion_list = list()
-                for id_, descr_ in machines.items():
-                    f_, ch_ = descr_
-                    if (id_ in machines_die_time) and (now() > machines_die_time[id_]):
-                        f_.cancel()
-                    if f_.done() or f_.cancelled():
-                        deletion_list.append(id_)
-                        await database_sync_to_async(machine_stopped)(id_)
-                        if id_ in machines_die_time:
-                            del machines_die_time[id_]
-                    pass
-                for id_ in list(set(deletion_list)):
-                    if id_ in machines.keys():
-                        del machines[id_]
-                pass
-        pass
-        machines_cleaner_task = asyncio.ensure_future(clean_done_machines())
+AGENT_COMMANDS = {}
+
+# Command may be executed even if wallet is not open
+ACCESS_NONE = 'none'
+# Wallet must be open
+ACCESS_OPEN = 'open'
+# Wallet must be open and request must carry valid pass phrase
+ACCESS_PASS_PHRASE = 'pass_phrase'
+
+
+class AgentCommand:
+
+    def __init__(self, name: str, handler, access: str):
+        self.name = name
+        self.handler = handler
+        self.access = access
+
+
+def agent_command(name: str, access: str=ACCESS_PASS_PHRASE):
+    """Register wallet agent command handler
+
+    Handler is coroutine: handler(agent: WalletAgentProcessor, req: dict, **kwargs) -> reply: dict
+    """
+    def decorator(handler):
+        AGENT_COMMANDS[name] = AgentCommand(name, handler, access)
+        return handler
+    return decorator
+
+
+def register_wallet_method(command: str, method_name: str, access: str=ACCESS_PASS_PHRASE):
+    """Register command that calls WalletConnection method as is"""
+    async def handler(agent, req, **kwargs):
+        ret = await getattr(agent.wallet, method_name)(**kwargs)
+        return dict(ret=ret)
+    agent_command(command, access)(handler)
+
+
+class WalletAgentProcessor:
+    """Wallet agent state: wallet connection, running state machines, commands statistics"""
+
+    def __init__(self, agent_name: str):
+        self.agent_name = agent_name
+        self.wallet = None
+        self.machines = {}
+        self.machines_die_time = {}
+        self.stats = CallStats()
+        self.is_stopped = False
+        self.is_hibernated = False
+        self.in_flight = 0
+        self.last_activity = time.monotonic()
+        self.sessions = {}
+        self.__machines_cleaner_task = asyncio.ensure_future(self.__clean_done_machines())
+
+    def is_exclusive(self, req) -> bool:
+        """Command changes wallet state and must wait for in-flight commands
+
+        open of already open wallet and close of closed one are served as cheap commands,
+        so callers that ensure wallet is open on every request are not stalled by slow commands
+        """
+        command = req.get('command', None) if isinstance(req, dict) else None
+        if command not in WalletAgent.EXCLUSIVE_COMMANDS:
+            return False
+        is_open = self.wallet is not None and self.wallet.is_open
+        return not is_open if command == WalletAgent.COMMAND_OPEN else is_open
+
+    def check_access_denied(self, pass_phrase):
+        if not self.wallet.check_credentials(self.agent_name, pass_phrase):
+            raise WalletAccessDenied()
+
+    def check_session(self, req: dict):
+        """Check session token or pass phrase of request
+
+        Return: new session token if request was authorized with pass phrase, else None
+        """
+        token = req.get('session_token', None)
+        if token is None:
+            self.check_access_denied(req.get('pass_phrase', None))
+            return self.issue_session(req.get('caller', None))
+        session = self.sessions.get(token, None)
+        if session is None or session[0] != req.get('caller', None):
+            raise WalletAccessDenied()
+        if session[1] < time.monotonic():
+            del self.sessions[token]
+            raise WalletAccessDenied(error_message='Session is expired')
+        return None
+
+    def issue_session(self, caller: str):
+        """Return: session token bound to caller or None if sessions are disabled"""
+        ttl = settings.INDY['WALLET_SETTINGS']['AGENT']['SESSION_TTL']
+        if not caller or not ttl:
+            return None
+        stamp = time.monotonic()
+        for token in [token for token, session in self.sessions.items() if session[1] < stamp]:
+            del self.sessions[token]
+        token = uuid.uuid4().hex
+        self.sessions[token] = (caller, stamp + ttl)
+        return token
 
+    @staticmethod
+    def attach_session(resp: dict, token: str):
+        if token:
+            resp['session_token'] = token
+            resp['session_ttl'] = settings.INDY['WALLET_SETTINGS']['AGENT']['SESSION_TTL']
+        return resp
+
+    def idle_time(self) -> float:
+        """Seconds since last command was done
+
+        Agent running state machines is never idle: hibernation would cancel them
+        and inbound messages have no pass phrase to reopen wallet
+        """
+        if self.in_flight or self.machines:
+            return 0.0
+        return time.monotonic() - self.last_activity
+
+    def hibernate(self):
+        """Stop agent to release resources, wallet will be reopened on demand"""
+        self.is_hibernated = True
+        self.is_stopped = True
+
+    async def publish_heartbeat(self):
+        if EmbeddedAgents.is_embedded(self.agent_name):
+            return
+        agent_settings = settings.INDY['WALLET_SETTINGS']['AGENT']
+        if self.wallet is not None and self.wallet.is_open:
+            state = HEARTBEAT_STATE_OPEN
+        else:
+            state = HEARTBEAT_STATE_RUNNING
+        await publish_heartbeat(self.agent_name, state, self.in_flight, agent_settings['HEARTBEAT_TTL'])
+
+    async def dispatch(self, req: dict) -> dict:
+        """Execute command and return reply packet"""
+        logging.debug('Received request: "%s"' % repr(req))
+        if req.get('command', None) in WalletAgent.PASSIVE_COMMANDS:
+            return await self.execute(req)
+        self.in_flight += 1
         try:
-            try:
-                while True:
-                    req, chan = await listener.wait_req()
+            return await self.execute(req)
+        finally:
+            self.in_flight -= 1
+            self.last_activity = time.monotonic()
+
+    async def execute(self, req: dict, authorized: bool=False) -> dict:
+        """Execute command
+
+        :param authorized: pass phrase was already checked
+        """
+        command = AGENT_COMMANDS.get(req.get('command', None), None)
+        stamp = time.monotonic()
+        failed = False
+        try:
+            if command is None:
+                raise WalletOperationError('Unknown command: %s' % req.get('command', None))
+            if command.access != ACCESS_NONE and self.wallet is None:
+                raise WalletIsNotOpen()
+            token = None
+            if command.access == ACCESS_PASS_PHRASE and not authorized:
+                token = self.check_session(req)
+            resp = await command.handler(self, req, **(req.get('kwargs', None) or {}))
+            return self.attach_session(resp, token)
+        except BaseWalletException as e:
+            failed = True
+            req['error'] = dict(error_code=e.error_code, error_message=e.error_message)
+            return req
+        except Exception as e:
+            failed = True
+            req['error'] = dict(error_code=WalletOperationError.error_code, error_message=str(e))
+            return req
+        finally:
+            if command is not None:
+                self.stats.observe(command.name, time.monotonic() - stamp, failed)
+
+    async def reply(self, req: dict, chan):
+        try:
+            resp = await self.dispatch(req)
+            await chan.write(resp)
+        finally:
+            await chan.close()
+
+    async def reply_error(self, req: dict, chan, e: BaseWalletException):
+        """Reply to request that was not executed"""
+        try:
+            if isinstance(req, dict):
+                req['error'] = dict(error_code=e.error_code, error_message=e.error_message)
+            await chan.write(req)
+        finally:
+            await chan.close()
+
+    async def invoke_state_machine(self, id_: str, content_type: str, data):
+        if (self.wallet is None) or (not self.wallet.is_open):
+            raise WalletIsNotOpen()
+        fut, write_channel, _ = self.machines.get(id_, (None, None, None))
+        if not fut:
+            instance = await database_sync_to_async(try_load_started_machine)(id_)
+            if instance:
+                # Wrap state machine into Future
+                uid = uuid.uuid4().hex
+                write_channel = await WriteOnlyChannel.create(uid)
+                read_channel = await ReadOnlyChannel.create(uid)
+
+                async def processor(machine, read_chan: ReadOnlyChannel, wallet):
                     try:
-                        logging.debug('Received request: "%s"' % repr(req))
-                        command = req['command']
-                        pass_phrase = req.get('pass_phrase', None)
-                        kwargs = req.get('kwargs', {})
                         try:
-                            if command == cls.COMMAND_PING:
-                                req['command'] = cls.COMMAND_PONG
-                                await chan.write(req)
-                            elif command == cls.COMMAND_OPEN:
-                                if wallet__ is None:
-                                    w = WalletConnection(agent_name, pass_phrase)
-                                    await w.open()
-                                    wallet__ = w
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    if not wallet__.is_open:
-                                        await wallet__.open()
-                                await chan.write(req)
-                            elif command == cls.COMMAND_CLOSE:
-                                if wallet__:
-                                    check_access_denied(pass_phrase)
-                                    if wallet__.is_open:
-                                        await wallet__.close()
-                                await chan.write(req)
-                                break
-                            elif command == cls.COMMAND_CREATE_KEY:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    seed = kwargs.get('seed', None)
-                                    ret = await wallet__.create_key(seed)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_CREATE_AND_STORE_MY_DID:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.create_and_store_my_did(**kwargs)
-                                    my_did, my_vk = ret
-                                    try:
-                                        await wallet__.add_wallet_record(WALLET_KEY_TO_DID_KEY, my_vk, my_did)
-                                    except:
-                                        pass
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_IS_OPEN:
-                                ret = wallet__ is not None and wallet__.is_open
-                                await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_ADD_WALLET_RECORD:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    try:
-                                        ret = await wallet__.add_wallet_record(**kwargs)
-                                    except:
-                                        pass
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_GET_WALLET_RECORD:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.get_wallet_record(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_UPDATE_WALLET_RECORD:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.update_wallet_record_value(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_KEY_FOR_LOCAL_DID:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.key_for_local_did(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_DID_FOR_KEY:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    did = await wallet__.get_wallet_record(WALLET_KEY_TO_DID_KEY, kwargs['key'])
-                                    await chan.write(dict(ret=did))
-                            elif command == cls.COMMAND_GET_PAIRWISE:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.get_pairwise(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_LIST_PAIRWISE:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.list_pairwise()
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_CREATE_PAIRWISE:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.create_pairwise(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_CREATE_PAIRWISE_STATICALLY:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    their_vk = kwargs.pop('their_vk')
-                                    await wallet__.store_their_did(kwargs['their_did'], their_vk)
-                                    try:
-                                        await wallet__.add_wallet_record(WALLET_KEY_TO_DID_KEY, their_vk, kwargs['their_did'])
-                                    except:
-                                        pass
-                                    ret = await wallet__.create_pairwise(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_PACK_MESSAGE:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    ret = await wallet__.pack_message(**kwargs)
-                                    ret = ret.decode('utf-8')
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_UNPACK_MESSAGE:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    kwargs['wire_msg_bytes'] = kwargs['wire_msg_bytes'].encode('utf-8')
-                                    ret = await wallet__.unpack_message(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_START_STATE_MACHINE:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    ttl = kwargs.pop('ttl')
-                                    await database_sync_to_async(machine_started)(**kwargs)
-                                    machine_id = kwargs['machine_id']
-                                    machines_die_time[machine_id] = now() + timedelta(seconds=ttl)
-                                    await chan.write(dict(ret=True))
-                            elif command == cls.COMMAND_INVOKE_STATE_MACHINE:
-                                try:
-                                    is_bytes = kwargs.pop('is_bytes')
-                                    if is_bytes:
-                                        kwargs['data'] = kwargs['data'].encode('utf-8')
-                                    await invoke_state_machine(**kwargs)
-                                except Exception as e:
-                                    req['error'] = dict(error_code=WalletOperationError.error_code, error_message=str(e))
-                                await chan.write(dict(ret=True))
-                            elif command == cls.COMMAND_KILL_STATE_MACHINE:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
+                            while True:
+                                s, d = await read_chan.read(timeout=None)
+                                if s:
+                                    content_type_, data_descr = d
+                                    data_ = data_descr['data']
+                                    if data_descr['is_bytes'] and isinstance(data_, str):
+                                        data_ = data_.encode()
+                                    await machine.invoke(content_type_, data_, wallet)
                                 else:
-                                    check_access_denied(pass_phrase)
-                                    id_ = kwargs.get('id_')
-                                    print('==== #1 kill state machine %s =====' % id_)
-                                    ret = await kill_state_machine(id_)
-                                    await chan.write(dict(ret=True))
-                            elif command == cls.COMMAND_ACCESS_LOG:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = wallet__.log_channel_name
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_WRITE_LOG:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.log(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_LIST_MY_DIDS_WITH_META:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.list_my_dids_with_meta()
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_BUILD_NYM_REQUEST:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.build_nym_request(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_SIGN_AND_SUBMIT_REQUEST:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    kwargs['request_json'] = json.loads(kwargs['request_json'])
-                                    ret = await wallet__.sign_and_submit_request(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_BUILD_SCHEMA_REQUEST:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.build_schema_request(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_ISSUER_CREATE_CRED_DEF:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.issuer_create_credential_def(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_ISSUER_CREATE_CRED_OFFER:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.issuer_create_credential_offer(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_PROVER_CREATE_MASTER_SECRET:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.prover_create_master_secret(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_PROVER_CREATE_CRED_REQ:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.prover_create_credential_req(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_ISSUER_CREATE_CRED:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.issuer_create_credential(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_PROVER_STORE_CRED:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.prover_store_credential(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_BUILD_GET_NYM_REQUEST:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.build_get_nym_request(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_BUILD_ATTRIB_REQUEST:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.build_attrib_request(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_BUILD_GET_ATTRIB_REQUEST:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.build_get_attrib_request(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_PROVER_SEARCH_CREDS_FOR_PROOF_REQ:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.prover_search_credentials_for_proof_req(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_PROVER_CLOSE_CRED_SEARCH_FOR_PROOF_REQ:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.prover_close_credentials_search_for_proof_req(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_PROVER_FETCH_CRED_FOR_PROOF_REQ:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.prover_fetch_credentials_for_proof_req(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                            elif command == cls.COMMAND_PROVER_CREATE_PROOF:
-                                if wallet__ is None:
-                                    raise WalletIsNotOpen()
-                                else:
-                                    check_access_denied(pass_phrase)
-                                    ret = await wallet__.prover_create_proof(**kwargs)
-                                    await chan.write(dict(ret=ret))
-                        except BaseWalletException as e:
-                            req['error'] = dict(error_code=e.error_code, error_message=e.error_message)
-                            await chan.write(req)
+                                    break
                         except Exception as e:
-                            req['error'] = dict(error_code=WalletOperationError.error_code, error_message=str(e))
-                            await chan.write(req)
+                            if e.__class__.__name__ == 'MachineIsDone':
+                                pass
+                            else:
+                                logging.exception('State Machine terminated with exception')
                     finally:
-                        await chan.close()
-            finally:
-                # terminate all active machines
-                machines_cleaner_task.cancel()
-                for f, ch in machines.values():
-                    f.cancel()
-                    await ch.close()
-                if wallet__ and wallet__.is_open:
-                    await wallet__.close()
-        finally:
-            await listener.stop_listening()
-            logging.debug('Wallet Agent "%s" is stopped' % agent_name)
+                        await read_chan.close()
+                pass
+
+                fut = asyncio.ensure_future(
+                    processor(instance, read_channel, self.wallet)
+                )
+                self.machines[id_] = (fut, write_channel, instance)
+            else:
+                print('------------------------------------')
+                print('State machine with id: %s not found' % id_)
+                print('Running state machines ids:')
+                machines_ids = [k for k in self.machines.keys()]
+                print(json.dumps(machines_ids, indent=2))
+                print('------------------------------------')
+                raise WalletMachineNotStartedError('MachineID: %s' % id_)
+        data_descr = dict(is_bytes=isinstance(data, bytes), data=data)
+        await write_channel.write((content_type, data_descr))
+
+    async def kill_state_machine(self, id_: str):
+        ret = False
+        if id_ in self.machines:
+            f_, ch_, _ = self.machines[id_]
+            f_.cancel()
+            await ch_.close()
+            ret = True
+        if id_ in self.machines_die_time:
+            del self.machines_die_time[id_]
+        await database_sync_to_async(machine_stopped)(id_)
+        return ret
+
+    async def drop_state_machine(self, id_: str):
+        """Stop live instance of state machine discarding its unsaved changes, it is reloaded on next invoke"""
+        descr = self.machines.pop(id_, None)
+        if descr:
+            f_, ch_, machine = descr
+            machine.discard()
+            f_.cancel()
+            await ch_.close()
+            await asyncio.wait([f_])
+
+    async def terminate(self):
+        self.__machines_cleaner_task.cancel()
+        live = []
+        for f, ch, machine in self.machines.values():
+            if not f.done():
+                live.append((f, machine))
+            f.cancel()
+            await ch.close()
+        if live:
+            await asyncio.wait([f for f, _ in live])
+        # Write changes still waiting for FLUSH_DELAY
+        for _, machine in live:
+            try:
+                await machine.flush()
+            except Exception:
+                logging.exception('Error while flushing state of "%s"' % machine.get_id())
+        if self.wallet and self.wallet.is_open:
+            await self.wallet.close()
+
+    async def __clean_done_machines(self):
+        while True:
+            await asyncio.sleep(30)
+            deletion_list = list()
+            for id_, descr_ in self.machines.items():
+                f_, ch_, _ = descr_
+                if (id_ in self.machines_die_time) and (now() > self.machines_die_time[id_]):
+                    f_.cancel()
+                if f_.done() or f_.cancelled():
+                    deletion_list.append(id_)
+                    await database_sync_to_async(machine_stopped)(id_)
+                    if id_ in self.machines_die_time:
+                        del self.machines_die_time[id_]
+                pass
+            for id_ in list(set(deletion_list)):
+                if id_ in self.machines.keys():
+                    del self.machines[id_]
+            pass
+
+
+class EmbeddedAgents:
+    """Wallet agents executed inside caller process: commands are dispatched without Redis round-trips
+
+    libindy can't open the same wallet twice in one process, so single agent serves wallet
+    for all threads of the process, agent is bound to event loop it was created in
+    """
+
+    __agents = dict()
+    __lock = threading.Lock()
+
+    @staticmethod
+    def is_embedded(agent_name: str) -> bool:
+        names = settings.INDY['WALLET_SETTINGS']['EMBEDDED_WALLETS']
+        return agent_name in names or '*' in names
+
+    @classmethod
+    async def call(cls, agent_name: str, packet: dict, timeout: float) -> dict:
+        loop = asyncio.get_event_loop()
+        with cls.__lock:
+            descr = cls.__agents.get(agent_name, None)
+            if descr is None or descr[1].is_closed():
+                agent_settings = settings.INDY['WALLET_SETTINGS']['AGENT']
+                scheduler = CommandScheduler(agent_settings['MAX_IN_FLIGHT'], agent_settings['COMMAND_CLASSES'])
+                descr = (WalletAgentProcessor(agent_name), loop, scheduler, asyncio.Lock())
+                cls.__agents[agent_name] = descr
+        agent, agent_loop, scheduler, gate = descr
+        # Request is copied: agent modifies it while building reply
+        fut = cls.__run_in_loop(cls.__schedule(agent, scheduler, gate, dict(packet)), agent_loop)
+        try:
+            resp = await asyncio.wait_for(asyncio.shield(fut), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise AgentTimeOutError()
+        if agent.is_stopped:
+            # Wallet is closed
+            with cls.__lock:
+                if cls.__agents.get(agent_name, None) is descr:
+                    del cls.__agents[agent_name]
+            await cls.__run_in_loop(agent.terminate(), agent_loop)
+        return resp
+
+    @staticmethod
+    async def __schedule(agent: WalletAgentProcessor, scheduler: CommandScheduler, gate: asyncio.Lock, req: dict):
+        """Execute command with the same concurrency limits as agent process applies"""
+        command = req.get('command', None)
+        done = asyncio.Future()
+
+        async def run():
+            try:
+                done.set_result(await agent.dispatch(req))
+            except asyncio.CancelledError:
+                done.cancel()
+                raise
+            except Exception as e:
+                done.set_exception(e)
+
+        # Gate keeps commands from being submitted while exclusive command waits for in-flight ones
+        async with gate:
+            if agent.is_exclusive(req):
+                await scheduler.drain()
+                return await agent.dispatch(req)
+            try:
+                await scheduler.submit(WalletAgent.command_class(command, req.get('kwargs', None)), run())
+            except SchedulerBusyError as e:
+                req['error'] = dict(error_code=AgentBusyError.error_code, error_message=str(e))
+                return req
+        return await done
+
+    @staticmethod
+    def __run_in_loop(coro, loop):
+        if loop is asyncio.get_event_loop():
+            return asyncio.ensure_future(coro)
+        else:
+            return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+@agent_command(WalletAgent.COMMAND_PING, access=ACCESS_NONE)
+async def ping_command(agent: WalletAgentProcessor, req: dict, **kwargs):
+    req['command'] = WalletAgent.COMMAND_PONG
+    return req
+
+
+@agent_command(WalletAgent.COMMAND_OPEN, access=ACCESS_NONE)
+async def open_command(agent: WalletAgentProcessor, req: dict, **kwargs):
+    pass_phrase = req.get('pass_phrase', None)
+    if agent.wallet is None:
+        w = WalletConnection(agent.agent_name, pass_phrase)
+        await w.open()
+        agent.wallet = w
+    else:
+        agent.check_access_denied(pass_phrase)
+        if agent.wallet.is_open:
+            # Fast path: wallet state is not changed
+            return agent.attach_session(req, agent.issue_session(req.get('caller', None)))
+        await agent.wallet.open()
+    await mark_hibernated(agent.agent_name, False)
+    await agent.publish_heartbeat()
+    return agent.attach_session(req, agent.issue_session(req.get('caller', None)))
+
+
+@agent_command(WalletAgent.COMMAND_CLOSE, access=ACCESS_NONE)
+async def close_command(agent: WalletAgentProcessor, req: dict, **kwargs):
+    if agent.wallet:
+        agent.check_access_denied(req.get('pass_phrase', None))
+        if agent.wallet.is_open:
+            await agent.wallet.close()
+            await agent.publish_heartbeat()
+    agent.sessions.clear()
+    agent.is_stopped = True
+    return req
+
+
+@agent_command(WalletAgent.COMMAND_IS_OPEN, access=ACCESS_NONE)
+async def is_open_command(agent: WalletAgentProcessor, req: dict, **kwargs):
+    ret = agent.wallet is not None and agent.wallet.is_open
+    return dict(ret=ret)
+
+
+@agent_command(WalletAgent.COMMAND_STATS)
+async def stats_command(agent: WalletAgentProcessor, req: dict, **kwargs):
+    return dict(ret=agent.stats.to_dict())
+
+
+@agent_command(WalletAgent.COMMAND_CACHE_STATS)
+async def cache_stats_command(agent: WalletAgentProcessor, req: dict, **kwargs):
+    return dict(ret=agent.wallet.cache_stats())
+
+
+# Commands that change agent state or execution order can't be batched
+BATCH_FORBIDDEN_COMMANDS = [
+    WalletAgent.COMMAND_OPEN, WalletAgent.COMMAND_CLOSE, WalletAgent.COMMAND_BATCH,
+    WalletAgent.COMMAND_START_STATE_MACHINE, WalletAgent.COMMAND_INVOKE_STATE_MACHINE,
+    WalletAgent.COMMAND_KILL_STATE_MACHINE
+]
+
+
+def resolve_batch_refs(kwargs: dict, results: list):
+    resolved = dict()
+    for name, value in kwargs.items():
+        if isinstance(value, dict) and list(value.keys()) == ['$ref']:
+            ref = str(value['$ref'])
+            path = ref.split('.')
+            try:
+                item = results[int(path[0])]
+            except (ValueError, IndexError):
+                raise WalletOperationError('Invalid reference: %s' % ref)
+            if 'error' in item:
+                raise WalletOperationError('Reference to failed command: %s' % ref)
+            value = item['ret']
+            for key in path[1:]:
+                try:
+                    value = value[int(key)] if isinstance(value, list) else value[key]
+                except (ValueError, IndexError, KeyError, TypeError):
+                    raise WalletOperationError('Invalid reference: %s' % ref)
+        resolved[name] = value
+    return resolved
+
+
+@agent_command(WalletAgent.COMMAND_BATCH)
+async def batch_command(agent: WalletAgentProcessor, req: dict, commands: list, stop_on_error: bool=True):
+    results = []
+    for item in commands:
+        command = item.get('command', None)
+        try:
+            if command in BATCH_FORBIDDEN_COMMANDS:
+                raise WalletOperationError('Command "%s" is not allowed in batch' % command)
+            kwargs = resolve_batch_refs(item.get('kwargs', None) or {}, results)
+        except WalletOperationError as e:
+            resp = dict(error=dict(error_code=e.error_code, error_message=e.error_message))
+        else:
+            resp = await agent.execute(dict(command=command, kwargs=kwargs), authorized=True)
+        if 'error' in resp:
+            results.append(dict(error=resp['error']))
+            if stop_on_error:
+                break
+        else:
+            results.append(dict(ret=resp.get('ret')))
+    return dict(ret=results)
+
+
+@agent_command(WalletAgent.COMMAND_CREATE_KEY)
+async def create_key_command(agent: WalletAgentProcessor, req: dict, seed: str=None, **kwargs):
+    ret = await agent.wallet.create_key(seed)
+    return dict(ret=ret)
+
+
+@agent_command(WalletAgent.COMMAND_CREATE_AND_STORE_MY_DID)
+async def create_and_store_my_did_command(agent: WalletAgentProcessor, req: dict, **kwargs):
+    ret = await agent.wallet.create_and_store_my_did(**kwargs)
+    my_did, my_vk = ret
+    try:
+        await agent.wallet.add_wallet_record(WALLET_KEY_TO_DID_KEY, my_vk, my_did)
+    except:
+        pass
+    return dict(ret=ret)
+
+
+@agent_command(WalletAgent.COMMAND_CREATE_MANY)
+async def create_many_command(agent: WalletAgentProcessor, req: dict, items: list, keys_only: bool=False, **kwargs):
+    if len(items) > WalletAgent.CREATE_MANY_CHUNK:
+        raise WalletOperationError('Expected at most %d items' % WalletAgent.CREATE_MANY_CHUNK)
+
+    async def create(item: dict):
+        seed = item.get('seed', None)
+        metadata = item.get('metadata', None)
+        try:
+            if keys_only:
+                did = None
+                verkey = await agent.wallet.create_key(seed)
+                if metadata:
+                    await agent.wallet.set_key_metadata(verkey, metadata)
+            else:
+                did, verkey = await agent.wallet.create_and_store_my_did(seed)
+                await agent.wallet.add_wallet_record(WALLET_KEY_TO_DID_KEY, verkey, did)
+                if metadata:
+                    await agent.wallet.set_did_metadata(did, metadata)
+        except BaseWalletException as e:
+            return dict(error=dict(error_code=e.error_code, error_message=e.error_message))
+        return dict(ret=dict(did=did, verkey=verkey))
+
+    ret = await asyncio.gather(*[create(item) for item in items])
+    return dict(ret=list(ret))
+
+
+@agent_command(WalletAgent.COMMAND_ADD_WALLET_RECORD)
+async def add_wallet_record_command(agent: WalletAgentProcessor, req: dict, **kwargs):
+    ret = await agent.wallet.add_wallet_record(**kwargs)
+    return dict(ret=ret)
+
+
+@agent_command(WalletAgent.COMMAND_DID_FOR_KEY)
+async def did_for_key_command(agent: WalletAgentProcessor, req: dict, key: str, **kwargs):
+    did = await agent.wallet.get_wallet_record(WALLET_KEY_TO_DID_KEY, key)
+    return dict(ret=did)
+
+
+@agent_command(WalletAgent.COMMAND_CREATE_PAIRWISE_STATICALLY)
+async def create_pairwise_statically_command(
+        agent: WalletAgentProcessor, req: dict, their_did: str, their_vk: str, my_did: str, metadata: dict=None
+):
+    await agent.wallet.store_their_did(their_did, their_vk)
+    try:
+        await agent.wallet.add_wallet_record(WALLET_KEY_TO_DID_KEY, their_vk, their_did)
+    except:
+        pass
+    ret = await agent.wallet.create_pairwise(their_did=their_did, my_did=my_did, metadata=metadata)
+    return dict(ret=ret)
+
+
+@agent_command(WalletAgent.COMMAND_PACK_MESSAGE, access=ACCESS_OPEN)
+async def pack_message_command(agent: WalletAgentProcessor, req: dict, **kwargs):
+    ret = await agent.wallet.pack_message(**kwargs)
+    return dict(ret=ret)
+
+
+@agent_command(WalletAgent.COMMAND_UNPACK_MESSAGE, access=ACCESS_OPEN)
+async def unpack_message_command(agent: WalletAgentProcessor, req: dict, wire_msg_bytes):
+    if isinstance(wire_msg_bytes, str):
+        wire_msg_bytes = wire_msg_bytes.encode('utf-8')
+    ret = await agent.wallet.unpack_message(wire_msg_bytes)
+    return dict(ret=ret)
+
+
+@agent_command(WalletAgent.COMMAND_START_STATE_MACHINE, access=ACCESS_OPEN)
+async def start_state_machine_command(agent: WalletAgentProcessor, req: dict, ttl: int, **kwargs):
+    machine_id = kwargs['machine_id']
+    # Restarted machine must not keep context of previous run in memory
+    await agent.drop_state_machine(machine_id)
+    await database_sync_to_async(machine_started)(**kwargs)
+    agent.machines_die_time[machine_id] = now() + timedelta(seconds=ttl)
+    return dict(ret=True)
+
+
+@agent_command(WalletAgent.COMMAND_INVOKE_STATE_MACHINE, access=ACCESS_NONE)
+async def invoke_state_machine_command(agent: WalletAgentProcessor, req: dict, is_bytes: bool, **kwargs):
+    try:
+        if is_bytes and isinstance(kwargs['data'], str):
+            kwargs['data'] = kwargs['data'].encode('utf-8')
+        await agent.invoke_state_machine(**kwargs)
+    except Exception:
+        logging.exception('Error while invoking state machine')
+    return dict(ret=True)
+
+
+@agent_command(WalletAgent.COMMAND_KILL_STATE_MACHINE)
+async def kill_state_machine_command(agent: WalletAgentProcessor, req: dict, id_: str, **kwargs):
+    await agent.kill_state_machine(id_)
+    return dict(ret=True)
+
+
+@agent_command(WalletAgent.COMMAND_ACCESS_LOG)
+async def access_log_command(agent: WalletAgentProcessor, req: dict, **kwargs):
+    return dict(ret=agent.wallet.log_channel_name)
+
+
+@agent_command(WalletAgent.COMMAND_SIGN_AND_SUBMIT_REQUEST)
+async def sign_and_submit_request_command(agent: WalletAgentProcessor, req: dict, self_did: str, request_json: str):
+    ret = await agent.wallet.sign_and_submit_request(self_did, json.loads(request_json))
+    return dict(ret=ret)
+
+
+for command_, method_name_ in [
+    (WalletAgent.COMMAND_GET_WALLET_RECORD, 'get_wallet_record'),
+    (WalletAgent.COMMAND_UPDATE_WALLET_RECORD, 'update_wallet_record_value'),
+    (WalletAgent.COMMAND_KEY_FOR_LOCAL_DID, 'key_for_local_did'),
+    (WalletAgent.COMMAND_GET_PAIRWISE, 'get_pairwise'),
+    (WalletAgent.COMMAND_LIST_PAIRWISE, 'list_pairwise'),
+    (WalletAgent.COMMAND_SEARCH_PAIRWISE, 'search_pairwise'),
+    (WalletAgent.COMMAND_FIND_PAIRWISE, 'find_pairwise'),
+    (WalletAgent.COMMAND_CREATE_PAIRWISE, 'create_pairwise'),
+    (WalletAgent.COMMAND_WRITE_LOG, 'log'),
+    (WalletAgent.COMMAND_LIST_MY_DIDS_WITH_META, 'list_my_dids_with_meta'),
+    (WalletAgent.COMMAND_BUILD_NYM_REQUEST, 'build_nym_request'),
+    (WalletAgent.COMMAND_BUILD_SCHEMA_REQUEST, 'build_schema_request'),
+    (WalletAgent.COMMAND_ISSUER_CREATE_CRED_DEF, 'issuer_create_credential_def'),
+    (WalletAgent.COMMAND_ISSUER_CREATE_CRED_OFFER, 'issuer_create_credential_offer'),
+    (WalletAgent.COMMAND_PROVER_CREATE_MASTER_SECRET, 'prover_create_master_secret'),
+    (WalletAgent.COMMAND_PROVER_CREATE_CRED_REQ, 'prover_create_credential_req'),
+    (WalletAgent.COMMAND_ISSUER_CREATE_CRED, 'issuer_create_credential'),
+    (WalletAgent.COMMAND_PROVER_STORE_CRED, 'prover_store_credential'),
+    (WalletAgent.COMMAND_BUILD_GET_NYM_REQUEST, 'build_get_nym_request'),
+    (WalletAgent.COMMAND_BUILD_ATTRIB_REQUEST, 'build_attrib_request'),
+    (WalletAgent.COMMAND_BUILD_GET_ATTRIB_REQUEST, 'build_get_attrib_request'),
+    (WalletAgent.COMMAND_PROVER_SEARCH_CREDS_FOR_PROOF_REQ, 'prover_search_credentials_for_proof_req'),
+    (WalletAgent.COMMAND_PROVER_CLOSE_CRED_SEARCH_FOR_PROOF_REQ, 'prover_close_credentials_search_for_proof_req'),
+    (WalletAgent.COMMAND_PROVER_FETCH_CRED_FOR_PROOF_REQ, 'prover_fetch_credentials_for_proof_req'),
+    (WalletAgent.COMMAND_PROVER_CREATE_PROOF, 'prover_create_proof'),
+]:
+    register_wallet_method(command_, method_name_)
 
 
 def try_load_started_machine(id_: str):
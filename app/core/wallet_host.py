@@ -0,0 +1,165 @@
+import time
+import asyncio
+import logging
+
+from django.conf import settings
+
+from core.base import AsyncReqResp
+from core.hashring import HashRing
+from core.wallet import WalletAgent, WalletAgentProcessor, WalletOperationError, BaseWalletException
+
+
+COMMAND_ATTACH = 'attach'
+COMMAND_STATS = 'stats'
+
+
+def config():
+    return settings.INDY['WALLET_SETTINGS']['HOSTS']
+
+
+class WalletHost:
+    """Serve many wallet agents in single process
+
+    Every attached agent listens its own wallet address, so requests are routed by address
+    while all agents share the event loop and Redis connections of the process.
+    If host is full then least recently used idle agent is hibernated to free slot.
+    """
+
+    def __init__(self, name: str, max_open_wallets: int):
+        self.name = name
+        self.max_open_wallets = max_open_wallets
+        self.agents = dict()
+        self.processors = dict()
+        self.evictions = 0
+        # agent name -> future of attach that waits for ping
+        self.__attaching = dict()
+
+    @staticmethod
+    def make_address(name: str):
+        return 'wallet-host/%s' % name
+
+    async def attach(self, agent_name: str):
+        """Start serving wallet agent"""
+        if agent_name in self.agents:
+            return
+        pending = self.__attaching.get(agent_name, None)
+        if pending is not None:
+            await asyncio.shield(pending)
+            return
+        pending = asyncio.Future()
+        self.__attaching[agent_name] = pending
+        try:
+            served_elsewhere = await WalletAgent.ping(agent_name, timeout=1)
+        finally:
+            del self.__attaching[agent_name]
+            pending.set_result(None)
+        if served_elsewhere:
+            # Agent is served by another process
+            return
+        # Capacity is checked after ping: concurrent attaches may have taken slots meanwhile,
+        # there are no awaits from here until the slot is taken
+        if len(self.agents) >= self.max_open_wallets:
+            self.__evict()
+        processor = WalletAgentProcessor(agent_name)
+        task = asyncio.ensure_future(WalletAgent.process(agent_name, processor))
+        self.agents[agent_name] = task
+        self.processors[agent_name] = processor
+        task.add_done_callback(lambda f: self.__detached(agent_name, f))
+        logging.info('Wallet agent "%s" is attached to host "%s"' % (agent_name, self.name))
+
+    def stats(self):
+        return dict(
+            host=self.name, agents=len(self.agents), max_open_wallets=self.max_open_wallets, evictions=self.evictions
+        )
+
+    async def run(self):
+        listener = AsyncReqResp(self.make_address(self.name))
+        await listener.start_listening()
+        logging.info('Wallet host "%s" is started' % self.name)
+        try:
+            while True:
+                req, chan = await listener.wait_req()
+                asyncio.ensure_future(self.__handle(req, chan))
+        finally:
+            tasks = list(self.agents.values())
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.wait(tasks)
+            await listener.stop_listening()
+
+    async def __handle(self, req: dict, chan):
+        try:
+            try:
+                if req['command'] == COMMAND_ATTACH:
+                    await self.attach(req['agent_name'])
+                    resp = dict(ret=True)
+                elif req['command'] == COMMAND_STATS:
+                    resp = dict(ret=self.stats())
+                else:
+                    raise WalletOperationError('Unknown command: %s' % req['command'])
+            except BaseWalletException as e:
+                resp = dict(error=dict(error_code=e.error_code, error_message=e.error_message))
+            await chan.write(resp)
+        finally:
+            await chan.close()
+
+    def __evict(self):
+        idle = [
+            (processor.idle_time(), name) for name, processor in self.processors.items()
+            if not processor.in_flight and not processor.machines
+        ]
+        if not idle:
+            raise WalletOperationError('Wallet host "%s" serves %d wallets' % (self.name, len(self.agents)))
+        _, agent_name = max(idle)
+        logging.info('Wallet agent "%s" is evicted from host "%s"' % (agent_name, self.name))
+        self.processors.pop(agent_name).hibernate()
+        self.agents.pop(agent_name).cancel()
+        self.evictions += 1
+
+    def __detached(self, agent_name: str, fut: asyncio.Future):
+        if self.agents.get(agent_name, None) is fut:
+            del self.agents[agent_name]
+            del self.processors[agent_name]
+        if not fut.cancelled() and fut.exception():
+            logging.error('Wallet agent "%s" terminated with exception: %s' % (agent_name, fut.exception()))
+
+
+_rings = dict()
+
+
+def host_for_wallet(agent_name: str):
+    """Name of the host serving wallet, None if wallet hosts are not configured"""
+    cfg = config()
+    names = tuple(cfg['NAMES'])
+    if not names:
+        return None
+    ring = _rings.get(names, None)
+    if ring is None:
+        ring = HashRing(names, cfg['REPLICAS'])
+        _rings[names] = ring
+    return ring.get_node(agent_name)
+
+
+async def attach_to_host(agent_name: str, timeout: float) -> bool:
+    """Ask wallet host to serve agent and wait until agent responds
+
+    Return: False if wallet hosts are not configured or host can't serve agent
+    """
+    host = host_for_wallet(agent_name)
+    if host is None:
+        return False
+    until_to = time.monotonic() + timeout
+    packet = dict(command=COMMAND_ATTACH, agent_name=agent_name)
+    success, resp = await AsyncReqResp(WalletHost.make_address(host)).req(packet, timeout)
+    if not success:
+        logging.warning('Wallet host "%s" is not available' % host)
+        return False
+    if resp.get('error', None):
+        logging.warning('Wallet host "%s" refused agent: %s' % (host, resp['error']['error_message']))
+        return False
+    while time.monotonic() < until_to:
+        if await WalletAgent.ping(agent_name, timeout=1):
+            return True
+        await asyncio.sleep(0.1)
+    return False
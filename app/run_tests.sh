@@ -3,8 +3,17 @@ cd /app
 
 echo "Running PyTest"
 pytest core/tests/pytest_wallets.py
+pytest core/tests/pytest_supervisor.py
+pytest core/tests/pytest_wallet_host.py
 pytest core/tests/pytest_reqresp.py
 pytest core/tests/pytest_channels.py
+pytest core/tests/pytest_redis_pool.py
+pytest core/tests/pytest_packets.py
+pytest core/tests/pytest_broadcast.py
+pytest core/tests/pytest_outbox.py
+pytest core/tests/pytest_inbound.py
+pytest core/tests/pytest_inbox.py
+pytest core/tests/pytest_sync2async.py
 pytest core/tests/pytest_ledger.py
 pytest core/tests/pytest_aries_0094_cross_domain_routing.py
 pytest core/tests/pytest_aries_0160_connection_protocol.py
@@ -101,6 +101,8 @@ DATABASES['primary'] = DATABASES['default']
 
 WSGI_APPLICATION = 'settings.wsgi.application'
 ASGI_APPLICATION = 'settings.routing.application'
+# Serve agent inbound endpoint by async consumer on ASGI event loop, off: by Django view in threads pool
+ASYNC_INBOUND_ENDPOINT = os.getenv('ASYNC_INBOUND_ENDPOINT', 'on') == 'on'
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.11/topics/i18n/
@@ -175,6 +177,53 @@ CACHES = {
 
 REDIS_ADDRESS = os.getenv('REDIS', 'redis')
 REDIS_CONN_TIMEOUT = 5.0
+REDIS_POOL = {
+    'MIN_SIZE': int(os.getenv('REDIS_POOL_MIN_SIZE', 1)),
+    'MAX_SIZE': int(os.getenv('REDIS_POOL_MAX_SIZE', 10)),
+    'CONN_TIMEOUT': REDIS_CONN_TIMEOUT,
+    'HEALTH_CHECK_INTERVAL': float(os.getenv('REDIS_POOL_HEALTH_CHECK_INTERVAL', 15.0))  # sec, 0 to disable
+}
+# Rolling upgrade: agents and readers of previous versions understand neither multiplexed replies
+# nor msgpack packets, while current ones accept both formats. Upgrade all processes with defaults,
+# then opt in with REDIS_RPC_MULTIPLEXED=on and REDIS_PACKET_CODEC=msgpack.
+# Replies to all requests of the process are delivered to single inbox and matched by request id
+REDIS_RPC_MULTIPLEXED = os.getenv('REDIS_RPC_MULTIPLEXED', 'off') == 'on'
+# Channel packets codec: msgpack | json
+REDIS_PACKET_CODEC = os.getenv('REDIS_PACKET_CODEC', 'json')
+# Transport of wallet agents requests: pubsub | streams
+REDIS_RPC_TRANSPORT = os.getenv('REDIS_RPC_TRANSPORT', 'pubsub')
+REDIS_STREAMS = {
+    'MAX_LEN': 10000,  # approximate limit of stream length
+    'MAX_BACKLOG': int(os.getenv('REDIS_STREAMS_MAX_BACKLOG', 1000)),  # requests are rejected if backlog is full
+    'READ_COUNT': 16,
+    'BLOCK_TIMEOUT': 1.0,  # sec
+    'CONSUMER_TTL': 5,  # sec, requests are rejected if consumer is silent for this time
+}
+STATE_MACHINES = {
+    # Sec, changed state is written to database with delay to merge writes of successive messages,
+    # 0: written at the end of every invoke
+    'FLUSH_DELAY': float(os.getenv('STATE_MACHINES_FLUSH_DELAY', 0)),
+}
+# Event loops running coroutines of sync views (core.sync2async.run_async)
+SYNC2ASYNC = {
+    'LOOPS': int(os.getenv('SYNC2ASYNC_LOOPS', 4)),
+    'LAG_PROBE_INTERVAL': 0.5,  # sec, 0 to disable
+}
+# Inbound endpoints lookups cache, see transport.resolver
+RESOLVER = {
+    'LOCAL_SIZE': 10000,
+    'LOCAL_TTL': float(os.getenv('RESOLVER_LOCAL_TTL', 5.0)),  # sec, entries invalidated by other processes live so long
+    'SHARED_TTL': 300,  # sec
+}
+# Outbound HTTP connections to agents endpoints, shared by all requests of event loop
+HTTP_POOL = {
+    'LIMIT': int(os.getenv('HTTP_POOL_LIMIT', 100)),
+    'LIMIT_PER_HOST': int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', 10)),
+    'KEEPALIVE_TIMEOUT': 30.0,  # sec
+    'DNS_CACHE_TTL': 300,  # sec
+    'CONN_TIMEOUT': float(os.getenv('HTTP_POOL_CONN_TIMEOUT', 10.0)),  # sec
+    'READ_TIMEOUT': float(os.getenv('HTTP_POOL_READ_TIMEOUT', 30.0)),  # sec
+}
 
 CHANNEL_LAYERS = {
     "default": {
@@ -209,6 +258,43 @@ INDY = {
             'AGENT_START': 30,  # timeout SEC
             'CRED_DEF_STORE': 60
         },
+        # Max count of DID, key, pairwise and record lookups cached by wallet connection, 0 to disable
+        'CONNECTION_CACHE_SIZE': int(os.getenv('WALLET_CONNECTION_CACHE_SIZE', 1024)),
+        # Pairwise search cursor is closed if it was not used for this time, sec
+        'PAIRWISE_SEARCH_TTL': 300,
+        'AGENT': {
+            # Max count of commands running or waiting for execution inside wallet agent
+            'MAX_IN_FLIGHT': int(os.getenv('WALLET_AGENT_MAX_IN_FLIGHT', 64)),
+            # Agent closes wallet and stops if there were no commands for this time, sec, 0 to disable
+            'IDLE_TTL': int(os.getenv('WALLET_AGENT_IDLE_TTL', 0)),
+            # Lifetime of session tokens issued instead of pass phrase checks, sec, 0 to disable
+            'SESSION_TTL': int(os.getenv('WALLET_AGENT_SESSION_TTL', 300)),
+            # Running agent refreshes its heartbeat key, key expires if agent is dead
+            'HEARTBEAT_INTERVAL': 2.0,  # sec
+            'HEARTBEAT_TTL': 6,  # sec
+            'COMMAND_CLASSES': {
+                'cheap': {'CONCURRENCY': 32, 'MAX_QUEUED': 64},
+                'expensive': {'CONCURRENCY': 2, 'MAX_QUEUED': 16},
+                'serial': {'CONCURRENCY': 1, 'MAX_QUEUED': 32}
+            }
+        },
+        # Wallets served by agents embedded into API processes instead of separate agents, '*' for all wallets
+        'EMBEDDED_WALLETS': [name for name in os.getenv('WALLET_EMBEDDED', '').split(',') if name],
+        'SUPERVISOR': {
+            # local: agents are started by API process, service: by run_agents_supervisor command
+            'MODE': os.getenv('WALLET_AGENTS_SUPERVISOR', 'local'),
+            'MAX_CONCURRENT_STARTS': int(os.getenv('WALLET_AGENTS_MAX_CONCURRENT_STARTS', 4)),
+            'POLL_INTERVAL': 1.0,  # sec
+            'MAX_RESTARTS': 5,
+            'RESTART_BACKOFF_MIN': 1.0,  # sec
+            'RESTART_BACKOFF_MAX': 60.0  # sec
+        },
+        'HOSTS': {
+            # Names of wallet hosts: run_wallet_agent --host <name>, wallets are assigned to hosts by consistent hashing
+            'NAMES': [name for name in os.getenv('WALLET_HOSTS', '').split(',') if name],
+            'MAX_OPEN_WALLETS': int(os.getenv('WALLET_HOST_MAX_OPEN_WALLETS', 100)),
+            'REPLICAS': 64
+        },
         'PROVER_MASTER_SECRET_NAME': os.getenv('PROVER_MASTER_SECRET_NAME') or SECRET_KEY
     },
     'LEDGER': {
@@ -216,6 +302,43 @@ INDY = {
             'READ': 30  # 30 sec
         }
     },
+    'MESSAGING': {
+        # Max count of concurrent deliveries of broadcast message
+        'BROADCAST_FAN_OUT': int(os.getenv('BROADCAST_FAN_OUT', 16)),
+        # Outbound messages to http endpoints are enqueued and delivered by run_outbox_worker command
+        'OUTBOX': {
+            'ENABLED': os.getenv('OUTBOX', 'off') == 'on',
+            'MAX_IN_FLIGHT': int(os.getenv('OUTBOX_MAX_IN_FLIGHT', 64)),
+            'MAX_PER_DESTINATION': int(os.getenv('OUTBOX_MAX_PER_DESTINATION', 4)),
+            'MAX_ATTEMPTS': int(os.getenv('OUTBOX_MAX_ATTEMPTS', 10)),
+            'BACKOFF_MIN': 1.0,  # sec
+            'BACKOFF_MAX': 600.0,  # sec
+            'REQUEST_TIMEOUT': 30,  # sec
+            'MAX_LEN': 100000,
+            'READ_COUNT': 64,
+            'BLOCK_TIMEOUT': 1.0,  # sec
+            'RETRY_POLL_INTERVAL': 1.0,  # sec
+            # Entries not acknowledged for this time are delivered again by other worker,
+            # must be greater than REQUEST_TIMEOUT plus time spent waiting for destination slot
+            'CLAIM_IDLE': 300.0,  # sec
+            'MAINTENANCE_INTERVAL': 5.0  # sec, latency publishing and claiming of idle entries
+        },
+        # Inbound messages are appended to partitioned inbox and processed by run_inbox_worker command,
+        # endpoint processes messages itself while workers are not running
+        'INBOX': {
+            'ENABLED': os.getenv('INBOX', 'off') == 'on',
+            'PARTITIONS': int(os.getenv('INBOX_PARTITIONS', 16)),
+            'MAX_ATTEMPTS': int(os.getenv('INBOX_MAX_ATTEMPTS', 5)),
+            'RETRY_DELAY_MIN': 1.0,  # sec
+            'RETRY_DELAY_MAX': 30.0,  # sec
+            'RETRY_POLL_INTERVAL': 0.5,  # sec
+            'MAX_BACKLOG': int(os.getenv('INBOX_MAX_BACKLOG', 10000)),
+            'MAX_LEN': 100000,
+            'READ_COUNT': 64,
+            'BLOCK_TIMEOUT': 1.0,  # sec
+            'CONSUMER_TTL': 5  # sec
+        }
+    },
     'INVITATION_URL_BASE': os.getenv('INDY_INVITATION_URL_BASE', 'https://socialsirius.com/invitation'),
     'GENESIS_TXN_FILE_PATH': os.getenv('INDY_GENESIS_TXN_FILE_PATH', '/home/indy/sandbox/pool_transactions_genesis'),
     'PROTOCOL_VERSION': 2,
@@ -2,15 +2,25 @@ import importlib
 
 from channels.db import database_sync_to_async as sync_to_async
 from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.http import AsgiHandler
 from django.conf.urls import url
 from django.conf import settings
 from django.http.request import HttpRequest
 
 from api.websockets import WalletStatusNotification
+from transport.consumers import EndpointConsumer
+
+
+http_urls = []
+if settings.ASYNC_INBOUND_ENDPOINT:
+    http_urls.append(url(r'^agent/endpoints/(?P<uid>\w+)/$', EndpointConsumer))
+# Other requests are served by Django views
+http_urls.append(url(r'', AsgiHandler))
 
 
 application = ProtocolTypeRouter(
     {
+        "http": URLRouter(http_urls),
         "websocket":
             URLRouter([
                 url("^agent/ws/wallets/status/$", WalletStatusNotification),
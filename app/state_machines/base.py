@@ -1,42 +1,102 @@
+import json
+import asyncio
+import logging
 from abc import ABC, abstractmethod
 
 from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
 
 from core.wallet import WalletConnection
 from .models import StateMachine as StateMachinePersistent
 
 
+# Merge changed keys into stored context and drop deleted ones
+UPDATE_CONTEXT_SQL = 'UPDATE {table} SET context = (context || %s::jsonb) - %s::text[], last_access = %s WHERE id = %s'
+
+
 class MachineIsDone(Exception):
     pass
 
 
 class BaseStateMachine:
 
-    """State machine is running inside Django-Channel infrastructure"""
+    """State machine is running inside Django-Channel infrastructure
+
+    Context is loaded from persistent storage on first invoke only and kept in memory while
+    machine is live, changed keys are written after every invoke or in FLUSH_DELAY seconds.
+    Wallet agent flushes pending changes when it terminates.
+    """
 
     def __init__(self, id_: str):
         self.__id = 'machine://%s:%s' % (self.__class__.__name__, id_)
         self.__cache = dict()
         self.__wallet = None
+        self.__loaded = False
+        self.__dirty = set()
+        self.__deleted = set()
+        self.__flush_timer = None
 
     def setup(self, **kwargs):
         state = dict(**kwargs)
         self.__store_state(state)
+        self.__cache = state
+        self.__loaded = True
+        self.__dirty.clear()
+        self.__deleted.clear()
 
     @abstractmethod
     async def handle(self, content_type, data):
         pass
 
     async def invoke(self, content_type, data, wallet: WalletConnection=None):
-        self.__cache = await database_sync_to_async(self.__load_state)()
+        if not self.__loaded:
+            self.__cache = await database_sync_to_async(self.__load_state)()
+            self.__loaded = True
+            self.__dirty.clear()
+            self.__deleted.clear()
         self.__wallet = wallet
         await self.handle(content_type, data)
-        await database_sync_to_async(self.__store_state)(self.__cache)
+        delay = settings.STATE_MACHINES['FLUSH_DELAY']
+        if delay:
+            if self.__flush_timer is None:
+                self.__flush_timer = asyncio.get_event_loop().call_later(delay, self.__on_flush_timer)
+        else:
+            await self.flush()
+
+    async def flush(self):
+        """Write changed keys to persistent storage"""
+        if not self.__loaded:
+            return
+        if self.__flush_timer is not None:
+            self.__flush_timer.cancel()
+            self.__flush_timer = None
+        changed = {key: self.__cache[key] for key in self.__dirty if key in self.__cache}
+        deleted = list(self.__deleted)
+        self.__dirty.clear()
+        self.__deleted.clear()
+        try:
+            await database_sync_to_async(self.__update_state)(changed, deleted)
+        except Exception:
+            # Keep keys dirty to write them with next flush unless they were changed again
+            self.__dirty.update(key for key in changed if key not in self.__deleted)
+            self.__deleted.update(key for key in deleted if key not in self.__cache)
+            raise
+
+    def discard(self):
+        """Drop changes that are not written yet"""
+        if self.__flush_timer is not None:
+            self.__flush_timer.cancel()
+            self.__flush_timer = None
+        self.__dirty.clear()
+        self.__deleted.clear()
 
     def get_id(self):
         return self.__id
 
     async def done(self):
+        self.discard()
         await database_sync_to_async(self.__before_done)()
         raise MachineIsDone()
 
@@ -55,21 +115,48 @@ class BaseStateMachine:
         # update last_access anyway
         state.save()
 
+    def __update_state(self, changed: dict, deleted: list):
+        """Update changed keys of stored state by single query, last_access is updated anyway"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                UPDATE_CONTEXT_SQL.format(table=StateMachinePersistent._meta.db_table),
+                [json.dumps(changed), deleted, timezone.now(), self.__id]
+            )
+            updated = cursor.rowcount
+        if updated == 0:
+            # Stored state was removed while machine is live
+            StateMachinePersistent.objects.update_or_create(id=self.__id, defaults=dict(context=self.__cache))
+
+    def __on_flush_timer(self):
+        self.__flush_timer = None
+        fut = asyncio.ensure_future(self.flush())
+        fut.add_done_callback(self.__on_flushed)
+
+    def __on_flushed(self, fut):
+        if not fut.cancelled() and fut.exception():
+            logging.error('Error while flushing state of "%s": %s' % (self.__id, fut.exception()))
+
     def __before_done(self):
         StateMachinePersistent.objects.filter(id=self.__id).all().delete()
 
     def __getattribute__(self, item: str):
-        if item.startswith('_') or item in ['invoke', 'handle', 'get_id', 'get_wallet', 'setup', 'done']:
+        if item.startswith('_') or item in ['invoke', 'handle', 'get_id', 'get_wallet', 'setup', 'done', 'flush', 'discard']:
             value = super().__getattribute__(item)
             return value
         else:
-            return self.__cache.get(item, None)
+            value = self.__cache.get(item, None)
+            if isinstance(value, (dict, list)):
+                # Value may be changed in place
+                self.__dirty.add(item)
+            return value
 
     def __setattr__(self, key: str, value):
         if key.startswith('_'):
             super().__setattr__(key, value)
         else:
             self.__cache[key] = value
+            self.__dirty.add(key)
+            self.__deleted.discard(key)
 
     def __delattr__(self, item: str):
         if item.startswith('_'):
@@ -77,5 +164,7 @@ class BaseStateMachine:
         else:
             if item in self.__cache:
                 del self.__cache[item]
+                self.__dirty.discard(item)
+                self.__deleted.add(item)
             else:
                 raise AttributeError('Attribute "%s" not found' % item)
@@ -1,4 +1,7 @@
+import asyncio
+
 import pytest
+from django.conf import settings
 
 from authentication.models import AgentAccount
 from transport.models import Endpoint
@@ -66,3 +69,71 @@ async def test_persistence():
     await machine3.invoke('test3', 'AnyValue2')
     assert machine3.value1 == machine1.value1
     assert machine3.value2 == machine1.value2
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db
+async def test_dirty_keys_flush():
+    machine = PersistenceMachine('dirty-machine-id')
+    await machine.invoke('any_content_type', 'AnyValue1')
+    state = StateMachine.objects.get(id=machine.get_id())
+    assert state.context == dict(value1='AnyValue1', value2=None)
+
+    # Only changed keys are written, so keys stored by others are kept
+    StateMachine.objects.filter(id=machine.get_id()).update(
+        context=dict(value1='AnyValue1', value2=None, external=1)
+    )
+    await machine.invoke('any_content_type', 'AnyValue2')
+    state = StateMachine.objects.get(id=machine.get_id())
+    assert state.context == dict(value1='AnyValue1', value2='AnyValue2', external=1)
+
+    del machine.value1
+    await machine.flush()
+    state = StateMachine.objects.get(id=machine.get_id())
+    assert state.context == dict(value2='AnyValue2', external=1)
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db
+async def test_flush_delay():
+    cfg = settings.STATE_MACHINES
+    saved = dict(cfg)
+    cfg['FLUSH_DELAY'] = 0.5
+    try:
+        machine = PersistenceMachine('delayed-machine-id')
+        await machine.invoke('any_content_type', 'AnyValue1')
+        await machine.invoke('any_content_type', 'AnyValue2')
+        state = StateMachine.objects.get(id=machine.get_id())
+        assert state.context == dict(value1=None, value2=None)
+        await asyncio.sleep(1)
+        state = StateMachine.objects.get(id=machine.get_id())
+        assert state.context == dict(value1='AnyValue1', value2='AnyValue2')
+    finally:
+        cfg.clear()
+        cfg.update(saved)
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db
+async def test_pending_changes():
+    cfg = settings.STATE_MACHINES
+    saved = dict(cfg)
+    cfg['FLUSH_DELAY'] = 0.5
+    try:
+        # Pending changes are written by explicit flush, like on agent termination
+        machine = PersistenceMachine('pending-machine-id')
+        await machine.invoke('any_content_type', 'AnyValue1')
+        await machine.flush()
+        state = StateMachine.objects.get(id=machine.get_id())
+        assert state.context == dict(value1='AnyValue1', value2=None)
+        # Changes of replaced instance are discarded and don't overwrite new context
+        await machine.invoke('any_content_type', 'AnyValue2')
+        machine.discard()
+        restarted = PersistenceMachine('pending-machine-id')
+        restarted.setup(value1='New')
+        await asyncio.sleep(1)
+        state = StateMachine.objects.get(id=machine.get_id())
+        assert state.context == dict(value1='New')
+    finally:
+        cfg.clear()
+        cfg.update(saved)
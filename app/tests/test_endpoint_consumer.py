@@ -0,0 +1,120 @@
+import json
+import uuid
+import asyncio
+from unittest.mock import patch
+
+from channels.testing import HttpCommunicator
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.conf import settings
+
+from authentication.models import AgentAccount
+from api.models import Wallet
+from core.base import ReadOnlyChannel
+from settings.routing import application
+from transport.models import Endpoint
+from transport.const import JSON_CONTENT_TYPES, WIRED_CONTENT_TYPES
+from transport.utils import make_wallet_wired_messages_channel_name
+from transport.views import INBOUND_ROUTER
+from transport.resolver import resolve_endpoint, resolver_stats
+
+
+class EndpointConsumerTest(TransactionTestCase):
+
+    IDENTITY = 'test'
+    WALLET_UID = 'test_wallet_uid'
+
+    def setUp(self):
+        self.account = AgentAccount.objects.create(username=self.IDENTITY, is_active=True)
+        wallet = Wallet.objects.create(uid=self.WALLET_UID, owner=self.account)
+        self.endpoint_uid = uuid.uuid4().hex
+        self.path = reverse('endpoint', kwargs=dict(uid=self.endpoint_uid))
+        Endpoint.objects.create(uid=self.endpoint_uid, owner=self.account, wallet=wallet, url=self.path)
+
+    @staticmethod
+    def post(path: str, body: bytes, content_type: str, method: str='POST'):
+        communicator = HttpCommunicator(
+            application, method, path, body=body, headers=[(b'content-type', content_type.encode())]
+        )
+        return asyncio.get_event_loop().run_until_complete(communicator.get_response(timeout=5))
+
+    def test_errors(self):
+        body = json.dumps(dict(content='x')).encode('utf-8')
+        resp = self.post(reverse('endpoint', kwargs=dict(uid='unknown')), body, JSON_CONTENT_TYPES[0])
+        self.assertEqual(404, resp['status'])
+        resp = self.post(self.path, body, 'text/plain')
+        self.assertEqual(406, resp['status'])
+        resp = self.post(self.path, b'', JSON_CONTENT_TYPES[0], method='GET')
+        self.assertEqual(405, resp['status'])
+        # Nobody listens wallet wired messages
+        resp = self.post(self.path, body, JSON_CONTENT_TYPES[0])
+        self.assertEqual(410, resp['status'])
+
+    def test_json_message(self):
+        message = dict(content=uuid.uuid4().hex)
+
+        async def run():
+            chan = await ReadOnlyChannel.create(make_wallet_wired_messages_channel_name(self.WALLET_UID))
+            try:
+                communicator = HttpCommunicator(
+                    application, 'POST', self.path, body=json.dumps(message).encode('utf-8'),
+                    headers=[(b'content-type', b'application/json; charset=utf-8')]
+                )
+                resp = await communicator.get_response(timeout=5)
+                self.assertEqual(202, resp['status'])
+                success, data = await chan.read(timeout=5)
+                self.assertTrue(success)
+                self.assertEqual(JSON_CONTENT_TYPES[0], data['content_type'])
+                self.assertEqual(message, data['transport'])
+            finally:
+                await chan.close()
+
+        asyncio.get_event_loop().run_until_complete(run())
+
+    def test_wire_message(self):
+        wire_message = uuid.uuid4().hex.encode()
+        routed = []
+
+        async def route(**kwargs):
+            routed.append(kwargs)
+            return True
+
+        with patch.object(INBOUND_ROUTER, 'route', side_effect=route):
+            resp = self.post(self.path, wire_message, WIRED_CONTENT_TYPES[0])
+        self.assertEqual(202, resp['status'])
+        self.assertEqual(1, len(routed))
+        self.assertEqual(self.WALLET_UID, routed[0]['agent_name'])
+        self.assertEqual(wire_message, routed[0]['wire_message'])
+        self.assertEqual(self.IDENTITY, routed[0]['my_label'])
+
+    def test_wire_message_timeout(self):
+
+        async def route(**kwargs):
+            await asyncio.sleep(10)
+            return True
+
+        timeouts = settings.INDY['WALLET_SETTINGS']['TIMEOUTS']
+        with patch.object(INBOUND_ROUTER, 'route', side_effect=route), patch.dict(timeouts, AGENT_REQUEST=0.5):
+            resp = self.post(self.path, uuid.uuid4().hex.encode(), WIRED_CONTENT_TYPES[0])
+        self.assertEqual(410, resp['status'])
+
+
+class ResolverTest(TestCase):
+
+    def test_endpoint_resolution(self):
+        account = AgentAccount.objects.create(username='owner', is_active=True)
+        wallet = Wallet.objects.create(uid=uuid.uuid4().hex, owner=account)
+        uid = uuid.uuid4().hex
+        Endpoint.objects.create(uid=uid, owner=account, wallet=wallet, url='http://example.com/endpoint')
+        hits = resolver_stats()['local_hits']
+        with self.assertNumQueries(1):
+            info = resolve_endpoint(uid)
+        self.assertEqual(wallet.uid, info['agent_name'])
+        self.assertEqual('owner', info['my_label'])
+        self.assertEqual('http://example.com/endpoint', info['my_endpoint'])
+        with self.assertNumQueries(0):
+            self.assertEqual(info, resolve_endpoint(uid))
+        self.assertEqual(hits + 1, resolver_stats()['local_hits'])
+        # Changes invalidate cached values
+        Endpoint.objects.filter(uid=uid).first().delete()
+        self.assertIsNone(resolve_endpoint(uid))
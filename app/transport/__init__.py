@@ -1 +1 @@
-
+default_app_config = 'transport.apps.TransportConfig'
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class TransportConfig(AppConfig):
     name = 'transport'
+
+    def ready(self):
+        # Connect cache invalidation signals
+        import transport.resolver
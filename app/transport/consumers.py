@@ -0,0 +1,56 @@
+import asyncio
+
+from django.conf import settings
+from channels.db import database_sync_to_async
+from channels.generic.http import AsyncHttpConsumer
+from rest_framework import status
+
+from transport.const import *
+from transport.resolver import resolve_endpoint, resolve_local_endpoint
+from transport.views import accept_wired_message
+
+
+class EndpointConsumer(AsyncHttpConsumer):
+    """Agent inbound endpoint running on ASGI event loop
+
+    Same contract as transport.views.endpoint without blocking worker thread
+    while message is processed by wallet agent
+    """
+
+    async def handle(self, body):
+        if self.scope['method'] != 'POST':
+            await self.send_response(
+                status.HTTP_405_METHOD_NOT_ALLOWED, b'', headers=[(b'Allow', b'POST')]
+            )
+            return
+        uid = self.scope['url_route']['kwargs']['uid']
+        endpoint = resolve_local_endpoint(uid) or await database_sync_to_async(resolve_endpoint)(uid)
+        if endpoint is None:
+            await self.send_response(status.HTTP_404_NOT_FOUND, b'')
+            return
+        content_type = self.content_type()
+        if content_type not in WIRED_CONTENT_TYPES + JSON_CONTENT_TYPES:
+            await self.send_response(status.HTTP_406_NOT_ACCEPTABLE, b'')
+            return
+        response_timeout = settings.INDY['WALLET_SETTINGS']['TIMEOUTS']['AGENT_REQUEST']
+        try:
+            status_code = await asyncio.wait_for(
+                accept_wired_message(
+                    agent_name=endpoint['agent_name'],
+                    my_label=endpoint['my_label'],
+                    my_endpoint=endpoint['my_endpoint'],
+                    content_type=content_type,
+                    body=body
+                ),
+                timeout=response_timeout
+            )
+        except asyncio.TimeoutError:
+            status_code = status.HTTP_410_GONE
+        await self.send_response(status_code, b'')
+
+    def content_type(self):
+        """Media type of request without parameters, like Django HttpRequest.content_type"""
+        for name, value in self.scope.get('headers', []):
+            if name.lower() == b'content-type':
+                return value.decode('latin-1').split(';')[0].strip().lower()
+        return ''
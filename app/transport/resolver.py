@@ -0,0 +1,141 @@
+import time
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from api.models import Wallet
+from core.cache import LRUCache
+from transport.models import Endpoint
+
+
+ENDPOINT_KEY = 'resolver:endpoint:%s'
+
+
+def config():
+    return settings.RESOLVER
+
+
+class Resolver:
+    """Endpoint lookups of inbound messages cached in process and in shared Django cache
+
+    Entries are invalidated on model save and delete, local entries of other processes
+    expire after LOCAL_TTL. Values are plain dicts for the hot inbound path only,
+    owner-checked API lookups go to database.
+    """
+
+    __instance = None
+
+    def __init__(self):
+        cfg = config()
+        self.local = LRUCache(cfg['LOCAL_SIZE'])
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def instance(cls) -> 'Resolver':
+        if cls.__instance is None:
+            cls.__instance = cls()
+        return cls.__instance
+
+    def get_local(self, key: str):
+        """Return: value if it is cached in process or None"""
+        with self.__lock:
+            cached = self.local.get(key)
+        if cached is LRUCache.MISSING:
+            return None
+        expire_at, value = cached
+        if expire_at < time.monotonic():
+            return None
+        self.local_hits += 1
+        return value
+
+    def resolve(self, key: str, loader):
+        """Cached value or value loaded from database by loader, None values are not cached"""
+        value = self.get_local(key)
+        if value is not None:
+            return value
+        cfg = config()
+        # Value loaded before concurrent invalidation is not cached locally
+        with self.__lock:
+            generation = self.local.generation
+        value = caches['default'].get(key)
+        if value is not None:
+            self.shared_hits += 1
+        else:
+            self.misses += 1
+            value = loader()
+            if value is None:
+                return None
+            caches['default'].set(key, value, cfg['SHARED_TTL'])
+        with self.__lock:
+            self.local.put(key, (time.monotonic() + cfg['LOCAL_TTL'], value), generation)
+        return value
+
+    def invalidate(self, *keys):
+        with self.__lock:
+            for key in keys:
+                self.local.invalidate(key)
+        caches['default'].delete_many(keys)
+
+    def stats(self):
+        lookups = self.local_hits + self.shared_hits + self.misses
+        with self.__lock:
+            local_size = len(self.local)
+        return dict(
+            local_hits=self.local_hits,
+            shared_hits=self.shared_hits,
+            misses=self.misses,
+            hit_rate=(self.local_hits + self.shared_hits) / lookups if lookups else 0.0,
+            local_size=local_size
+        )
+
+
+def load_endpoint(uid: str):
+    row = Endpoint.objects.filter(uid=uid).values(
+        'uid', 'url', 'wallet_id', 'wallet__uid', 'owner_id', 'owner__username'
+    ).first()
+    if row is None:
+        return None
+    return dict(
+        uid=row['uid'],
+        wallet_id=row['wallet_id'],
+        agent_name=row['wallet__uid'],
+        owner_id=row['owner_id'],
+        my_label=row['owner__username'],
+        my_endpoint=row['url']
+    )
+
+
+def resolve_endpoint(uid: str):
+    """Endpoint with wallet uid and owner label loaded by single query
+
+    Return: dict(uid, wallet_id, agent_name, owner_id, my_label, my_endpoint) or None
+    """
+    return Resolver.instance().resolve(ENDPOINT_KEY % uid, lambda: load_endpoint(uid))
+
+
+def resolve_local_endpoint(uid: str):
+    """Endpoint if it is cached in process, database is not touched, so it may be called from event loop"""
+    return Resolver.instance().get_local(ENDPOINT_KEY % uid)
+
+
+def resolver_stats():
+    return Resolver.instance().stats()
+
+
+@receiver([post_save, post_delete], sender=Endpoint)
+def invalidate_endpoint(sender, instance, **kwargs):
+    Resolver.instance().invalidate(ENDPOINT_KEY % instance.uid)
+
+
+@receiver(post_save, sender=Wallet)
+def invalidate_wallet(sender, instance, **kwargs):
+    # Endpoints hold wallet uid, deleted wallet endpoints are invalidated by cascade
+    keys = [ENDPOINT_KEY % uid for uid in Endpoint.objects.filter(wallet=instance).values_list('uid', flat=True)]
+    if keys:
+        Resolver.instance().invalidate(*keys)
@@ -20,6 +20,9 @@ from core.base import ReadOnlyChannel, WriteOnlyChannel, ReadWriteTimeoutError,
 from core.utils import extract_pass_phrase
 from core.wallet import AgentTimeOutError, WalletOperationError
 from core.sync2async import run_async
+from core.inbound import InboundRouter
+from transport.resolver import resolve_endpoint
+from core import inbox
 from core.aries_rfcs.features.feature_0023_did_exchange.feature import DIDExchange as DIDExchangeFeature
 from core.aries_rfcs.features.feature_0023_did_exchange.errors import \
     BadInviteException as DIDExchangeBadInviteException
@@ -34,6 +37,13 @@ from .utils import *
 from .models import Endpoint, Invitation
 
 
+# Unqualified types (DIDExchange problem report) are not bound to family, they fall back to DIDExchange
+INBOUND_ROUTER = InboundRouter(
+    [IssueCredentialProtocol, PresentProofProtocol, ConnectionProtocol, DIDExchangeFeature],
+    fallback=DIDExchangeFeature
+)
+
+
 async def read_from_channel(name: str, timeout: int):
     chan = await ReadOnlyChannel.create(name)
     try:
@@ -337,51 +347,75 @@ class InvitationViewSet(NestedViewSetMixin,
             raise exceptions.NotFound()
 
 
+async def receive_wired_message(
+        agent_name: str, my_label: str, my_endpoint: str, content_type: str, body: bytes
+) -> int:
+    """Process message posted to agent endpoint: wire messages are dispatched to features,
+    unprocessed messages are forwarded to wallet wired messages channel
+
+    Return: HTTP status code
+    """
+    processed = False
+    if content_type in WIRED_CONTENT_TYPES:
+        try:
+            processed = await INBOUND_ROUTER.route(
+                agent_name=agent_name,
+                wire_message=body,
+                my_label=my_label,
+                my_endpoint=my_endpoint
+            )
+        except AgentTimeOutError:
+            return status.HTTP_410_GONE
+        if processed:
+            return status.HTTP_202_ACCEPTED
+    count = await write_to_channel(
+        name=make_wallet_wired_messages_channel_name(agent_name),
+        data=dict(
+            content_type=content_type,
+            transport=json.loads(body.decode('utf-8'))
+        )
+    )
+    if count > 0:
+        return status.HTTP_202_ACCEPTED
+    else:
+        return status.HTTP_410_GONE
+
+
+async def accept_wired_message(
+        agent_name: str, my_label: str, my_endpoint: str, content_type: str, body: bytes
+) -> int:
+    """Append message to wallet inbox if inbox is enabled, otherwise process it at once
+
+    Return: HTTP status code
+    """
+    if inbox.is_enabled():
+        if await inbox.enqueue(agent_name, my_label, my_endpoint, content_type, body):
+            return status.HTTP_202_ACCEPTED
+    return await receive_wired_message(agent_name, my_label, my_endpoint, content_type, body)
+
+
 @api_view(http_method_names=['POST'])
 def endpoint(request, uid):
-    instance = Endpoint.objects.filter(uid=uid).first()
+    instance = resolve_endpoint(uid)
     response_timeout = settings.INDY['WALLET_SETTINGS']['TIMEOUTS']['AGENT_REQUEST']
     if instance:
         print('============= Endpoint triggered ==================')
         print('Content-Type: ' + request.content_type)
-        print('endpoint uid: ' + instance.uid)
-        print('endpoint url: ' + instance.url)
+        print('endpoint uid: ' + instance['uid'])
+        print('endpoint url: ' + instance['my_endpoint'])
         if request.content_type not in WIRED_CONTENT_TYPES + JSON_CONTENT_TYPES:
             return Response(status=status.HTTP_406_NOT_ACCEPTABLE)
-        processed = False
-        if request.content_type in WIRED_CONTENT_TYPES:
-            try:
-                for feature in [IssueCredentialProtocol, PresentProofProtocol, ConnectionProtocol, DIDExchangeFeature]:
-                    success = run_async(
-                        feature.handle(
-                            agent_name=instance.wallet.uid,
-                            wire_message=request.body,
-                            my_label=instance.owner.username,
-                            my_endpoint=instance.url
-                        ),
-                        timeout=response_timeout
-                    )
-                    processed = processed or success
-                    if success:
-                        print('Catched by protocol: ' + feature.__class__.__name__)
-            except AgentTimeOutError:
-                return Response(status=status.HTTP_410_GONE)
-            if processed:
-                return Response(status=status.HTTP_202_ACCEPTED)
-        if not processed:
-            count = run_async(
-                write_to_channel(
-                    name=make_wallet_wired_messages_channel_name(instance.wallet.uid),
-                    data=dict(
-                        content_type=request.content_type,
-                        transport=json.loads(request.body.decode('utf-8'))
-                    )
-                )
-            )
-            if count > 0:
-                return Response(status=status.HTTP_202_ACCEPTED)
-            else:
-                return Response(status=status.HTTP_410_GONE)
-        print('====================================================')
+        status_code = run_async(
+            accept_wired_message(
+                agent_name=instance['agent_name'],
+                my_label=instance['my_label'],
+                my_endpoint=instance['my_endpoint'],
+                content_type=request.content_type,
+                body=request.body
+            ),
+            timeout=response_timeout,
+            shard_key=instance['agent_name']
+        )
+        return Response(status=status_code)
     else:
         return HttpResponse(status=status.HTTP_404_NOT_FOUND)